@@ -0,0 +1,221 @@
+"""asyncio against the selectors backend at high connection counts.
+
+Each backend serves from a process of its own; client processes keep a few
+pipelined GETs in flight on every connection and count the responses.
+Besides requests per second, the server's CPU time per request is taken
+from /proc: with one CPU shared by server and clients it is the figure
+that shows the per-event overhead.
+
+    python -m benchmarks.backends [seconds] [connections ...]
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import selectors
+import socket
+import sys
+import time
+
+from http2 import aio
+from http2 import hpack
+from http2 import limits
+from http2 import selector
+from http2 import server
+from http2 import timers
+
+CLIENT_PROCESSES = max(1, (os.cpu_count() or 2) // 2)
+CONNECTIONS = (100, 1000, 5000)
+# Requests in flight per connection
+BATCH = 4
+# Seconds of load before measuring
+WARMUP = 0.5
+FRAME_LIMITS = limits.FrameLimits(rates={})
+# SETTINGS are acknowledged once every connection is open, which takes a while
+TIMEOUTS = timers.Timeouts(settings_ack=None)
+
+BLOCK = hpack.encode(
+    [
+        (":method", "GET"),
+        (":scheme", "http"),
+        (":path", "/"),
+        (":authority", "localhost"),
+    ]
+)
+
+
+def frame(type_: int, flags: int, stream_id: int, payload: bytes) -> bytes:
+    return (
+        len(payload).to_bytes(3, "big")
+        + bytes([type_, flags])
+        + stream_id.to_bytes(4, "big")
+        + payload
+    )
+
+
+SETTINGS_ACK = frame(0x4, 0x1, 0, b"")
+
+
+def serve(backend: str, sock: socket.socket) -> None:
+    """Server process, runs until terminated."""
+    sys.stdout = open(os.devnull, "w")
+    if backend == "selectors":
+        srv = selector.Server(
+            sock, server.handle_client, frame_limits=FRAME_LIMITS, timeouts=TIMEOUTS
+        )
+        srv.start()
+        srv.run()
+        return
+
+    async def run():
+        srv = aio.Server(
+            sock, server.handle_client, frame_limits=FRAME_LIMITS, timeouts=TIMEOUTS
+        )
+        await srv.start()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+class Connection:
+    __slots__ = ("sock", "stream_id", "buffer", "outstanding")
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.stream_id = 1
+        self.buffer = bytearray()
+        self.outstanding = 0
+
+    def send_batch(self) -> None:
+        stream_id = self.stream_id
+        self.sock.send(
+            b"".join(frame(0x1, 0x5, stream_id + 2 * i, BLOCK) for i in range(BATCH))
+        )
+        self.stream_id = stream_id + 2 * BATCH
+        self.outstanding = BATCH
+
+    def received(self, data: bytes) -> int:
+        """Parse what arrived, return the responses completed."""
+        buffer = self.buffer
+        buffer += data
+        responses = 0
+        offset = 0
+        while len(buffer) - offset >= 9:
+            length = int.from_bytes(buffer[offset : offset + 3], "big")
+            end = offset + 9 + length
+            if len(buffer) < end:
+                break
+            type_ = buffer[offset + 3]
+            flags = buffer[offset + 4]
+            if type_ == 0x1 and flags & 0x1:
+                responses += 1
+            elif type_ == 0x4 and not flags & 0x1:
+                self.sock.send(SETTINGS_ACK)
+            offset = end
+        del buffer[:offset]
+        self.outstanding -= responses
+        return responses
+
+
+def load(
+    port: int, connections: int, seconds: float, server_pid: int | None
+) -> tuple[int, float, float]:
+    """Client process: BATCH GETs in flight per connection.
+
+    Returns the responses, the seconds they took and, given ``server_pid``,
+    the server's CPU time meanwhile; connecting and a warm-up are excluded.
+    """
+    sel = selectors.DefaultSelector()
+    conns = []
+    for _ in range(connections):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(server.CLIENT_PREFACE_PRI + frame(0x4, 0, 0, b""))
+        sock.setblocking(False)
+        conn = Connection(sock)
+        sel.register(sock, selectors.EVENT_READ, conn)
+        conns.append(conn)
+    for conn in conns:
+        conn.send_batch()
+    done = 0
+    start = time.perf_counter()
+    cpu = 0.0
+    warmup = time.monotonic() + WARMUP
+    deadline = warmup + seconds
+    while (now := time.monotonic()) < deadline:
+        if warmup and now >= warmup:
+            warmup = 0.0
+            done = 0
+            start = time.perf_counter()
+            if server_pid is not None:
+                cpu = cpu_seconds(server_pid)
+        for key, _ in sel.select(0.1):
+            conn = key.data
+            try:
+                data = conn.sock.recv(65536)
+            except BlockingIOError:
+                continue
+            if not data:
+                raise ConnectionError("server closed a connection")
+            done += conn.received(data)
+            if not conn.outstanding:
+                conn.send_batch()
+    elapsed = time.perf_counter() - start
+    if server_pid is not None:
+        cpu = cpu_seconds(server_pid) - cpu
+    for conn in conns:
+        conn.sock.close()
+    sel.close()
+    return done, elapsed, cpu
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        # After the command in parentheses, utime and stime are fields 14, 15
+        fields = f.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def run(backend: str, connections: int, seconds: float) -> tuple[float, float]:
+    """Requests per second and server CPU microseconds per request."""
+    context = multiprocessing.get_context("fork")
+    sock = socket.create_server(("127.0.0.1", 0), backlog=4096)
+    port = sock.getsockname()[1]
+    process = context.Process(target=serve, args=(backend, sock))
+    process.start()
+    sock.close()
+    per_client = [connections // CLIENT_PROCESSES] * CLIENT_PROCESSES
+    per_client[0] += connections % CLIENT_PROCESSES
+    # The first client takes the server's CPU time, over its own window
+    pids = [process.pid] + [None] * (CLIENT_PROCESSES - 1)
+    with context.Pool(CLIENT_PROCESSES) as pool:
+        results = pool.starmap(
+            load, [(port, n, seconds, pid) for n, pid in zip(per_client, pids)]
+        )
+    process.terminate()
+    process.join()
+    done, elapsed, cpu = results[0]
+    rate = sum(n / t for n, t, _ in results)
+    return rate, cpu / done * 1e6
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    counts = [int(arg) for arg in sys.argv[2:]] or CONNECTIONS
+    print(
+        f"{os.cpu_count()} CPUs, {CLIENT_PROCESSES} client processes, {BATCH} in flight"
+    )
+    for connections in counts:
+        for backend in ("asyncio", "selectors"):
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                rate, cpu = run(backend, connections, seconds)
+            print(
+                f"{connections:>6} connections {backend:>9}: {rate:9.0f} req/s"
+                f" {cpu:7.1f} us server CPU/request",
+                file=sys.__stdout__,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Replay a capture through the frame processing path, without sockets.
+
+With a file recorded by ``python -m http2.server --capture FILE`` replays
+it; without one, first records some synthetic traffic (with cookies and
+authorization headers, redacted in the file) through a live server.
+
+    python -m benchmarks.capture_replay [FILE] [--pace] [--repeat N]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import os
+import socket
+import sys
+import tempfile
+import threading
+
+from http2 import aio
+from http2 import capture
+from http2 import hpack
+from http2 import limits
+from http2 import metrics
+from http2 import models
+from http2 import server
+
+# Captured traffic already passed the rate limits at its own pace
+FRAME_LIMITS = limits.FrameLimits(rates={})
+CONNECTIONS = 20
+REQUESTS = 200
+
+
+def frame(type_: int, flags: int, stream_id: int, payload: bytes) -> bytes:
+    return (
+        len(payload).to_bytes(3, "big")
+        + bytes([type_, flags])
+        + stream_id.to_bytes(4, "big")
+        + payload
+    )
+
+
+def request(stream_id: int) -> bytes:
+    block = hpack.encode(
+        [
+            (":method", "GET"),
+            (":scheme", "https"),
+            (":path", f"/static/{stream_id}.js"),
+            (":authority", "www.example.com"),
+            ("user-agent", "Mozilla/5.0 (X11; Linux x86_64)"),
+            ("accept", "*/*"),
+            ("cookie", f"session={os.urandom(16).hex()}"),
+            ("authorization", "Bearer " + os.urandom(24).hex()),
+        ]
+    )
+    return frame(0x1, 0x5, stream_id, block)
+
+
+def load(port: int) -> None:
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(server.CLIENT_PREFACE_PRI + frame(0x4, 0, 0, b""))
+    for i in range(0, REQUESTS, 20):
+        sock.sendall(b"".join(request(2 * j + 1) for j in range(i, i + 20)))
+        responses = 0
+        buffer = b""
+        while responses < 20:
+            buffer += sock.recv(65536)
+            while len(buffer) >= 9:
+                length = int.from_bytes(buffer[:3], "big")
+                if len(buffer) < 9 + length:
+                    break
+                if buffer[3] == 0x1 and buffer[4] & 0x1:
+                    responses += 1
+                elif buffer[3] == 0x4 and not buffer[4] & 0x1:
+                    sock.sendall(frame(0x4, 0x1, 0, b""))
+                buffer = buffer[9 + length :]
+    sock.close()
+
+
+def record(path: str) -> None:
+    async def run():
+        sock = socket.create_server(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        recording = capture.Capture(path)
+        srv = aio.Server(
+            sock, server.handle_client, frame_limits=FRAME_LIMITS, capture=recording
+        )
+        await srv.start()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(None, load, port) for _ in range(CONNECTIONS))
+        )
+        await srv.shutdown(1.0)
+        recording.close()
+
+    thread = threading.Thread(target=asyncio.run, args=(run(),))
+    thread.start()
+    thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", nargs="?")
+    parser.add_argument("--pace", action="store_true", help="at the recorded pace")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        devnull = stack.enter_context(open(os.devnull, "w"))
+        stack.enter_context(contextlib.redirect_stdout(devnull))
+        path = args.file
+        if path is None:
+            directory = stack.enter_context(tempfile.TemporaryDirectory())
+            path = os.path.join(directory, "synthetic.h2cap")
+            record(path)
+            with open(path, "rb") as f:
+                assert b"Bearer" not in f.read(), "authorization not redacted"
+            print(
+                f"Recorded {os.path.getsize(path)} bytes to replay",
+                file=sys.__stdout__,
+            )
+        records = list(capture.read(path))
+
+        for _ in range(args.repeat):
+            streams = metrics.METRICS.streams_total
+            stats = capture.replay(
+                records,
+                server.handle_client,
+                make_client=lambda: models.Client(frame_limits=FRAME_LIMITS),
+                pace=args.pace,
+            )
+            requests = metrics.METRICS.streams_total - streams
+            print(
+                f"{stats.connections} connections {stats.reads} reads"
+                f" {stats.bytes_in / 1e6:.2f} MB in {stats.seconds:.3f}s:"
+                f" {requests / stats.seconds:10.0f} streams/s"
+                f" {stats.bytes_in / stats.seconds / 1e6:8.1f} MB/s",
+                file=sys.__stdout__,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""gRPC messages per second over loopback, unary and bidirectional streaming.
+
+Serves an echo service from the asyncio backend on one thread and drives it
+from a minimal h2 client on another, for small and large payloads.
+
+    python -m benchmarks.grpc_messages [messages]
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+import socket
+import sys
+import threading
+import time
+
+from http2 import aio
+from http2 import frames
+from http2 import grpc
+from http2 import hpack
+from http2 import limits
+from http2 import models
+from http2 import server
+
+MAX_WINDOW = 2**31 - 1
+# Unary calls in flight at once
+CONCURRENCY = 64
+# A new stream per unary call is well above the default HEADERS rate limit
+FRAME_LIMITS = limits.FrameLimits(rates={})
+
+router = grpc.Router()
+
+
+@router.unary("/bench.Echo/Unary")
+def unary(call: grpc.Call, request: memoryview | bytes) -> memoryview | bytes:
+    return request
+
+
+@router.stream("/bench.Echo/Stream")
+async def stream(call: grpc.Call) -> None:
+    async for message in call:
+        await call.send(message)
+
+
+def serve(sock: socket.socket, ready: threading.Event):
+    async def run():
+        srv = aio.Server(
+            sock, server.handle_client, frame_limits=FRAME_LIMITS, handler=router
+        )
+        await srv.start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def request_headers(path: str) -> bytes:
+    return hpack.encode(
+        [
+            (":method", "POST"),
+            (":scheme", "http"),
+            (":path", path),
+            (":authority", "localhost"),
+            ("content-type", "application/grpc"),
+            ("te", "trailers"),
+        ]
+    )
+
+
+class Call:
+    def __init__(self, expected: int):
+        self.parser = grpc.MessageParser(max_size=MAX_WINDOW)
+        self.expected = expected
+        self.received = 0
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class Client(asyncio.Protocol):
+    """Just enough of an h2 client: sends respecting flow control, counts replies."""
+
+    def __init__(self):
+        self.transport: asyncio.Transport | None = None
+        self.buffer = b""
+        self.next_stream_id = 1
+        self.calls: dict[int, Call] = {}
+        self.window = frames.CONNECTION_WINDOW_SIZE
+        self.stream_windows: dict[int, int] = {}
+        # stream id -> [data, offset, end_stream] waiting for flow-control credit
+        self.pending: dict[int, list] = {}
+        self.unacknowledged = 0
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        settings = frames.generate_settings_frame(
+            models.Settings(initial_window_size=MAX_WINDOW)
+        )
+        transport.write(
+            server.CLIENT_PREFACE_PRI
+            + settings
+            + frames.generate_window_update(0, MAX_WINDOW - self.window)
+        )
+
+    def start(self, path: str, messages: list[bytes], expected: int) -> Call:
+        assert self.transport is not None
+        stream_id = self.next_stream_id
+        self.next_stream_id += 2
+        call = Call(expected)
+        self.calls[stream_id] = call
+        self.stream_windows[stream_id] = frames.CONNECTION_WINDOW_SIZE
+        block = request_headers(path)
+        self.transport.write(frames.generate_headers(stream_id, block, False))
+        data = b"".join(grpc.encode_message(message, None) for message in messages)
+        self.pending[stream_id] = [memoryview(data), 0, True]
+        self.flush(stream_id)
+        return call
+
+    def flush(self, stream_id: int) -> None:
+        assert self.transport is not None
+        data, offset, end = self.pending[stream_id]
+        out = []
+        while offset < len(data) and self.window > 0:
+            size = min(
+                len(data) - offset, self.window, self.stream_windows[stream_id], 16_384
+            )
+            if size <= 0:
+                break
+            last = end and offset + size == len(data)
+            out.append(
+                frames.generate_data(stream_id, data[offset : offset + size], last)
+            )
+            offset += size
+            self.window -= size
+            self.stream_windows[stream_id] -= size
+        if offset < len(data):
+            self.pending[stream_id][1] = offset
+        else:
+            del self.pending[stream_id]
+        self.transport.write(b"".join(out))
+
+    def data_received(self, data: bytes) -> None:
+        assert self.transport is not None
+        self.buffer += data
+        batch, consumed, _ = server.extract_frames(self.buffer, MAX_WINDOW)
+        buffer = memoryview(self.buffer)
+        for header in batch:
+            payload = buffer[header.offset : header.offset + header.length]
+            if header.type == 0x4 and not header.flags & 0x1:
+                self.transport.write(frames.generate_empty_settings_frame(ack=True))
+            elif header.type == 0x8:
+                incr = int.from_bytes(payload, "big") & 0x7FFFFFFF
+                if header.stream_id == 0:
+                    self.window += incr
+                    for stream_id in list(self.pending):
+                        self.flush(stream_id)
+                elif header.stream_id in self.pending:
+                    self.stream_windows[header.stream_id] += incr
+                    self.flush(header.stream_id)
+            elif header.type == 0x0:
+                call = self.calls[header.stream_id]
+                call.received += len(call.parser.feed(payload))
+                self.unacknowledged += header.length
+            elif header.type == 0x1 and header.flags & 0x1:
+                # Trailers
+                call = self.calls.pop(header.stream_id)
+                self.stream_windows.pop(header.stream_id, None)
+                call.done.set_result(call.received)
+            elif header.type == 0x7:
+                raise ConnectionError(f"GOAWAY {bytes(payload[4:8]).hex()}")
+            elif header.type == 0x3:
+                self.calls.pop(header.stream_id).done.set_exception(
+                    ConnectionError("stream reset")
+                )
+        self.buffer = self.buffer[consumed:]
+        if self.unacknowledged > MAX_WINDOW // 2:
+            self.transport.write(frames.generate_window_update(0, self.unacknowledged))
+            self.unacknowledged = 0
+
+
+async def run_unary(client: Client, payload: bytes, count: int) -> float:
+    start = time.perf_counter()
+    remaining = count
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            call = client.start("/bench.Echo/Unary", [payload], 1)
+            assert await call.done == 1
+
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return count / (time.perf_counter() - start)
+
+
+async def run_stream(client: Client, payload: bytes, count: int) -> float:
+    start = time.perf_counter()
+    call = client.start("/bench.Echo/Stream", [payload] * count, count)
+    assert await call.done == count
+    return count / (time.perf_counter() - start)
+
+
+async def run(port: int, count: int) -> None:
+    loop = asyncio.get_running_loop()
+    _, client = await loop.create_connection(Client, "127.0.0.1", port)
+    for name, size, n in (
+        ("small", 16, count),
+        ("large", 256 * 1024, max(1, count // 100)),
+    ):
+        payload = os.urandom(size)
+        for mode, bench in (("unary", run_unary), ("stream", run_stream)):
+            rate = await bench(client, payload, n)
+            print(
+                f"{mode:>6} {name:>5} ({size:>6} B): {rate:10.1f} messages/s"
+                f" {rate * size / 1e6:8.1f} MB/s",
+                file=sys.__stdout__,
+            )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    sock = socket.create_server(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    ready = threading.Event()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        threading.Thread(target=serve, args=(sock, ready), daemon=True).start()
+        ready.wait()
+        asyncio.run(run(port, count))
+
+
+if __name__ == "__main__":
+    main()
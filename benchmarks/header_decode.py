@@ -0,0 +1,89 @@
+"""Header block decode time and retained memory for a browser-like request.
+
+Compares reading only the pseudo-headers (what routing needs) with reading
+every field, which is what eager decoding cost on every request.
+
+    python -m benchmarks.header_decode [iterations]
+"""
+from __future__ import annotations
+
+import contextlib
+import io
+import sys
+import time
+import tracemalloc
+
+from http2 import hpack
+
+# Every field is a literal without indexing so each iteration decodes the
+# same work regardless of dynamic table state.
+BLOCK = hpack.encode(
+    [
+        (":method", "GET"),
+        (":scheme", "https"),
+        (":path", "/static/app.js?v=1234"),
+        (":authority", "www.example.com"),
+        ("sec-ch-ua", '"Chromium";v="124", "Google Chrome";v="124"'),
+        ("sec-ch-ua-mobile", "?0"),
+        ("sec-ch-ua-platform", '"Linux"'),
+        (
+            "user-agent",
+            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+            "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+        ),
+        ("accept", "*/*"),
+        ("sec-fetch-site", "same-origin"),
+        ("sec-fetch-mode", "no-cors"),
+        ("sec-fetch-dest", "script"),
+        ("referer", "https://www.example.com/"),
+        ("accept-encoding", "gzip, deflate, br, zstd"),
+        ("accept-language", "en-US,en;q=0.9"),
+        ("cookie", "session=" + "x" * 600 + "; _ga=GA1.1.1234567890.1700000000"),
+    ]
+)
+
+
+def decode(decoder: hpack.HPack) -> hpack.HeaderList:
+    success, headers = decoder.decode(memoryview(BLOCK))
+    assert success, headers
+    return headers
+
+
+def run(name: str, read_all: bool, iterations: int) -> None:
+    with contextlib.redirect_stdout(io.StringIO()):
+        decoder = hpack.HPack(max_table_size=4_096)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        headers = decode(decoder)
+        headers.method, headers.path
+        if read_all:
+            list(headers)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    kept = []
+    for _ in range(1_000):
+        headers = decode(decoder)
+        headers.method, headers.path
+        if read_all:
+            list(headers)
+        kept.append(headers)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{name:>10}: {elapsed / iterations * 1e6:7.2f} us/request"
+        f" {size / len(kept):8.0f} B/request retained"
+    )
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    print(f"block: {len(BLOCK)} bytes")
+    run("pseudo", read_all=False, iterations=iterations)
+    run("all", read_all=True, iterations=iterations)
+
+
+if __name__ == "__main__":
+    main()
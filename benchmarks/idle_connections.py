@@ -0,0 +1,63 @@
+"""RSS per idle connection.
+
+Builds N connections worth of ``models.Client`` state, each having completed
+the preface, the SETTINGS exchange and one request, then reports the resident
+set size growth per connection. Sockets are not opened: the kernel side of a
+TCP connection is not what this measures.
+
+    python -m benchmarks.idle_connections 10000 100000
+"""
+from __future__ import annotations
+
+import contextlib
+import gc
+import io
+import os
+import sys
+
+from http2 import models
+from http2 import server
+
+
+def rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def frame(type_: int, flags: int, stream_id: int, payload: bytes) -> bytes:
+    res = len(payload).to_bytes(3, "big") + bytes([type_, flags])
+    return res + stream_id.to_bytes(4, "big") + payload
+
+
+HANDSHAKE = (
+    server.CLIENT_PREFACE_PRI
+    + frame(0x4, 0, 0, b"")
+    # GET / http with literal :authority (not indexed)
+    + frame(0x1, 0x1 | 0x4, 1, b"\x82\x84\x86\x01\x09localhost")
+)
+
+
+def run(count: int) -> None:
+    clients = []
+    gc.collect()
+    before = rss()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(count):
+            client = models.Client()
+            client.rest_data = HANDSHAKE
+            server.handle_client(client)
+            client.send_data = bytearray()
+            models.shed_idle_state(client)
+            clients.append(client)
+    gc.collect()
+    after = rss()
+    print(f"{count:>7} idle connections: {(after - before) / count:8.1f} B/conn")
+
+
+def main():
+    for arg in sys.argv[1:] or ["10000", "100000"]:
+        run(int(arg))
+
+
+if __name__ == "__main__":
+    main()
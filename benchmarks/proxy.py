@@ -0,0 +1,259 @@
+"""Requests and bodies through the reverse proxy, against the origin directly.
+
+An origin server and a proxy in front of it (http2.proxy, with the default
+65,535 byte windows on both hops) each run an asyncio backend on a thread
+of their own; a minimal h2 client talks to either. Large bodies are larger
+than every initial window, so they only get through with flow control
+bridged end to end, and each one is compared with what was sent.
+
+    python -m benchmarks.proxy [requests]
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from http2 import aio
+from http2 import frames
+from http2 import handlers
+from http2 import hpack
+from http2 import limits
+from http2 import models
+from http2 import proxy
+from http2 import server
+from http2 import upstream
+
+MAX_WINDOW = 2**31 - 1
+FRAME_LIMITS = limits.FrameLimits(rates={})
+CONCURRENCY = 10
+LARGE = 4 * 1024 * 1024
+LARGE_BODY = os.urandom(LARGE)
+
+
+async def origin(client: models.Client, stream: models.Stream) -> None:
+    """POST echoes the request body, GET /large sends LARGE_BODY."""
+    assert stream.headers is not None
+    if stream.body is not None:
+        handlers.respond_headers(client, stream, 200)
+        async for chunk in stream.body:
+            frames.send_data(client, stream, chunk, end_stream=False)
+            await handlers.drain(stream)
+        frames.send_data(client, stream, b"", end_stream=True)
+    elif stream.headers.path == "/large":
+        handlers.respond(client, stream, 200, body=LARGE_BODY)
+    else:
+        handlers.respond(client, stream, 200, body=b"ok")
+
+
+def serve(
+    sock: socket.socket, ready: threading.Event, upstream_port: int | None = None
+):
+    async def run():
+        handler = origin
+        if upstream_port is not None:
+            # Pools belong to the loop they were created on
+            handler = proxy.Proxy(upstream.UpstreamPool("127.0.0.1", upstream_port))
+        srv = aio.Server(
+            sock, server.handle_client, frame_limits=FRAME_LIMITS, handler=handler
+        )
+        await srv.start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def request_headers(method: str, path: str) -> bytes:
+    return hpack.encode(
+        [
+            (":method", method),
+            (":scheme", "http"),
+            (":path", path),
+            (":authority", "localhost"),
+        ]
+    )
+
+
+class Response:
+    def __init__(self):
+        self.body = bytearray()
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class Client(asyncio.Protocol):
+    """Just enough of an h2 client: sends respecting flow control, keeps bodies."""
+
+    def __init__(self):
+        self.transport: asyncio.Transport | None = None
+        self.buffer = b""
+        self.next_stream_id = 1
+        self.responses: dict[int, Response] = {}
+        self.window = frames.CONNECTION_WINDOW_SIZE
+        self.initial_window = models.DEFAULT_SETTINGS.initial_window_size
+        self.stream_windows: dict[int, int] = {}
+        # stream id -> [data, offset] waiting for flow-control credit
+        self.pending: dict[int, list] = {}
+        self.unacknowledged = 0
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        settings = frames.generate_settings_frame(
+            models.Settings(initial_window_size=MAX_WINDOW)
+        )
+        transport.write(
+            server.CLIENT_PREFACE_PRI
+            + settings
+            + frames.generate_window_update(0, MAX_WINDOW - self.window)
+        )
+
+    def request(self, path: str, body: bytes | None = None) -> Response:
+        assert self.transport is not None
+        stream_id = self.next_stream_id
+        self.next_stream_id += 2
+        response = self.responses[stream_id] = Response()
+        block = request_headers("GET" if body is None else "POST", path)
+        self.transport.write(frames.generate_headers(stream_id, block, body is None))
+        if body is not None:
+            self.stream_windows[stream_id] = self.initial_window
+            self.pending[stream_id] = [memoryview(body), 0]
+            self.flush(stream_id)
+        return response
+
+    def flush(self, stream_id: int) -> None:
+        assert self.transport is not None
+        data, offset = self.pending[stream_id]
+        out = []
+        while offset < len(data):
+            size = min(
+                len(data) - offset, self.window, self.stream_windows[stream_id], 16_384
+            )
+            if size <= 0:
+                break
+            last = offset + size == len(data)
+            out.append(
+                frames.generate_data(stream_id, data[offset : offset + size], last)
+            )
+            offset += size
+            self.window -= size
+            self.stream_windows[stream_id] -= size
+        if offset < len(data):
+            self.pending[stream_id][1] = offset
+        else:
+            del self.pending[stream_id]
+            del self.stream_windows[stream_id]
+        self.transport.write(b"".join(out))
+
+    def data_received(self, data: bytes) -> None:
+        assert self.transport is not None
+        self.buffer += data
+        batch, consumed, _ = server.extract_frames(self.buffer, MAX_WINDOW)
+        buffer = memoryview(self.buffer)
+        for header in batch:
+            payload = buffer[header.offset : header.offset + header.length]
+            if header.type == 0x4 and not header.flags & 0x1:
+                for identifier, value in struct.iter_unpack(">HI", payload):
+                    if identifier == 0x4:
+                        self.initial_window = value
+                self.transport.write(frames.generate_empty_settings_frame(ack=True))
+            elif header.type == 0x8:
+                incr = int.from_bytes(payload, "big") & 0x7FFFFFFF
+                if header.stream_id == 0:
+                    self.window += incr
+                    for stream_id in list(self.pending):
+                        self.flush(stream_id)
+                elif header.stream_id in self.pending:
+                    self.stream_windows[header.stream_id] += incr
+                    self.flush(header.stream_id)
+            elif header.type in (0x0, 0x1):
+                response = self.responses[header.stream_id]
+                if header.type == 0x0:
+                    response.body += payload
+                    self.unacknowledged += header.length
+                if header.flags & 0x1:
+                    del self.responses[header.stream_id]
+                    response.done.set_result(bytes(response.body))
+            elif header.type == 0x7:
+                raise ConnectionError(f"GOAWAY {bytes(payload[4:8]).hex()}")
+            elif header.type == 0x3:
+                self.responses.pop(header.stream_id).done.set_exception(
+                    ConnectionError("stream reset")
+                )
+        self.buffer = self.buffer[consumed:]
+        if self.unacknowledged > MAX_WINDOW // 2:
+            self.transport.write(frames.generate_window_update(0, self.unacknowledged))
+            self.unacknowledged = 0
+
+
+async def run_small(client: Client, count: int) -> float:
+    start = time.perf_counter()
+    remaining = count
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            assert await client.request("/").done == b"ok"
+
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return count / (time.perf_counter() - start)
+
+
+async def run_download(client: Client, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        body = await client.request("/large").done
+        assert body == LARGE_BODY, "download corrupted"
+    return count * LARGE / (time.perf_counter() - start) / 1e6
+
+
+async def run_upload(client: Client, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        body = await client.request("/echo", LARGE_BODY).done
+        assert body == LARGE_BODY, "upload corrupted"
+    return count * LARGE / (time.perf_counter() - start) / 1e6
+
+
+async def run(ports: dict[str, int], count: int) -> None:
+    loop = asyncio.get_running_loop()
+    for name, port in ports.items():
+        _, client = await loop.create_connection(Client, "127.0.0.1", port)
+        # SETTINGS first, the initial window of the streams depends on it
+        await asyncio.sleep(0.05)
+        small = await run_small(client, count)
+        large = max(1, count // 500)
+        download = await run_download(client, large)
+        upload = await run_upload(client, large)
+        print(
+            f"{name:>7}: {small:8.0f} req/s,"
+            f" download {download:7.1f} MB/s, upload echo {upload:7.1f} MB/s",
+            file=sys.__stdout__,
+        )
+        assert client.transport is not None
+        client.transport.close()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    origin_sock = socket.create_server(("127.0.0.1", 0))
+    proxy_sock = socket.create_server(("127.0.0.1", 0))
+    origin_port = origin_sock.getsockname()[1]
+    ports = {"direct": origin_port, "proxied": proxy_sock.getsockname()[1]}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for sock, upstream_port in ((origin_sock, None), (proxy_sock, origin_port)):
+            ready = threading.Event()
+            threading.Thread(
+                target=serve, args=(sock, ready, upstream_port), daemon=True
+            ).start()
+            ready.wait()
+        asyncio.run(run(ports, count))
+
+
+if __name__ == "__main__":
+    main()
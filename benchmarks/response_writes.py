@@ -0,0 +1,134 @@
+"""Response write throughput and transient allocation per request.
+
+Feeds pipelined GETs to handle_client without sockets, the way a read from
+the event loop would, and drops what the server queued to send. The peer
+grants all the flow-control credit it can so every response is written
+out in full, or, with a stream window, one window per stream and read.
+
+    python -m benchmarks.response_writes [seconds]
+"""
+from __future__ import annotations
+
+import contextlib
+import functools
+import os
+import sys
+import time
+import tracemalloc
+
+from http2 import frames
+from http2 import handlers
+from http2 import hpack
+from http2 import limits
+from http2 import models
+from http2 import server
+
+MAX_WINDOW = 2**31 - 1
+FRAME_LIMITS = limits.FrameLimits(rates={})
+PIPELINE = 32
+
+HEADERS = [
+    ("content-type", "application/javascript"),
+    ("cache-control", "public, max-age=31536000, immutable"),
+    ("etag", '"5f2b1c-1a2b3c4d"'),
+    ("vary", "accept-encoding"),
+]
+
+
+def respond(body: bytes, client: models.Client, stream: models.Stream) -> None:
+    handlers.respond(client, stream, 200, HEADERS, body)
+
+
+def request_block(stream_id: int) -> bytes:
+    return hpack.encode(
+        [
+            (":method", "GET"),
+            (":scheme", "https"),
+            (":path", f"/static/{stream_id}.js"),
+            (":authority", "www.example.com"),
+        ]
+    )
+
+
+class Connection:
+    def __init__(self, body: bytes | None, window: int = MAX_WINDOW):
+        handler = None if body is None else functools.partial(respond, body)
+        self.client = models.Client(frame_limits=FRAME_LIMITS, handler=handler)
+        self.window = window
+        # read() adds the connection window
+        self.client.rest_data = server.CLIENT_PREFACE_PRI + (
+            frames.generate_settings_frame(models.Settings(initial_window_size=window))
+        )
+        self.stream_id = 1
+        self.read()
+
+    def read(self) -> int:
+        """Process one read of PIPELINE requests, return the bytes queued."""
+        client = self.client
+        data = [client.rest_data]
+        if client.flow_control < MAX_WINDOW:
+            data.append(
+                frames.generate_window_update(0, MAX_WINDOW - client.flow_control)
+            )
+        if self.window < MAX_WINDOW:
+            for stream_id in client.streams:
+                data.append(frames.generate_window_update(stream_id, self.window))
+        for _ in range(PIPELINE):
+            data.append(
+                frames.generate_headers(
+                    self.stream_id, request_block(self.stream_id), True
+                )
+            )
+            self.stream_id += 2
+        client.rest_data = b"".join(data)
+        server.handle_client(client)
+        while client.budget_exhausted:
+            server.handle_client(client)
+        sent = len(client.send_data)
+        client.send_data = bytearray()
+        return sent
+
+
+def run(
+    name: str, body: bytes | None, seconds: float, window: int = MAX_WINDOW
+) -> None:
+    connection = Connection(body, window)
+    reads = 0
+    sent = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < seconds:
+        sent += connection.read()
+        reads += 1
+
+    # Transient memory: the peak above what is still allocated afterwards
+    tracemalloc.start()
+    peaks = []
+    for _ in range(100):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        connection.read()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - current)
+    tracemalloc.stop()
+
+    requests = reads * PIPELINE
+    print(
+        f"{name:>12}: {requests / elapsed:9.0f} requests/s"
+        f" {sent / elapsed / 1e6:8.1f} MB/s"
+        f" {sorted(peaks)[len(peaks) // 2] / PIPELINE / 1024:9.1f} KiB/request peak",
+        file=sys.__stdout__,
+    )
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        run("empty 200", None, seconds)
+        run("1 KiB", os.urandom(1024), seconds)
+        run("64 KiB", os.urandom(64 * 1024), seconds)
+        run("1 MiB", os.urandom(1024 * 1024), seconds)
+        run("1 MiB/64 KiB", os.urandom(1024 * 1024), seconds, window=65_535)
+
+
+if __name__ == "__main__":
+    main()
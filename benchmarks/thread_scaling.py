@@ -0,0 +1,151 @@
+"""Requests per second with 1..N event loop threads in one process.
+
+Each loop accepts from its own SO_REUSEPORT socket on the same port. Load
+comes from separate client processes so it does not compete with the
+server for the GIL. Only a free-threaded build (3.13t and later, GIL
+disabled) is expected to scale past one thread.
+
+    python -m benchmarks.thread_scaling [max_threads] [seconds]
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+from http2 import aio
+from http2 import hpack
+from http2 import limits
+from http2 import server
+
+CLIENT_PROCESSES = max(1, (os.cpu_count() or 2) // 2)
+CONNECTIONS_PER_CLIENT = 8
+# Requests in flight per connection
+BATCH = 32
+
+BLOCK = hpack.encode(
+    [
+        (":method", "GET"),
+        (":scheme", "http"),
+        (":path", "/"),
+        (":authority", "localhost"),
+    ]
+)
+
+
+def frame(type_: int, flags: int, stream_id: int, payload: bytes) -> bytes:
+    return (
+        len(payload).to_bytes(3, "big")
+        + bytes([type_, flags])
+        + stream_id.to_bytes(4, "big")
+        + payload
+    )
+
+
+def load(port: int, seconds: float) -> int:
+    """Client process: pipelined GETs on a few connections, returns responses."""
+    conns = []
+    for _ in range(CONNECTIONS_PER_CLIENT):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(server.CLIENT_PREFACE_PRI + frame(0x4, 0, 0, b""))
+        conns.append([sock, 1, b""])
+    done = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for conn in conns:
+            sock, stream_id, _ = conn
+            requests = b"".join(
+                frame(0x1, 0x5, stream_id + 2 * i, BLOCK) for i in range(BATCH)
+            )
+            conn[1] = stream_id + 2 * BATCH
+            sock.sendall(requests)
+        for conn in conns:
+            sock, _, buffer = conn
+            responses = 0
+            while responses < BATCH:
+                buffer += sock.recv(65536)
+                while len(buffer) >= 9:
+                    length = int.from_bytes(buffer[:3], "big")
+                    if len(buffer) < 9 + length:
+                        break
+                    if buffer[3] == 0x1 and buffer[4] & 0x1:
+                        responses += 1
+                    elif buffer[3] == 0x4 and not buffer[4] & 0x1:
+                        sock.sendall(frame(0x4, 0x1, 0, b""))
+                    buffer = buffer[9 + length :]
+            conn[2] = buffer
+            done += responses
+    for sock, _, _ in conns:
+        sock.close()
+    return done
+
+
+def serve(port: int, ready: threading.Barrier, stops: list, lock: threading.Lock):
+    async def run():
+        sock = socket.create_server(("127.0.0.1", port), reuse_port=True)
+        srv = aio.Server(
+            sock, server.handle_client, frame_limits=limits.FrameLimits(rates={})
+        )
+        await srv.start()
+        stop = asyncio.Event()
+        with lock:
+            stops.append((asyncio.get_running_loop(), stop))
+        ready.wait()
+        await stop.wait()
+        await srv.shutdown(1.0)
+
+    asyncio.run(run())
+
+
+def run(pool, threads: int, seconds: float) -> float:
+    probe = socket.create_server(("127.0.0.1", 0), reuse_port=True)
+    port = probe.getsockname()[1]
+    probe.close()
+
+    stops: list = []
+    lock = threading.Lock()
+    ready = threading.Barrier(threads + 1)
+    workers = [
+        threading.Thread(target=serve, args=(port, ready, stops, lock))
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    ready.wait()
+
+    start = time.perf_counter()
+    done = sum(pool.starmap(load, [(port, seconds)] * CLIENT_PROCESSES))
+    elapsed = time.perf_counter() - start
+
+    for loop, stop in stops:
+        loop.call_soon_threadsafe(stop.set)
+    for worker in workers:
+        worker.join()
+    return done / elapsed
+
+
+def main():
+    max_threads = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(
+        f"Python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'},"
+        f" {os.cpu_count()} CPUs, {CLIENT_PROCESSES} client processes"
+    )
+    # Forked before any server thread exists
+    with multiprocessing.get_context("fork").Pool(CLIENT_PROCESSES) as pool:
+        base = None
+        for threads in range(1, max_threads + 1):
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                rate = run(pool, threads, seconds)
+            base = base or rate
+            print(f"{threads:>3} threads: {rate:10.0f} req/s  x{rate / base:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Full vs resumed TLS handshakes per second against the asyncio backend.
+
+Generates a throwaway certificate with the openssl command line tool, serves
+it on a loopback port and opens connections that negotiate h2, send the
+preface and wait for the server SETTINGS.
+
+    python -m benchmarks.tls_handshakes [connections]
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from http2 import aio
+from http2 import server
+from http2 import tls
+
+SETTINGS = b"\x00\x00\x00\x04\x00\x00\x00\x00\x00"
+
+
+def generate_certificate(directory: str) -> tuple[str, str]:
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "ec",
+            "-pkeyopt",
+            "ec_paramgen_curve:prime256v1",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-keyout",
+            keyfile,
+            "-out",
+            certfile,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def serve(sock: socket.socket, context: ssl.SSLContext, ready: threading.Event):
+    async def run():
+        srv = aio.Server(sock, server.handle_client, ssl_context=context)
+        await srv.start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def connect(
+    context: ssl.SSLContext, port: int, session: ssl.SSLSession | None
+) -> ssl.SSLSocket:
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn = context.wrap_socket(sock, server_hostname="localhost", session=session)
+    assert conn.selected_alpn_protocol() == "h2"
+    conn.sendall(server.CLIENT_PREFACE_PRI + SETTINGS)
+    # Server SETTINGS; TLS 1.3 tickets arrive before it
+    conn.recv(4096)
+    return conn
+
+
+def run(name: str, context: ssl.SSLContext, port: int, count: int, resume: bool):
+    session = None
+    if resume:
+        conn = connect(context, port, None)
+        session = conn.session
+        conn.close()
+
+    reused = 0
+    start = time.perf_counter()
+    for _ in range(count):
+        conn = connect(context, port, session)
+        reused += conn.session_reused
+        if resume:
+            session = conn.session
+        conn.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:>8}: {count / elapsed:8.1f} handshakes/s ({reused}/{count} resumed)",
+        file=sys.__stdout__,
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = generate_certificate(directory)
+        server_context = tls.create_context(certfile, keyfile)
+
+    sock = socket.create_server(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    ready = threading.Event()
+    with contextlib.redirect_stdout(io.StringIO()):
+        threading.Thread(
+            target=serve, args=(sock, server_context, ready), daemon=True
+        ).start()
+        ready.wait()
+
+        for version in (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3):
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            context.set_alpn_protocols(["h2"])
+            context.minimum_version = context.maximum_version = version
+            print(version.name, file=sys.__stdout__)
+            run("full", context, port, count, resume=False)
+            run("resumed", context, port, count, resume=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""WebSocket messages per second, many WebSockets multiplexed on one connection.
+
+Serves an echo WebSocket over HTTP/2 (RFC 8441) from the asyncio backend on
+one thread; a minimal h2 client on another opens the WebSockets on a single
+connection and sends every message masked, as browsers do.
+
+    python -m benchmarks.websocket_messages [messages]
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from http2 import aio
+from http2 import frames
+from http2 import hpack
+from http2 import limits
+from http2 import models
+from http2 import server
+from http2 import websocket
+
+MAX_WINDOW = 2**31 - 1
+FRAME_LIMITS = limits.FrameLimits(rates={})
+SETTINGS = models.Settings(enable_connect_protocol=1, initial_window_size=1 << 20)
+
+router = websocket.Router()
+
+
+@router.route("/echo")
+async def echo(ws: websocket.WebSocket) -> None:
+    async for message in ws:
+        await ws.send(message)
+
+
+def serve(sock: socket.socket, ready: threading.Event):
+    async def run():
+        srv = aio.Server(
+            sock,
+            server.handle_client,
+            local_settings=SETTINGS,
+            frame_limits=FRAME_LIMITS,
+            handler=router,
+        )
+        await srv.start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+CONNECT = hpack.encode(
+    [
+        (":method", "CONNECT"),
+        (":protocol", "websocket"),
+        (":scheme", "http"),
+        (":path", "/echo"),
+        (":authority", "localhost"),
+        ("sec-websocket-version", "13"),
+    ]
+)
+
+
+def client_frame(payload: bytes) -> bytes:
+    """A masked binary frame; the zero key keeps the benchmark about the server."""
+    size = len(payload)
+    if size < 126:
+        header = bytes([0x82, 0x80 | size])
+    elif size < 2**16:
+        header = struct.pack(">BBH", 0x82, 0xFE, size)
+    else:
+        header = struct.pack(">BBQ", 0x82, 0xFF, size)
+    return header + b"\x00\x00\x00\x00" + payload
+
+
+def count_frames(buffer: bytearray) -> int:
+    """Remove complete server frames from ``buffer``, return how many."""
+    count = 0
+    offset = 0
+    while len(buffer) - offset >= 2:
+        size = buffer[offset + 1] & 0x7F
+        start = offset + 2
+        if size == 126:
+            size = int.from_bytes(buffer[start : start + 2], "big")
+            start += 2
+        elif size == 127:
+            size = int.from_bytes(buffer[start : start + 8], "big")
+            start += 8
+        if len(buffer) < start + size:
+            break
+        offset = start + size
+        count += 1
+    del buffer[:offset]
+    return count
+
+
+class Socket:
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.received = 0
+        self.buffer = bytearray()
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class Client(asyncio.Protocol):
+    """Just enough of an h2 client: sends respecting flow control, counts echoes."""
+
+    def __init__(self):
+        self.transport: asyncio.Transport | None = None
+        self.buffer = b""
+        self.next_stream_id = 1
+        self.sockets: dict[int, Socket] = {}
+        self.window = frames.CONNECTION_WINDOW_SIZE
+        self.stream_windows: dict[int, int] = {}
+        self.initial_window = models.DEFAULT_SETTINGS.initial_window_size
+        # stream id -> [data, offset] waiting for flow-control credit
+        self.pending: dict[int, list] = {}
+        self.unacknowledged = 0
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        settings = frames.generate_settings_frame(
+            models.Settings(initial_window_size=MAX_WINDOW)
+        )
+        transport.write(
+            server.CLIENT_PREFACE_PRI
+            + settings
+            + frames.generate_window_update(0, MAX_WINDOW - self.window)
+        )
+
+    def open(self, messages: list[bytes]) -> Socket:
+        assert self.transport is not None
+        stream_id = self.next_stream_id
+        self.next_stream_id += 2
+        ws = self.sockets[stream_id] = Socket(len(messages))
+        self.stream_windows[stream_id] = self.initial_window
+        self.transport.write(frames.generate_headers(stream_id, CONNECT, False))
+        data = b"".join(client_frame(message) for message in messages)
+        self.pending[stream_id] = [memoryview(data), 0]
+        self.flush(stream_id)
+        return ws
+
+    def flush(self, stream_id: int) -> None:
+        assert self.transport is not None
+        data, offset = self.pending[stream_id]
+        out = []
+        while offset < len(data):
+            size = min(
+                len(data) - offset, self.window, self.stream_windows[stream_id], 16_384
+            )
+            if size <= 0:
+                break
+            out.append(
+                frames.generate_data(stream_id, data[offset : offset + size], False)
+            )
+            offset += size
+            self.window -= size
+            self.stream_windows[stream_id] -= size
+        if offset < len(data):
+            self.pending[stream_id][1] = offset
+        else:
+            del self.pending[stream_id]
+        self.transport.write(b"".join(out))
+
+    def data_received(self, data: bytes) -> None:
+        assert self.transport is not None
+        self.buffer += data
+        batch, consumed, _ = server.extract_frames(self.buffer, MAX_WINDOW)
+        buffer = memoryview(self.buffer)
+        for header in batch:
+            payload = buffer[header.offset : header.offset + header.length]
+            if header.type == 0x4 and not header.flags & 0x1:
+                for identifier, value in struct.iter_unpack(">HI", payload):
+                    if identifier == 0x4:
+                        self.initial_window = value
+                self.transport.write(frames.generate_empty_settings_frame(ack=True))
+            elif header.type == 0x8:
+                incr = int.from_bytes(payload, "big") & 0x7FFFFFFF
+                if header.stream_id == 0:
+                    self.window += incr
+                    for stream_id in list(self.pending):
+                        self.flush(stream_id)
+                elif header.stream_id in self.stream_windows:
+                    self.stream_windows[header.stream_id] += incr
+                    if header.stream_id in self.pending:
+                        self.flush(header.stream_id)
+            elif header.type == 0x0:
+                ws = self.sockets[header.stream_id]
+                ws.buffer += payload
+                ws.received += count_frames(ws.buffer)
+                self.unacknowledged += header.length
+                if ws.received == ws.expected and not ws.done.done():
+                    ws.done.set_result(ws.received)
+            elif header.type == 0x7:
+                raise ConnectionError(f"GOAWAY {bytes(payload[4:8]).hex()}")
+            elif header.type == 0x3:
+                self.sockets[header.stream_id].done.set_exception(
+                    ConnectionError("stream reset")
+                )
+        self.buffer = self.buffer[consumed:]
+        if self.unacknowledged > MAX_WINDOW // 2:
+            self.transport.write(frames.generate_window_update(0, self.unacknowledged))
+            self.unacknowledged = 0
+
+
+async def run(port: int, count: int) -> None:
+    loop = asyncio.get_running_loop()
+    for sockets in (1, 10, 100):
+        for size in (16, 16 * 1024):
+            _, client = await loop.create_connection(Client, "127.0.0.1", port)
+            # SETTINGS first, the initial window of the streams depends on it
+            await asyncio.sleep(0.05)
+            payload = os.urandom(size)
+            per_socket = max(
+                1, count // sockets if size < 1024 else count // 20 // sockets
+            )
+            start = time.perf_counter()
+            opened = [client.open([payload] * per_socket) for _ in range(sockets)]
+            await asyncio.gather(*(ws.done for ws in opened))
+            elapsed = time.perf_counter() - start
+            total = per_socket * sockets
+            print(
+                f"{sockets:>4} websockets, {size:>6} B: {total / elapsed:10.0f}"
+                f" messages/s {total * size / elapsed / 1e6:8.1f} MB/s",
+                file=sys.__stdout__,
+            )
+            assert client.transport is not None
+            client.transport.close()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    sock = socket.create_server(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    ready = threading.Event()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        threading.Thread(target=serve, args=(sock, ready), daemon=True).start()
+        ready.wait()
+        asyncio.run(run(port, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import random
+import time
+
+
+@dataclasses.dataclass(kw_only=True, slots=True)
+class AdmissionController:
+    """Sheds new streams while the process has a standing queue.
+
+    Fed with queueing delay samples (how late the event loop runs work that
+    was ready), CoDel style: a short burst above ``target`` is tolerated, but
+    once the delay stays above it for ``interval`` a growing share of new
+    streams is refused. The share decays again when the delay recovers.
+    """
+
+    target: float = 0.005
+    interval: float = 0.1
+    # How fast the shed share moves per interval spent above / below target
+    step: float = 0.1
+    max_shed: float = 0.95
+    # None: RST_STREAM(REFUSED_STREAM), safe for the client to retry.
+    # Otherwise the status sent as the response, e.g. 503.
+    reject_status: int | None = None
+
+    shed_ratio: float = 0.0
+    above_since: float | None = None
+    last_adjust: float = 0.0
+    last_delay: float = 0.0
+    admitted: int = 0
+    shed: int = 0
+
+    def observe(self, delay: float, now: float | None = None) -> None:
+        if now is None:
+            now = time.monotonic()
+        self.last_delay = delay
+        if delay < self.target:
+            self.above_since = None
+            if self.shed_ratio and now - self.last_adjust >= self.interval:
+                self.shed_ratio = max(0.0, self.shed_ratio - self.step)
+                self.last_adjust = now
+            return
+        if self.above_since is None:
+            self.above_since = now
+            return
+        if (
+            now - self.above_since >= self.interval
+            and now - self.last_adjust >= self.interval
+        ):
+            self.shed_ratio = min(self.max_shed, self.shed_ratio + self.step)
+            self.last_adjust = now
+
+    def admit(self) -> bool:
+        if self.shed_ratio and random.random() < self.shed_ratio:
+            self.shed += 1
+            return False
+        self.admitted += 1
+        return True
+
+
+async def sample_loop_delay(
+    controller: AdmissionController, period: float = 0.01
+) -> None:
+    """Feed ``controller`` with how late the running event loop wakes us up."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + period
+        await asyncio.sleep(period)
+        controller.observe(max(0.0, loop.time() - expected))
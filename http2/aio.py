@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import socket
+import ssl
+import time
+from collections.abc import Callable
+from collections.abc import Coroutine
+from typing import Any
+
+from http2 import admission
+from http2 import capture
+from http2 import flow
+from http2 import frames
+from http2 import limits
+from http2 import metrics
+from http2 import models
+from http2 import profiling
+from http2 import timers
+from http2 import tls
+
+HandleClient = Callable[[models.Client], None]
+
+WRITE_PHASE = profiling.phase("write")
+
+
+class ClientProtocol(asyncio.Protocol):
+    def __init__(self, server: Server):
+        self.server = server
+        self.client = models.Client(
+            local_settings=server.local_settings,
+            admission_controller=server.admission_controller,
+            handler=server.handler,
+            frame_limits=server.frame_limits,
+            timeouts=server.timeouts,
+            window_update_policy=server.window_update_policy,
+        )
+        self.client.call_soon_threadsafe = self.call_soon_threadsafe
+        self.client.wakeup = self.wakeup
+        self.client.spawn = self.spawn
+        self.loop = asyncio.get_running_loop()
+        self.transport: asyncio.Transport | None = None
+        self.flush_scheduled = False
+        # The transport's write buffer is above its high-water mark, see
+        # pause_writing
+        self.blocked = False
+        self.idle_timer: timers.Timer | None = None
+        self.frame_timer: timers.Timer | None = None
+        self.settings_timer: timers.Timer | None = None
+        # Coroutine handlers running for this connection's streams
+        self.tasks: set[asyncio.Task] = set()
+        self.capture: capture.ConnectionCapture | None = None
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        print("Client open")
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            # asyncio only does this for sockets created with IPPROTO_TCP,
+            # not for those accepted from socket.create_server; without it
+            # a WINDOW_UPDATE written after another small frame waits for
+            # the peer's delayed ACK
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections.add(self)
+        if self.server.capture is not None:
+            self.capture = self.server.capture.connection(
+                self.client.local_settings.header_table_size
+            )
+        wheel = timers.get_wheel()
+        self.client.timer_wheel = wheel
+        timeouts = self.client.timeouts
+        if timeouts.idle is not None:
+            self.idle_timer = wheel.schedule(timeouts.idle, self.idle_timeout)
+        if timeouts.frame is not None:
+            # The preface is due right away
+            self.frame_timer = wheel.schedule(timeouts.frame, self.frame_timeout)
+        ssl_object = transport.get_extra_info("ssl_object")
+        if ssl_object is not None and not tls.negotiated_h2(ssl_object):
+            # TODO: HTTP/1.1 fallback
+            transport.close()
+            return
+        if self.server.draining:
+            # Accepted right before the listener closed
+            frames.send_goaway(self.client)
+
+    def data_received(self, data: bytes) -> None:
+        client = self.client
+        if client.need_close:
+            return
+        if self.capture is not None:
+            self.capture.feed(data)
+        client.rest_data += data
+        if self.idle_timer is not None:
+            # Only stores the new deadline, cheap enough for every read
+            self.idle_timer.reschedule(client.timeouts.idle)
+        self.process()
+
+    def process(self) -> None:
+        client = self.client
+        assert self.transport is not None
+        if self.transport.is_closing() or self.blocked:
+            return
+        pending = len(client.rest_data)
+        self.server.handle_client(client)
+        self.flush()
+        if client.need_close or self.blocked:
+            return
+        self.update_timers(progress=len(client.rest_data) < pending)
+        if client.budget_exhausted:
+            # Out of CPU budget: stop reading and continue after other
+            # connections had their turn
+            self.transport.pause_reading()
+            asyncio.get_running_loop().call_soon(self.process)
+            return
+        if not self.transport.is_reading():
+            self.transport.resume_reading()
+        if not frames.has_active_streams(client):
+            models.shed_idle_state(client)
+
+    def pause_writing(self) -> None:
+        # A peer that does not read is not served: neither reading nor the
+        # frames already read are processed until the buffer drained
+        self.blocked = True
+        assert self.transport is not None
+        self.transport.pause_reading()
+
+    def resume_writing(self) -> None:
+        self.blocked = False
+        # Frames may be waiting in rest_data, process resumes reading
+        self.loop.call_soon(self.process)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if self.client.rest_data:
+            print("Unhandled data in client steam before close")
+        frames.release_streams(self.client)
+        for task in self.tasks:
+            task.cancel()
+        for timer in (self.idle_timer, self.frame_timer, self.settings_timer):
+            if timer is not None:
+                timer.cancel()
+        if self.capture is not None:
+            self.capture.close()
+        print("Client closed")
+        self.server.connections.discard(self)
+
+    def flush(self) -> None:
+        client = self.client
+        assert self.transport is not None
+        if client.send_data:
+            start = time.perf_counter_ns()
+            self.transport.write(client.send_data)
+            WRITE_PHASE.add(time.perf_counter_ns() - start)
+            # The transport may keep what it could not send yet, not reused
+            client.send_data = bytearray()
+        if client.need_close:
+            print("Need close")
+            self.transport.close()
+        elif client.goaway_sent and not frames.has_active_streams(client):
+            print("Drained")
+            self.transport.close()
+
+    def update_timers(self, progress: bool) -> None:
+        client = self.client
+        timeouts = client.timeouts
+        if self.frame_timer is not None:
+            if not client.rest_data and client.phase:
+                self.frame_timer.cancel()
+            elif progress or not self.frame_timer.active:
+                # A frame started, or the previous one completed
+                self.frame_timer.reschedule(timeouts.frame)
+        if (
+            client.settings_ack_pending
+            and self.settings_timer is None
+            and timeouts.settings_ack is not None
+        ):
+            self.settings_timer = self.client.timer_wheel.schedule(
+                timeouts.settings_ack, self.settings_timeout
+            )
+
+    def idle_timeout(self) -> None:
+        if frames.has_active_streams(self.client):
+            assert self.idle_timer is not None
+            self.idle_timer.reschedule(self.client.timeouts.idle)
+            return
+        print("Idle timeout")
+        frames.send_goaway(self.client)
+        self.flush()
+
+    def frame_timeout(self) -> None:
+        print("Frame timeout, incomplete frame or preface")
+        # PROTOCOL_ERROR
+        frames.send_goaway(self.client, 0x1)
+        self.client.need_close = True
+        self.flush()
+
+    def settings_timeout(self) -> None:
+        if not self.client.settings_ack_pending:
+            return
+        print("SETTINGS not acknowledged in time")
+        # SETTINGS_TIMEOUT
+        frames.send_goaway(self.client, 0x4)
+        self.client.need_close = True
+        self.flush()
+
+    def wakeup(self) -> None:
+        # Once per loop iteration, however many frames were queued
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self.scheduled_flush)
+
+    def scheduled_flush(self) -> None:
+        self.flush_scheduled = False
+        assert self.transport is not None
+        if self.transport.is_closing():
+            return
+        frames.flush_window_updates(self.client)
+        self.flush()
+
+    def spawn(self, stream: models.Stream, coro: Coroutine[Any, Any, None]) -> None:
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(functools.partial(self.handler_done, stream))
+
+    def handler_done(self, stream: models.Stream, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is None:
+            return
+        print("Handler failed", stream.identifier, repr(exc))
+        assert self.transport is not None
+        if (
+            stream.state != models.StreamState.closed
+            and not self.transport.is_closing()
+        ):
+            # INTERNAL_ERROR
+            self.client.send_data += frames.generate_rst_stream(stream.identifier, 0x2)
+            frames.close_stream(self.client, stream)
+            self.flush()
+
+    def call_soon_threadsafe(self, callback: Callable[[], None]) -> None:
+        self.loop.call_soon_threadsafe(self._run, callback)
+
+    def _run(self, callback: Callable[[], None]) -> None:
+        assert self.transport is not None
+        if self.transport.is_closing():
+            return
+        callback()
+        self.flush()
+
+    def goaway(self) -> None:
+        frames.send_goaway(self.client)
+        self.flush()
+
+    def abort(self) -> None:
+        assert self.transport is not None
+        self.transport.abort()
+
+
+class Server:
+    """asyncio backend: serves every accepted connection through ``handle_client``."""
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        handle_client: HandleClient,
+        *,
+        local_settings: models.Settings = models.DEFAULT_SETTINGS,
+        admission_controller: admission.AdmissionController | None = None,
+        ssl_context: ssl.SSLContext | None = None,
+        frame_limits: limits.FrameLimits = limits.DEFAULT_LIMITS,
+        timeouts: timers.Timeouts = timers.DEFAULT_TIMEOUTS,
+        handler: Callable[
+            [models.Client, models.Stream], Coroutine[Any, Any, None] | None
+        ]
+        | None = None,
+        capture: capture.Capture | None = None,
+        window_update_policy: flow.WindowUpdatePolicy = flow.DEFAULT_POLICY,
+    ):
+        self.sock = sock
+        self.handle_client = handle_client
+        self.local_settings = local_settings
+        self.admission_controller = admission_controller
+        self.ssl_context = ssl_context
+        self.frame_limits = frame_limits
+        self.timeouts = timeouts
+        self.handler = handler
+        self.capture = capture
+        self.window_update_policy = window_update_policy
+        self.connections: set[ClientProtocol] = set()
+        self.draining = False
+        self._server: asyncio.Server | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(
+            lambda: ClientProtocol(self), sock=self.sock, ssl=self.ssl_context
+        )
+        if self.admission_controller is not None:
+            task = asyncio.create_task(
+                admission.sample_loop_delay(self.admission_controller)
+            )
+            self._tasks.add(task)
+
+    async def shutdown(self, timeout: float) -> None:
+        """Graceful shutdown.
+
+        Stops accepting, sends GOAWAY with the last processed stream id on every
+        connection, waits up to ``timeout`` seconds for active streams to finish
+        and then drops whatever is left.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        if self._server is not None:
+            self._server.close()
+        print("Draining", len(self.connections), "connections")
+
+        for protocol in list(self.connections):
+            protocol.goaway()
+
+        deadline = time.monotonic() + timeout
+        while self.connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        for protocol in list(self.connections):
+            print("Drain deadline reached, closing client")
+            protocol.abort()
+        for task in self._tasks:
+            task.cancel()
+        if self.admission_controller is not None:
+            print("Admission", self.admission_controller)
+        if self.ssl_context is not None:
+            tls.report(self.ssl_context)
+        metrics.report()
+        print("Server closed")
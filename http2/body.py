@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import tempfile
+from collections.abc import AsyncIterator
+from collections.abc import Callable
+from collections.abc import Iterator
+
+
+class StreamReset(Exception):
+    """The request stream was reset or the connection closed mid-body."""
+
+
+class RequestBody:
+    """Inbound DATA of one stream, delivered as memoryview chunks.
+
+    Chunks are views into the receive buffer, nothing is copied. Flow-control
+    credit for a chunk is handed back (``release``) only when the consumer
+    takes it, so a slow consumer throttles the sender and at most one stream
+    window of data is buffered per request.
+    """
+
+    __slots__ = ("release", "chunks", "complete", "discarding", "error", "waiter")
+
+    def __init__(self, release: Callable[[int], None]):
+        self.release = release
+        self.chunks: collections.deque[memoryview] = collections.deque()
+        self.complete = False
+        # Nobody is going to read the rest, credit it on arrival
+        self.discarding = False
+        self.error: StreamReset | None = None
+        self.waiter: asyncio.Future | None = None
+
+    def feed(self, chunk: memoryview) -> None:
+        if self.discarding:
+            self.release(len(chunk))
+            return
+        if chunk:
+            self.chunks.append(chunk)
+            self._wake()
+
+    def end(self) -> None:
+        self.complete = True
+        self._wake()
+
+    def abort(self) -> None:
+        if self.complete and not self.chunks:
+            return
+        self.error = StreamReset()
+        self._wake()
+
+    def discard(self) -> None:
+        """The response is done without the body, drop what is left of it."""
+        self.discarding = True
+        size = sum(len(chunk) for chunk in self.chunks)
+        self.chunks.clear()
+        if size:
+            self.release(size)
+
+    def _wake(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+        self.waiter = None
+
+    def _take(self) -> memoryview:
+        chunk = self.chunks.popleft()
+        self.release(len(chunk))
+        return chunk
+
+    def __iter__(self) -> Iterator[memoryview]:
+        """Chunks received so far; the whole body once ``complete`` is set."""
+        while self.chunks:
+            yield self._take()
+        if self.error is not None:
+            raise self.error
+
+    async def __aiter__(self) -> AsyncIterator[memoryview]:
+        while True:
+            if self.chunks:
+                yield self._take()
+                continue
+            if self.error is not None:
+                raise self.error
+            if self.complete:
+                return
+            self.waiter = asyncio.get_running_loop().create_future()
+            await self.waiter
+
+    async def read(
+        self, max_memory: int = 1024 * 1024
+    ) -> tempfile.SpooledTemporaryFile:
+        """The whole body as a file, in memory up to ``max_memory`` bytes.
+
+        Larger bodies spill to a temporary file, so an upload is never held
+        in RAM in full. The file is positioned at the start.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        try:
+            async for chunk in self:
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
@@ -0,0 +1,177 @@
+"""Size-classed pool of bytearrays for DATA waiting for flow-control credit.
+
+A bytearray gives its memory back as soon as it shrinks, so pooled buffers
+never change size: a PooledBuffer fills one up to an offset and moves to
+the next size class when it runs out. Requests larger than the biggest
+class get a buffer of their own that is not pooled.
+
+Only buffers whose contents are copied out before they are released belong
+here. Received data is not pooled: request bodies and lazily decoded
+headers are views of it. Neither is what goes to the transport, which may
+keep a reference to what it could not send yet. Small scratch buffers are
+not worth it either, checking one out costs more than a new bytearray.
+
+Leak detection is on in development mode (``python -X dev``) or with
+HTTP2_BUFFER_DEBUG=1: every buffer checked out remembers where, released
+buffers are overwritten so a stale view shows garbage, and releasing a
+buffer twice raises.
+"""
+from __future__ import annotations
+
+import dataclasses
+import os
+import sys
+import threading
+import traceback
+
+KIB = 1024
+SIZE_CLASSES = (4 * KIB, 16 * KIB, 64 * KIB, 256 * KIB, 1024 * KIB)
+POISON = 0xDD
+
+
+@dataclasses.dataclass(kw_only=True, slots=True)
+class BufferStats:
+    hits: int = 0
+    misses: int = 0
+    # Larger than the biggest size class
+    oversized: int = 0
+    # Released to a full free list
+    dropped: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class BufferPool:
+    """Free lists of bytearrays, one per size class.
+
+    Shared by the event loops of every thread, the free lists are guarded
+    by ``lock``. Statistics may undercount when loops run truly in
+    parallel.
+    """
+
+    __slots__ = ("size_classes", "max_free", "free", "stats", "lock", "checked_out")
+
+    def __init__(
+        self,
+        *,
+        size_classes: tuple[int, ...] = SIZE_CLASSES,
+        max_free: int = 16,
+        debug: bool | None = None,
+    ):
+        self.size_classes = size_classes
+        # Per size class, what is above is left to the allocator
+        self.max_free = max_free
+        self.free: dict[int, list[bytearray]] = {size: [] for size in size_classes}
+        self.stats = BufferStats()
+        self.lock = threading.Lock()
+        if debug is None:
+            debug = sys.flags.dev_mode or bool(os.environ.get("HTTP2_BUFFER_DEBUG"))
+        # id of every buffer checked out -> where, only with leak detection
+        self.checked_out: dict[int, str] | None = {} if debug else None
+
+    def acquire(self, size: int) -> bytearray:
+        """A buffer of at least ``size`` bytes, hand it back with ``release``."""
+        for capacity in self.size_classes:
+            if size <= capacity:
+                break
+        else:
+            self.stats.oversized += 1
+            return bytearray(size)
+        with self.lock:
+            free = self.free[capacity]
+            buffer = free.pop() if free else None
+        if buffer is None:
+            self.stats.misses += 1
+            buffer = bytearray(capacity)
+        else:
+            self.stats.hits += 1
+        if self.checked_out is not None:
+            where = "".join(traceback.format_stack(limit=6)[:-1])
+            self.checked_out[id(buffer)] = where
+        return buffer
+
+    def release(self, buffer: bytearray) -> None:
+        if self.checked_out is not None and len(buffer) in self.free:
+            if self.checked_out.pop(id(buffer), None) is None:
+                raise RuntimeError("buffer released twice or not from this pool")
+            buffer[:] = bytes([POISON]) * len(buffer)
+        free = self.free.get(len(buffer))
+        if free is None:
+            # Oversized, or resized by mistake
+            return
+        with self.lock:
+            if len(free) < self.max_free:
+                free.append(buffer)
+                return
+        self.stats.dropped += 1
+
+    def leaks(self) -> list[str]:
+        """Where each buffer still checked out was acquired."""
+        if self.checked_out is None:
+            return []
+        return list(self.checked_out.values())
+
+    def report(self) -> None:
+        print(f"Buffer pool hit rate {self.stats.hit_rate:.1%}", self.stats)
+        leaks = self.leaks()
+        if leaks:
+            print(len(leaks), "buffers checked out, acquired at:")
+            for where in leaks:
+                print(where)
+
+
+POOL = BufferPool()
+
+
+class PooledBuffer:
+    """Bytes appended at the end and consumed from the front, in a pooled
+    buffer that is swapped for a bigger one when it runs out.
+
+    ``close`` hands the buffer back to the pool, views from ``view`` must
+    be released before.
+    """
+
+    __slots__ = ("pool", "buffer", "start", "end")
+
+    def __init__(self, size_hint: int = 0, pool: BufferPool = POOL):
+        self.pool = pool
+        self.buffer = pool.acquire(size_hint)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def write(self, data: bytes | bytearray | memoryview) -> None:
+        size = len(data)
+        if self.end + size > len(self.buffer):
+            self.move(len(self) + size)
+        # Same length on both sides: copied in place, never resized
+        self.buffer[self.end : self.end + size] = data
+        self.end += size
+
+    def move(self, needed: int) -> None:
+        """Continue at the start of a buffer with room for ``needed`` bytes."""
+        old = self.buffer
+        self.buffer = self.pool.acquire(max(needed, 2 * len(self)))
+        with memoryview(old) as view:
+            self.buffer[: len(self)] = view[self.start : self.end]
+        self.end = len(self)
+        self.start = 0
+        self.pool.release(old)
+
+    def view(self) -> memoryview:
+        return memoryview(self.buffer)[self.start : self.end]
+
+    def consume(self, size: int) -> None:
+        self.start += size
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def close(self) -> None:
+        if self.buffer is not None:
+            self.pool.release(self.buffer)
+            self.buffer = None  # type: ignore[assignment]
@@ -0,0 +1,338 @@
+"""Inbound byte streams of sampled connections, replayed without sockets.
+
+A capture file is MAGIC followed by one record per event, big endian:
+
+    kind (1 byte) | connection (4) | seconds since start (8, float) |
+    payload length (4) | payload
+
+OPEN and CLOSE records have no payload, a DATA record holds what one read
+returned. Replaying them through handle_client reproduces the same frames,
+HPACK state and read boundaries the server saw, so production traffic can
+be run again as a deterministic benchmark.
+
+Values of sensitive fields are replaced by as many ``*`` before they are
+written. They keep their decoded length, so the dynamic table evolves
+exactly as it did in the original, but a rewritten header block may differ
+in size and is written out with the read that completed it. Header blocks
+that cannot be decoded, and every one after them on the connection, are
+left out.
+"""
+from __future__ import annotations
+
+import dataclasses
+import random
+import struct
+import threading
+import time
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Iterator
+
+from http2 import frames
+from http2 import hpack
+from http2 import models
+
+MAGIC = b"H2CAP\x00\x01\n"
+RECORD = struct.Struct(">BIdI")
+OPEN = 0
+DATA = 1
+CLOSE = 2
+
+SENSITIVE = frozenset(("authorization", "proxy-authorization", "cookie"))
+
+# server.CLIENT_PREFACE_PRI, passed through untouched
+PREFACE_SIZE = 24
+FRAME_HEADER_SIZE = 9
+HEADERS = 0x1
+CONTINUATION = 0x9
+END_HEADERS = 0x4
+PADDED = 0x8
+PRIORITY = 0x20
+
+Record = tuple[int, int, float, bytes]
+
+
+class Capture:
+    """Capture file shared by every connection of the process."""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        rate: float = 1.0,
+        sensitive: Iterable[str] = SENSITIVE,
+    ):
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        # Fraction of connections captured
+        self.rate = rate
+        self.sensitive = frozenset(sensitive)
+        self.start = time.monotonic()
+        self.next_id = 0
+        # Event loops may run in several threads, see server.serve_threads
+        self.lock = threading.Lock()
+
+    def connection(self, header_table_size: int) -> ConnectionCapture | None:
+        """Start capturing a new connection, None if it is not sampled."""
+        if self.rate < 1.0 and random.random() >= self.rate:
+            return None
+        with self.lock:
+            identifier = self.next_id
+            self.next_id += 1
+        self.write(OPEN, identifier, b"")
+        return ConnectionCapture(self, identifier, header_table_size)
+
+    def write(self, kind: int, connection: int, payload: bytes) -> None:
+        header = RECORD.pack(
+            kind, connection, time.monotonic() - self.start, len(payload)
+        )
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(header + payload)
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+
+class ConnectionCapture:
+    """Frames one connection's reads just enough to redact header blocks."""
+
+    def __init__(self, capture: Capture, identifier: int, header_table_size: int):
+        self.capture = capture
+        self.identifier = identifier
+        # Mirrors the server's decoder, the redacted block is what it decodes
+        self.decoder = hpack.HPack(header_table_size)
+        self.preface = PREFACE_SIZE
+        # What is left of a frame that is written out as it arrives
+        self.passthrough = 0
+        # An incomplete frame header or header block frame
+        self.pending = b""
+        # Header block fragments waiting for END_HEADERS
+        self.fragments: list[bytes] = []
+        self.first: tuple[int, int, bytes, bytes] | None = None
+        # A block the mirror could not decode: it no longer knows what the
+        # following ones decode to, they are all dropped
+        self.lost = False
+
+    def feed(self, data: bytes) -> None:
+        data = self.redact(data)
+        if data:
+            self.capture.write(DATA, self.identifier, data)
+
+    def close(self) -> None:
+        self.capture.write(CLOSE, self.identifier, b"")
+
+    def redact(self, data: bytes) -> bytes:
+        data = self.pending + data
+        self.pending = b""
+        out = []
+        offset = 0
+        if self.preface:
+            size = min(self.preface, len(data))
+            out.append(data[:size])
+            offset = size
+            self.preface -= size
+        while offset < len(data):
+            if self.passthrough:
+                size = min(self.passthrough, len(data) - offset)
+                out.append(data[offset : offset + size])
+                offset += size
+                self.passthrough -= size
+                continue
+            if len(data) - offset < FRAME_HEADER_SIZE:
+                self.pending = data[offset:]
+                break
+            length = int.from_bytes(data[offset : offset + 3], "big")
+            type_ = data[offset + 3]
+            if type_ not in (HEADERS, CONTINUATION):
+                self.passthrough = FRAME_HEADER_SIZE + length
+                continue
+            end = offset + FRAME_HEADER_SIZE + length
+            if end > len(data):
+                self.pending = data[offset:]
+                break
+            out.append(self.header_frame(data[offset:end]))
+            offset = end
+        return b"".join(out)
+
+    def header_frame(self, frame: bytes) -> bytes:
+        """A HEADERS or CONTINUATION frame, rewritten once END_HEADERS arrives.
+
+        A block continued in CONTINUATION frames comes out as the single
+        HEADERS frame it amounts to.
+        """
+        flags = frame[4]
+        stream_id = frame[5:9]
+        payload = frame[FRAME_HEADER_SIZE:]
+        if frame[3] == HEADERS:
+            start = 0
+            padding = 0
+            if flags & PADDED:
+                padding = payload[0]
+                start = 1
+            if flags & PRIORITY:
+                start += 5
+            self.first = (
+                flags,
+                padding,
+                stream_id,
+                payload[:start],
+            )
+            self.fragments = [payload[start : len(payload) - padding]]
+        elif self.first is not None:
+            self.fragments.append(payload)
+        else:
+            # CONTINUATION without HEADERS, the server rejects it. It may
+            # hold anything, it is not written out
+            return b""
+        if not flags & END_HEADERS:
+            return b""
+
+        flags, padding, stream_id, prefix = self.first
+        self.first = None
+        block = None
+        if not self.lost:
+            block = self.redact_block(b"".join(self.fragments))
+        self.fragments = []
+        if block is None:
+            # Sensitive values could not be told apart, the block is left
+            # out instead of being written as it came
+            print("Header block not captured", self.identifier)
+            self.lost = True
+            return b""
+        payload = prefix + block + bytes(padding)
+        return (
+            len(payload).to_bytes(3, "big")
+            + bytes([HEADERS, flags | END_HEADERS])
+            + stream_id
+            + payload
+        )
+
+    def redact_block(self, block: bytes) -> bytes | None:
+        """The block with sensitive values masked, None if it is malformed."""
+        decoder = self.decoder
+        sensitive = self.capture.sensitive
+        out = b""
+        data = block
+        while data:
+            start = data
+            byte, data = data[0], data[1:]
+            if byte & 0x80 or not byte & 0x40 and byte & 0x20:
+                # Indexed Header Field; Dynamic Table Size Update
+                n_bits = 7 if byte & 0x80 else 5
+                success, value, data = hpack.decode_int(
+                    n_bits, byte & (2**n_bits - 1), data
+                )
+                if not success:
+                    return None
+                if not byte & 0x80:
+                    if value > decoder.max_table_size:
+                        # The server fails the connection on it (COMPRESSION_ERROR)
+                        return None
+                    # Evicts as the server's decoder does, later indexes
+                    # resolve to the same entries
+                    decoder.change_table_size(value)
+                out += start[: len(start) - len(data)]
+                continue
+
+            # Literals, with incremental indexing or without
+            n_bits = 6 if byte & 0x40 else 4
+            success, index, data = hpack.decode_int(
+                n_bits, byte & (2**n_bits - 1), data
+            )
+            if success and index == 0:
+                success, key, data = hpack.decode_str(data)
+            elif success:
+                success, header = decoder.get_from_tables(index, value_must=False)
+                if success:
+                    key = header.key
+            if not success:
+                return None
+            name = data
+            success, value, data = hpack.decode_str(data)
+            if not success:
+                return None
+            key = hpack.as_str(key)
+            if key in sensitive:
+                value = b"*" * len(value)
+                out += start[: len(start) - len(name)] + hpack.encode_str(
+                    value.decode()
+                )
+            else:
+                out += start[: len(start) - len(data)]
+            if byte & 0x40:
+                decoder.add_to_dynamic_table(
+                    hpack.Header(key=key, value=hpack.as_str(value))
+                )
+        return out
+
+
+def read(path: str) -> Iterator[Record]:
+    """The records of a capture file: (kind, connection, seconds, payload)."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while header := f.read(RECORD.size):
+            kind, connection, timestamp, length = RECORD.unpack(header)
+            yield kind, connection, timestamp, f.read(length)
+
+
+@dataclasses.dataclass(kw_only=True, slots=True)
+class ReplayStats:
+    connections: int = 0
+    reads: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    seconds: float = 0.0
+
+
+def replay(
+    records: Iterable[Record],
+    handle_client: Callable[[models.Client], None],
+    *,
+    make_client: Callable[[], models.Client] = models.Client,
+    pace: bool = False,
+) -> ReplayStats:
+    """Feed captured reads to ``handle_client``, as fast as possible or at
+    the recorded pace.
+
+    There are no sockets and no event loop: responses are counted and
+    dropped, timeouts never fire and a handler returning a coroutine can
+    not be run.
+    """
+    clients: dict[int, models.Client] = {}
+    stats = ReplayStats()
+    start = time.perf_counter()
+    for kind, connection, timestamp, payload in records:
+        if pace:
+            delay = timestamp - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if kind == OPEN:
+            clients[connection] = make_client()
+            stats.connections += 1
+            continue
+        client = clients.get(connection)
+        if client is None:
+            continue
+        if kind == CLOSE:
+            frames.release_streams(client)
+            del clients[connection]
+            continue
+        if client.need_close:
+            continue
+        stats.reads += 1
+        stats.bytes_in += len(payload)
+        client.rest_data += payload
+        handle_client(client)
+        while client.budget_exhausted and not client.need_close:
+            handle_client(client)
+        stats.bytes_out += len(client.send_data)
+        client.send_data = bytearray()
+        if not frames.has_active_streams(client):
+            models.shed_idle_state(client)
+    for client in clients.values():
+        frames.release_streams(client)
+    stats.seconds = time.perf_counter() - start
+    return stats
@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+from collections.abc import Callable
+from collections.abc import Coroutine
+from collections.abc import Hashable
+from collections.abc import Iterable
+from typing import Any
+
+from http2 import frames
+from http2 import hpack
+from http2 import metrics
+from http2 import models
+from http2 import server
+from http2 import timers
+
+Handler = Callable[[models.Client, models.Stream], Coroutine[Any, Any, None] | None]
+
+MAX_WINDOW = 2**31 - 1
+MAX_FRAME_SIZE = 2**24 - 1
+# The shared run writes to a connection nobody reads from: no pushes, no
+# flow control, frames as large as the response chunks
+SHARED_SETTINGS = models.Settings(
+    enable_push=0, initial_window_size=MAX_WINDOW, max_frame_size=MAX_FRAME_SIZE
+)
+# Requests carrying these are answered for one user
+CREDENTIAL_FIELDS = ("authorization", "cookie")
+
+
+def personal(block: bytes) -> bool:
+    """Whether a response header block is meant for its requester only."""
+    # hpack.encode never indexes, a fresh decoder reads any block it made
+    decoder = hpack.HPack(models.DEFAULT_SETTINGS.header_table_size)
+    success, headers = decoder.decode(memoryview(block))
+    if not success:
+        return True
+    assert isinstance(headers, hpack.HeaderList)
+    for name, value in headers:
+        if name == "set-cookie":
+            return True
+        if name == "cache-control" and "private" in value.lower():
+            return True
+    return False
+
+
+def run(handler: Handler, client: models.Client, stream: models.Stream) -> None:
+    """frames.run_handler with a handler other than ``client.handler``."""
+    result = handler(client, stream)
+    if inspect.iscoroutine(result):
+        assert client.spawn is not None, "backend can not run coroutines"
+        client.spawn(stream, result)
+
+
+class Flight:
+    """One handler run whose response goes out on every waiting stream.
+
+    The handler writes to a private Client; every frame it queues there is
+    replayed on the waiters, each through its own send buffer so a slow
+    stream or connection does not hold the others back.
+    """
+
+    def __init__(self, coalescer: Coalescer, key: Hashable):
+        self.coalescer = coalescer
+        self.key = key
+        self.waiters: list[tuple[models.Client, models.Stream]] = []
+        # Wait cap timers of the waiters that did not start the run
+        self.timers: list[timers.Timer] = []
+        # The first frame went out, nobody can join any more
+        self.started = False
+        # The final response headers were seen
+        self.responded = False
+        self.done = False
+        self.client = models.Client(
+            local_settings=SHARED_SETTINGS,
+            remote_settings=SHARED_SETTINGS,
+            flow_control=MAX_WINDOW,
+            handler=coalescer.handler,
+            wakeup=self.pump,
+            spawn=self.spawn,
+            call_soon_threadsafe=self.call_soon_threadsafe,
+        )
+        self.stream = models.Stream(
+            identifier=1,
+            state=models.StreamState.half_closed_remote,
+            flow_control=MAX_WINDOW,
+        )
+
+    def open_waiters(self) -> list[tuple[models.Client, models.Stream]]:
+        return [
+            (client, stream)
+            for client, stream in self.waiters
+            if stream.state != models.StreamState.closed
+        ]
+
+    def spawn(self, stream: models.Stream, coro: Coroutine[Any, Any, None]) -> None:
+        # Run by the backend of the stream that started the flight
+        client, first = self.waiters[0]
+        assert client.spawn is not None, "backend can not run coroutines"
+        client.spawn(first, self.guard(coro))
+
+    def call_soon_threadsafe(self, callback: Callable[[], None]) -> None:
+        # Any connection still waiting will do, the callback only writes to
+        # the private client and the pump wakes up the others
+        for client, _ in self.open_waiters():
+            if client.call_soon_threadsafe is not None:
+                client.call_soon_threadsafe(callback)
+                return
+
+    async def guard(self, coro: Coroutine[Any, Any, None]) -> None:
+        try:
+            await coro
+        except asyncio.CancelledError:
+            # The connection running the handler went away
+            self.abandon()
+            raise
+        except Exception as e:
+            print("Shared handler failed", self.key, repr(e))
+            self.reset(0x2)
+        else:
+            self.pump()
+
+    def pump(self) -> None:
+        """Replay what the handler queued since the last call on every waiter."""
+        client = self.client
+        data = client.send_data
+        client.send_data = bytearray()
+        # Credit is unlimited here, every waiter has its own
+        client.flow_control = MAX_WINDOW
+        self.stream.flow_control = MAX_WINDOW
+        if not data or self.done:
+            return
+        batch, _, _ = server.extract_frames(data, MAX_FRAME_SIZE)
+        buffer = memoryview(data)
+        if not self.responded and self.stream.response_started:
+            # Each HEADERS is pumped on its own, the final response's is here
+            self.responded = True
+            for header in batch:
+                if header.type == 0x1:
+                    block = buffer[header.offset : header.offset + header.length]
+                    if personal(bytes(block)):
+                        self.keep_first()
+                    break
+        if not self.started:
+            self.start()
+        for header in batch:
+            payload = buffer[header.offset : header.offset + header.length]
+            end_stream = bool(header.flags & 0x1)
+            if header.type == 0x0:
+                self.send_data(bytes(payload), end_stream)
+            elif header.type == 0x1:
+                # Every HEADERS wakes the pump up right away, an interim
+                # 1xx response is one sent before the final response started
+                interim = not self.stream.response_started
+                self.send_headers(bytes(payload), end_stream, interim)
+            elif header.type == 0x3:
+                self.reset(int.from_bytes(payload, "big"))
+                return
+            if end_stream:
+                self.finish()
+                return
+
+    def keep_first(self) -> None:
+        """The response is personal: only the request it was made for gets
+        it, the others run the handler for themselves."""
+        print("Personal response, not shared", self.key)
+        first, followers = self.waiters[:1], self.waiters[1:]
+        self.waiters = first
+        self.coalescer.release(self)
+        for timer in self.timers:
+            timer.cancel()
+        self.timers = []
+        for client, stream in followers:
+            if stream.state != models.StreamState.closed:
+                run(self.coalescer.handler, client, stream)
+
+    def start(self) -> None:
+        self.started = True
+        self.coalescer.release(self)
+        for timer in self.timers:
+            timer.cancel()
+        followers = len(self.open_waiters()) - 1
+        if followers > 0:
+            metrics.increment("coalesced_streams", followers)
+
+    def send_headers(self, block: bytes, end_stream: bool, interim: bool) -> None:
+        for client, stream in self.open_waiters():
+            if end_stream:
+                # Response headers or trailers, after any DATA still buffered
+                stream.response_started = True
+                stream.send_trailers = block
+                stream.send_end = True
+                frames.flush_stream(client, stream)
+            else:
+                if not interim:
+                    stream.response_started = True
+                    if stream.deadline is not None:
+                        stream.deadline.cancel()
+                client.send_data += frames.generate_headers(
+                    stream.identifier, block, False
+                )
+            frames.wakeup(client)
+
+    def send_data(self, data: bytes, end_stream: bool) -> None:
+        waiters = self.open_waiters()
+        for client, stream in waiters:
+            frames.send_data(client, stream, data, end_stream)
+        if len(waiters) > 1:
+            metrics.increment("coalesced_bytes", len(data) * (len(waiters) - 1))
+
+    def reset(self, error_code: int) -> None:
+        for client, stream in self.open_waiters():
+            client.send_data += frames.generate_rst_stream(
+                stream.identifier, error_code
+            )
+            frames.close_stream(client, stream)
+            frames.wakeup(client)
+        self.finish()
+
+    def abandon(self) -> None:
+        """The run was cancelled: waiters still without a response run anew."""
+        if self.done:
+            return
+        if self.started:
+            self.reset(0x2)
+            return
+        waiters = self.open_waiters()
+        self.finish()
+        for client, stream in waiters:
+            run(self.coalescer, client, stream)
+
+    def finish(self) -> None:
+        self.done = True
+        self.coalescer.release(self)
+        for timer in self.timers:
+            timer.cancel()
+        self.waiters = []
+
+    def wait_expired(self, client: models.Client, stream: models.Stream) -> None:
+        if self.started or stream.state == models.StreamState.closed:
+            return
+        print("Gave up waiting for shared response", stream.identifier, self.key)
+        self.waiters = [waiter for waiter in self.waiters if waiter[1] is not stream]
+        metrics.increment("coalesce_wait_expired")
+        run(self.coalescer.handler, client, stream)
+
+
+class Coalescer:
+    """Handler wrapper running ``handler`` once for identical concurrent GETs.
+
+    A GET arriving while the same request (method, authority, path and the
+    ``vary`` fields) is in flight on any connection waits for that run
+    instead of starting its own, and gets the same response frames. It
+    joins as long as the shared response has not started; after
+    ``max_wait`` seconds without a response it runs the handler itself.
+
+    Requests with credentials (``authorization``, ``cookie``) run on their
+    own unless ``share_credentials`` is set. A response with ``set-cookie``
+    or ``cache-control: private`` goes to the request that started the run
+    only, the handler runs again for the others.
+
+    Flights are not shared between event loops, in thread-per-loop mode
+    create one Coalescer per thread (server.serve_threads handler_factory).
+    """
+
+    def __init__(
+        self,
+        handler: Handler,
+        *,
+        vary: Iterable[str] = ("accept-encoding",),
+        max_wait: float | None = 5.0,
+        share_credentials: bool = False,
+    ):
+        self.handler = handler
+        self.vary = tuple(vary)
+        self.max_wait = max_wait
+        # The response does not depend on who asks, e.g. a session cookie
+        # the handler ignores
+        self.share_credentials = share_credentials
+        self.flights: dict[Hashable, Flight] = {}
+
+    def key(self, stream: models.Stream) -> Hashable | None:
+        headers = stream.headers
+        if (
+            headers is None
+            or headers.method != "GET"
+            or stream.body is not None
+            # Pushed streams are answered as soon as they are promised
+            or not stream.identifier & 1
+        ):
+            return None
+        if not self.share_credentials and any(
+            headers.get(name) is not None for name in CREDENTIAL_FIELDS
+        ):
+            return None
+        return (
+            headers.authority,
+            headers.path,
+            *(headers.get(name) for name in self.vary),
+        )
+
+    def __call__(
+        self, client: models.Client, stream: models.Stream
+    ) -> Coroutine[Any, Any, None] | None:
+        key = self.key(stream)
+        if key is None:
+            return self.handler(client, stream)
+        flight = self.flights.get(key)
+        if flight is not None:
+            flight.waiters.append((client, stream))
+            if self.max_wait is not None and client.timer_wheel is not None:
+                flight.timers.append(
+                    client.timer_wheel.schedule(
+                        self.max_wait,
+                        functools.partial(flight.wait_expired, client, stream),
+                    )
+                )
+            return None
+
+        flight = self.flights[key] = Flight(self, key)
+        flight.waiters.append((client, stream))
+        flight.stream.headers = stream.headers
+        frames.run_handler(flight.client, flight.stream)
+        # Whatever a plain handler queued without a wakeup
+        flight.pump()
+        return None
+
+    def release(self, flight: Flight) -> None:
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
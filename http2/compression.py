@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import dataclasses
+import os
+import threading
+import zlib
+from collections.abc import Hashable
+from collections.abc import Iterable
+
+from http2 import frames
+from http2 import handlers
+from http2 import models
+
+# Preference order when the client accepts both with the same q-value
+ENCODINGS = ("gzip", "deflate")
+# zlib wbits: gzip container, or zlib container which is what HTTP calls deflate
+WBITS = {"gzip": 31, "deflate": 15}
+LEVEL = 6
+
+# Not worth a content-encoding header below this
+MIN_SIZE = 256
+# Bodies from this size are compressed on the worker pool (zlib releases
+# the GIL), keeping the event loop free
+POOL_THRESHOLD = 128 * 1024
+# Queued but not yet sent bytes before respond_stream waits for the client
+SEND_HIGH_WATER = 64 * 1024
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    if not accept_encoding:
+        return None
+    best = None
+    best_q = 0.0
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        if coding == "*":
+            coding = best or ENCODINGS[0]
+        if coding not in WBITS or q <= 0:
+            continue
+        if q > best_q or (
+            q == best_q and ENCODINGS.index(coding) < ENCODINGS.index(best)
+        ):
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, WBITS[encoding])
+    return compressor.compress(body) + compressor.flush()
+
+
+@dataclasses.dataclass(kw_only=True, slots=True)
+class VariantCache:
+    """Compressed variants of static/cacheable bodies, LRU bounded in bytes."""
+
+    max_bytes: int = 64 * 1024 * 1024
+    size: int = 0
+    entries: collections.OrderedDict[tuple[Hashable, str], bytes] = dataclasses.field(
+        default_factory=collections.OrderedDict
+    )
+    hits: int = 0
+    misses: int = 0
+    # Shared by the event loops of every thread and the compression workers
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+    def get(self, key: Hashable, encoding: str) -> bytes | None:
+        with self.lock:
+            body = self.entries.get((key, encoding))
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((key, encoding))
+            self.hits += 1
+            return body
+
+    def put(self, key: Hashable, encoding: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop((key, encoding), None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[(key, encoding)] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+CACHE = VariantCache()
+
+_executor: concurrent.futures.ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=os.cpu_count(), thread_name_prefix="compress"
+            )
+        return _executor
+
+
+def cache_key_for(
+    stream: models.Stream, headers: list[tuple[str, str]]
+) -> Hashable | None:
+    """Responses with an ETag that may be cached are cached by path and ETag."""
+    etag = None
+    for key, value in headers:
+        if key == "etag":
+            etag = value
+        elif key == "cache-control" and ("no-store" in value or "private" in value):
+            return None
+        elif key == "set-cookie":
+            return None
+    if etag is None or stream.headers is None:
+        return None
+    return stream.headers.authority, stream.headers.path, etag
+
+
+def _compressed_headers(
+    headers: Iterable[tuple[str, str]], encoding: str | None
+) -> list[tuple[str, str]]:
+    if encoding is None:
+        # The body goes out as given, its length still holds
+        res = list(headers)
+    else:
+        res = [(key, value) for key, value in headers if key != "content-length"]
+        res.append(("content-encoding", encoding))
+    res.append(("vary", "accept-encoding"))
+    return res
+
+
+def respond(
+    client: models.Client,
+    stream: models.Stream,
+    status: int = 200,
+    headers: Iterable[tuple[str, str]] = (),
+    body: bytes = b"",
+    *,
+    cache_key: Hashable | None = None,
+) -> None:
+    """handlers.respond with the body compressed as the client accepts.
+
+    ``cache_key`` (or an ETag on a cacheable response) keeps the compressed
+    variant around so a hot asset is compressed once, not once per request.
+    """
+    headers = list(headers)
+    encoding = None
+    if stream.headers is not None and not any(
+        key == "content-encoding" for key, _ in headers
+    ):
+        encoding = negotiate(stream.headers.get("accept-encoding"))
+    if encoding is None or len(body) < MIN_SIZE:
+        handlers.respond(
+            client, stream, status, _compressed_headers(headers, None), body
+        )
+        return
+
+    if cache_key is None:
+        cache_key = cache_key_for(stream, headers)
+    headers = _compressed_headers(headers, encoding)
+    if cache_key is not None:
+        cached = CACHE.get(cache_key, encoding)
+        if cached is not None:
+            handlers.respond(client, stream, status, headers, cached)
+            return
+
+    if len(body) < POOL_THRESHOLD or client.call_soon_threadsafe is None:
+        compressed = compress(body, encoding)
+        if cache_key is not None:
+            CACHE.put(cache_key, encoding, compressed)
+        handlers.respond(client, stream, status, headers, compressed)
+        return
+
+    # Headers now, DATA once the worker is done
+    handlers.respond_headers(client, stream, status, headers)
+    future = executor().submit(compress, body, encoding)
+
+    def done() -> None:
+        try:
+            compressed = future.result()
+        except Exception as e:
+            print("Compression failed", stream.identifier, repr(e))
+            if stream.state != models.StreamState.closed:
+                # INTERNAL_ERROR, the headers are out already
+                client.send_data += frames.generate_rst_stream(stream.identifier, 0x2)
+                frames.close_stream(client, stream)
+            return
+        if cache_key is not None:
+            CACHE.put(cache_key, encoding, compressed)
+        if stream.state != models.StreamState.closed:
+            frames.send_data(client, stream, compressed, end_stream=True)
+
+    call_soon_threadsafe = client.call_soon_threadsafe
+    future.add_done_callback(lambda _: call_soon_threadsafe(done))
+
+
+async def respond_stream(
+    client: models.Client,
+    stream: models.Stream,
+    status: int = 200,
+    headers: Iterable[tuple[str, str]] = (),
+    chunks: Iterable[bytes] = (),
+) -> None:
+    """Compress ``chunks`` on the fly, never holding the whole body.
+
+    Takes the next chunk only while less than SEND_HIGH_WATER bytes wait
+    for the client, a slow reader holds back the producer.
+    """
+    encoding = None
+    if stream.headers is not None:
+        encoding = negotiate(stream.headers.get("accept-encoding"))
+    handlers.respond_headers(
+        client, stream, status, _compressed_headers(headers, encoding)
+    )
+    compressor = None
+    if encoding is not None:
+        compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, WBITS[encoding])
+    for chunk in chunks:
+        if stream.state == models.StreamState.closed:
+            return
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            frames.send_data(client, stream, chunk, end_stream=False)
+            if frames.queued(stream) > SEND_HIGH_WATER:
+                await handlers.drain(stream)
+    if stream.state == models.StreamState.closed:
+        return
+    last = b"" if compressor is None else compressor.flush()
+    frames.send_data(client, stream, last, end_stream=True)
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import dataclasses
+
+
+@dataclasses.dataclass(kw_only=True, slots=True, frozen=True)
+class WindowUpdatePolicy:
+    """Decides when received bytes are handed back to the peer.
+
+    Sending a WINDOW_UPDATE for every DATA frame doubles the frame count on
+    uploads, so consumed bytes are accumulated until ``threshold`` of the
+    advertised window has been used up.
+    """
+
+    # Fraction of the window that must be consumed before an update is sent
+    threshold: float = 0.5
+    # Never send increments smaller than this (unless the window is tiny)
+    min_increment: int = 0
+
+    def increment(self, consumed: int, window: int) -> int:
+        """Return the WINDOW_UPDATE increment to send now, 0 to hold it back."""
+        if consumed <= 0:
+            return 0
+        if consumed < self.min_increment and consumed < window:
+            return 0
+        if consumed < window * self.threshold:
+            return 0
+        return consumed
+
+
+DEFAULT_POLICY = WindowUpdatePolicy()
+# Large uploads: fewer, bigger updates; the sender is expected to have a deep
+# enough window not to stall while the update is in flight.
+BULK_UPLOAD_POLICY = WindowUpdatePolicy(threshold=0.75, min_increment=16_384)
+# Small request bodies: hand credit back early so the sender never waits.
+INTERACTIVE_POLICY = WindowUpdatePolicy(threshold=0.125)
+
+# By name, see server.argument_parser
+POLICIES = {
+    "default": DEFAULT_POLICY,
+    "bulk-upload": BULK_UPLOAD_POLICY,
+    "interactive": INTERACTIVE_POLICY,
+}
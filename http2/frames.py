@@ -1,9 +1,18 @@
 import dataclasses
+import functools
+import inspect
 import struct
+import time
+from collections.abc import Iterable
 from collections.abc import Mapping
 from typing import Protocol
 
+from http2 import body
+from http2 import buffers
+from http2 import hpack
+from http2 import metrics
 from http2 import models
+from http2 import profiling
 
 # 6 bytes:
 # 16 bit identifier
@@ -12,6 +21,16 @@ SETTINGS_FRAME_FORMAT = ">HI"
 SETTINGS_FRAME_FORMAT_SIZE = struct.calcsize(SETTINGS_FRAME_FORMAT)
 assert SETTINGS_FRAME_FORMAT_SIZE == 6
 
+# Length (24 bit) and type, flags, stream id
+FRAME_HEADER = struct.Struct(">IBI")
+assert FRAME_HEADER.size == 9
+# Last-Stream-ID, error code
+GOAWAY = struct.Struct(">II")
+
+# The connection flow-control window always starts at 65,535 octets;
+# SETTINGS_INITIAL_WINDOW_SIZE only applies to streams
+CONNECTION_WINDOW_SIZE = 65_535
+
 
 #       Receiving any frame other than HEADERS or PRIORITY on a stream in
 #       this state MUST be treated as a connection error (Section 5.4.1)
@@ -44,12 +63,22 @@ def set_settings(client: models.Client, setting: SettingRaw) -> bool:
         # unsupported identifier MUST ignore that setting.
         print("WARNING: Unknown setting: ", setting.identifier)
         return True
-    setattr(client.remote_settings, setting_id, setting.value)
+    if setting_id == "initial_window_size":
+        # Applies to every open stream as a delta
+        delta = setting.value - client.remote_settings.initial_window_size
+        for stream in client.streams.values():
+            stream.flow_control += delta
+    # Settings are immutable and shared between connections, copy on write
+    client.remote_settings = dataclasses.replace(
+        client.remote_settings, **{setting_id: setting.value}
+    )
     print("Set remote setting", setting_id, setting.value)
     return True
 
 
-def parse_settings(client: models.Client, header: models.FrameHeader, frame: bytes):
+def parse_settings(
+    client: models.Client, header: models.FrameHeader, frame: memoryview
+):
     assert frame is not None
     assert header is not None
     assert header.type == 0x4
@@ -62,6 +91,7 @@ def parse_settings(client: models.Client, header: models.FrameHeader, frame: byt
             client.need_close = True
             return
         print("Settings ACK")
+        client.settings_ack_pending = False
         return
 
     # The stream identifier for a SETTINGS frame MUST be zero (0x0)
@@ -92,15 +122,22 @@ def parse_settings(client: models.Client, header: models.FrameHeader, frame: byt
             return
     print("Settings frame OK")
     client.send_data += generate_empty_settings_frame(ack=True)
+    flush_streams(client)
 
 
 def window_update(client: models.Client, stream_id: int, incr: int) -> None:
-    stream = client.streams.get(stream_id)
-    # TODO:
-    #   Receiving any frame other than HEADERS or PRIORITY on a stream in
-    #   this state MUST be treated as a connection error (Section 5.4.1)
-    #   of type PROTOCOL_ERROR.
+    # Client carries the connection-level window under the same name
+    stream: models.Stream | models.Client | None
+    stream = client if stream_id == 0 else client.streams.get(stream_id)
     if stream is None:
+        if stream_state(client, stream_id) == models.StreamState.closed:
+            # Can arrive shortly after the stream was closed, ignore
+            print("Window update: Stream closed", stream_id)
+            return
+        # TODO:
+        #   Receiving any frame other than HEADERS or PRIORITY on a stream in
+        #   this state MUST be treated as a connection error (Section 5.4.1)
+        #   of type PROTOCOL_ERROR.
         print("Window update: Stream not found")
         client.need_close = True
         return
@@ -119,11 +156,15 @@ def window_update(client: models.Client, stream_id: int, incr: int) -> None:
         )
         client.need_close = True
         return
-    print("Window update: ", stream.identifier, sizeof_fmt(stream.flow_control))
+    print("Window update: ", stream_id, sizeof_fmt(stream.flow_control))
+    if stream_id == 0:
+        flush_streams(client)
+    else:
+        flush_stream(client, stream)
 
 
 def parse_window_update(
-    client: models.Client, header: models.FrameHeader, frame: bytes
+    client: models.Client, header: models.FrameHeader, frame: memoryview
 ):
     assert frame is not None
     assert header is not None
@@ -151,7 +192,10 @@ def parse_window_update(
     print("Window update frame OK")
 
 
-def parse_headers(client: models.Client, header: models.FrameHeader, frame: bytes):
+HPACK_PHASE = profiling.phase("hpack.decode")
+
+
+def parse_headers(client: models.Client, header: models.FrameHeader, frame: memoryview):
     assert frame is not None
     assert header is not None
     assert header.type == 0x1
@@ -166,9 +210,27 @@ def parse_headers(client: models.Client, header: models.FrameHeader, frame: byte
         client.need_close = True
         return
 
-    stream = client.streams.setdefault(
-        header.stream_id, models.Stream(identifier=header.stream_id)
-    )
+    if client.goaway_sent and header.stream_id > client.last_stream_id:
+        if skip_header_block(client, frame):
+            print("Ignoring stream opened after GOAWAY", header.stream_id)
+        return
+
+    stream = client.streams.get(header.stream_id)
+    status = 200
+    if stream is None:
+        if not header.stream_id & 1 or header.stream_id <= client.last_stream_id:
+            # TODO: connection error PROTOCOL_ERROR, STREAM_CLOSED if closed
+            print("Headers frame on closed or invalid stream", header.stream_id)
+            client.need_close = True
+            return
+        status = admit_stream(client)
+        if status == 0:
+            if skip_header_block(client, frame):
+                # Refused streams count as closed from now on
+                client.last_stream_id = header.stream_id
+                client.send_data += generate_rst_stream(header.stream_id, 0x7)
+            return
+        stream = open_stream(client, header.stream_id)
 
     if stream.state in [models.StreamState.idle]:
         stream.state = models.StreamState.open
@@ -207,57 +269,543 @@ def parse_headers(client: models.Client, header: models.FrameHeader, frame: byte
     #    MUST be transmitted as a contiguous sequence of frames, with no
     #    interleaved frames of any other type or from any other stream.
 
-    http_headers = []
-    for success, http_header in client.decoder.decode(frame):
-        if not success:
-            # connection error: DECODE ERROR
-            print("DECODE ERROR", success, http_header)
+    start = time.perf_counter_ns()
+    success, http_headers = models.get_decoder(client).decode(frame)
+    HPACK_PHASE.add(time.perf_counter_ns() - start)
+    if not success:
+        # connection error: DECODE ERROR
+        print("DECODE ERROR", success, http_headers)
+        client.need_close = True
+        return
+    print(http_headers)
+    stream.headers = http_headers
+    if not end_stream and status == 200 and client.handler is not None:
+        stream.body = body.RequestBody(
+            functools.partial(release_body, client, header.stream_id)
+        )
+
+    if end_stream:
+        end_remote(client, stream)
+    if status != 200:
+        block = hpack.encode([(":status", str(status))])
+        client.send_data += generate_headers(header.stream_id, block, end_stream=True)
+        end_local(client, stream)
+    elif client.handler is None:
+        client.send_data += generate_empty_200(header.stream_id)
+        end_local(client, stream)
+    else:
+        run_handler(client, stream)
+
+
+def run_handler(client: models.Client, stream: models.Stream) -> None:
+    assert client.handler is not None
+    result = client.handler(client, stream)
+    if inspect.iscoroutine(result):
+        assert client.spawn is not None, "backend can not run coroutines"
+        client.spawn(stream, result)
+
+
+def skip_header_block(client: models.Client, frame: memoryview) -> bool:
+    """Decode a header block of a stream that is not processed.
+
+    The block still has to pass through the decoder to keep HPACK state in sync.
+    """
+    success, http_headers = models.get_decoder(client).decode(frame)
+    if not success:
+        print("DECODE ERROR", success, http_headers)
+        client.need_close = True
+        return False
+    return True
+
+
+def admit_stream(client: models.Client) -> int:
+    """Return 0 to refuse a new stream, otherwise the status to respond with."""
+    limit = client.local_settings.max_concurrent_streams
+    active = len(client.streams)
+    if client.last_pushed_stream_id:
+        # Pushed streams count against the client's limit, not ours
+        active = sum(1 for stream_id in client.streams if stream_id & 1)
+    if limit is not None and active >= limit:
+        print("MAX_CONCURRENT_STREAMS reached", limit)
+        return 0
+    if (
+        client.admission_controller is not None
+        and not client.admission_controller.admit()
+    ):
+        print("Admission control: shedding stream")
+        return client.admission_controller.reject_status or 0
+    return 200
+
+
+def stream_state(client: models.Client, stream_id: int) -> models.StreamState:
+    stream = client.streams.get(stream_id)
+    if stream is not None:
+        return stream.state
+    # Closed streams are not kept around. Stream ids only ever grow, so a
+    # stream up to the highest opened id that is not active is closed.
+    if stream_id & 1 and stream_id <= client.last_stream_id:
+        return models.StreamState.closed
+    if not stream_id & 1 and stream_id <= client.last_pushed_stream_id:
+        return models.StreamState.closed
+    return models.StreamState.idle
+
+
+def open_stream(client: models.Client, stream_id: int) -> models.Stream:
+    stream = models.Stream(
+        identifier=stream_id,
+        flow_control=client.remote_settings.initial_window_size,
+        recv_window=client.local_settings.initial_window_size,
+    )
+    client.streams[stream_id] = stream
+    timeout = client.timeouts.stream
+    if client.timer_wheel is not None and timeout is not None:
+        stream.deadline = client.timer_wheel.schedule(
+            timeout, functools.partial(stream_timed_out, client, stream)
+        )
+    if stream_id & 1:
+        client.last_stream_id = max(client.last_stream_id, stream_id)
+    else:
+        client.last_pushed_stream_id = max(client.last_pushed_stream_id, stream_id)
+    metrics.stream_opened()
+    return stream
+
+
+def close_stream(client: models.Client, stream: models.Stream) -> None:
+    stream.state = models.StreamState.closed
+    if stream.deadline is not None:
+        stream.deadline.cancel()
+    if stream.body is not None:
+        # Wakes up a handler still waiting for the rest of the body
+        stream.body.abort()
+    if stream.send_buffer is not None:
+        stream.send_buffer.close()
+        stream.send_buffer = None
+    drained(stream)
+    if client.streams.pop(stream.identifier, None) is not None:
+        metrics.stream_closed()
+
+
+def stream_timed_out(client: models.Client, stream: models.Stream) -> None:
+    if stream.state == models.StreamState.closed:
+        return
+    print("Stream response deadline passed", stream.identifier)
+    # CANCEL
+    client.send_data += generate_rst_stream(stream.identifier, 0x8)
+    close_stream(client, stream)
+    wakeup(client)
+
+
+def release_streams(client: models.Client) -> None:
+    """Connection is gone, every stream on it is closed."""
+    for stream in list(client.streams.values()):
+        close_stream(client, stream)
+
+
+def end_remote(client: models.Client, stream: models.Stream) -> None:
+    """END_STREAM received from the peer."""
+    if stream.body is not None:
+        stream.body.end()
+    if stream.state == models.StreamState.open:
+        stream.state = models.StreamState.half_closed_remote
+    elif stream.state == models.StreamState.half_closed_local:
+        close_stream(client, stream)
+
+
+def end_local(client: models.Client, stream: models.Stream) -> None:
+    """END_STREAM sent to the peer."""
+    if stream.deadline is not None:
+        stream.deadline.cancel()
+    if stream.body is not None:
+        # The response is complete, nobody reads the rest of the request
+        stream.body.discard()
+    if stream.state == models.StreamState.open:
+        stream.state = models.StreamState.half_closed_local
+    elif stream.state == models.StreamState.half_closed_remote:
+        close_stream(client, stream)
+
+
+def parse_data(client: models.Client, header: models.FrameHeader, frame: memoryview):
+    assert frame is not None
+    assert header is not None
+    assert header.type == 0x0
+    assert len(frame) == header.length
+
+    if header.stream_id == 0:
+        # TODO: connection error PROTOCOL_ERROR
+        print("Data frame can not be sent for stream id 0")
+        client.need_close = True
+        return
+
+    if client.goaway_sent and header.stream_id > client.last_stream_id:
+        # Ignored stream, but the bytes still count against the connection
+        client.recv_window -= header.length
+        consume(client, header.stream_id, header.length)
+        return
+
+    stream = client.streams.get(header.stream_id)
+    if (
+        stream is None
+        and stream_state(client, header.stream_id) == models.StreamState.closed
+        and header.length <= client.recv_window
+    ):
+        # Stream error STREAM_CLOSED; the bytes still count for the connection
+        print("Received data frame on closed stream", header.stream_id)
+        client.recv_window -= header.length
+        consume(client, header.stream_id, header.length)
+        client.send_data += generate_rst_stream(header.stream_id, 0x5)
+        return
+    if stream is None or stream.state not in [
+        models.StreamState.open,
+        models.StreamState.half_closed_local,
+    ]:
+        # TODO: connection error PROTOCOL_ERROR / STREAM_CLOSED
+        print("Received data frame on wrong stream state", header.stream_id)
+        client.need_close = True
+        return
+
+    # The entire DATA frame payload is included in flow control,
+    # including the Pad Length and Padding fields if present.
+    if header.length > client.recv_window or header.length > stream.recv_window:
+        # TODO: connection error FLOW_CONTROL_ERROR
+        print("Data frame exceeds flow control window", header.length)
+        client.need_close = True
+        return
+    client.recv_window -= header.length
+    stream.recv_window -= header.length
+
+    end_stream = (header.flags & 0x1) != 0
+    padded = (header.flags & 0x8) != 0
+    data = frame
+    if padded:
+        if not frame or frame[0] >= len(frame):
+            # TODO: connection error PROTOCOL_ERROR
+            print("Data frame padding exceeds payload")
             client.need_close = True
             return
-        print(http_header)
-        http_headers.append(http_header)
+        data = frame[1 : len(frame) - frame[0]]
+
+    print("Data frame", header.stream_id, len(data), f"{end_stream=}")
+    if stream.body is None:
+        # Nobody reads it
+        consume(client, header.stream_id, header.length)
+    else:
+        # The connection window is credited on arrival, so a handler that
+        # reads slowly stalls its own stream and not the others. What is
+        # buffered is bounded by the stream window, credited back as the
+        # handler reads it, padding right away.
+        consume_connection(client, header.length)
+        if len(data) != header.length:
+            consume_stream(client, header.stream_id, header.length - len(data))
+        stream.body.feed(data)
+    if end_stream:
+        end_remote(client, stream)
+
+
+def release_body(client: models.Client, stream_id: int, size: int) -> None:
+    """The handler read ``size`` bytes of a request body, the connection
+    window had them back on arrival."""
+    consume_stream(client, stream_id, size)
+    wakeup(client)
+
+
+def wakeup(client: models.Client) -> None:
+    """Frames were queued outside handle_client, have the backend send them."""
+    if client.wakeup is not None:
+        client.wakeup()
+
+
+_NOT_RECEIVING = (models.StreamState.half_closed_remote, models.StreamState.closed)
+
+
+def consume(client: models.Client, stream_id: int, size: int) -> None:
+    """Mark ``size`` received bytes of ``stream_id`` as processed.
+
+    The bytes are credited back to the peer once the client's
+    ``window_update_policy`` says enough of the window has been used; the
+    resulting WINDOW_UPDATE frames are queued in ``pending_window_updates``.
+    """
+    consume_connection(client, size)
+    consume_stream(client, stream_id, size)
+
+
+def consume_connection(client: models.Client, size: int) -> None:
+    client.recv_consumed += size
+    incr = client.window_update_policy.increment(
+        client.recv_consumed, CONNECTION_WINDOW_SIZE
+    )
+    if incr:
+        if client.pending_window_updates is None:
+            client.pending_window_updates = {}
+        client.recv_consumed -= incr
+        client.recv_window += incr
+        pending = client.pending_window_updates
+        pending[0] = pending.get(0, 0) + incr
+
+
+def consume_stream(client: models.Client, stream_id: int, size: int) -> None:
+    stream = client.streams.get(stream_id)
+    if stream is None or stream.state in _NOT_RECEIVING:
+        # The peer can not send anything more on this stream
+        return
+    stream.recv_consumed += size
+    window = client.local_settings.initial_window_size
+    incr = client.window_update_policy.increment(stream.recv_consumed, window)
+    if incr:
+        if client.pending_window_updates is None:
+            client.pending_window_updates = {}
+        pending = client.pending_window_updates
+        stream.recv_consumed -= incr
+        stream.recv_window += incr
+        pending[stream_id] = pending.get(stream_id, 0) + incr
+
+
+def send_data(
+    client: models.Client,
+    stream: models.Stream,
+    data: bytes | memoryview,
+    end_stream: bool,
+) -> None:
+    """Queue DATA on ``stream``; it is sent as far as flow control allows.
+
+    The rest goes out from flush_stream once the peer sends WINDOW_UPDATE.
+    """
+    if stream.send_buffer is not None:
+        stream.send_buffer.write(data)
+        data = b""
+    stream.send_end = end_stream
+    flush_stream(client, stream, data)
+    wakeup(client)
+
+
+def send_trailers(
+    client: models.Client,
+    stream: models.Stream,
+    headers: Iterable[tuple[str, str]],
+) -> None:
+    """End ``stream`` with a trailer HEADERS frame after all queued DATA."""
+    stream.send_trailers = hpack.encode(headers)
+    stream.send_end = True
+    flush_stream(client, stream)
+    wakeup(client)
+
+
+def queued(stream: models.Stream) -> int:
+    """DATA bytes on ``stream`` waiting for flow-control credit."""
+    return 0 if stream.send_buffer is None else len(stream.send_buffer)
+
+
+def flush_stream(
+    client: models.Client, stream: models.Stream, data: bytes | memoryview = b""
+) -> None:
+    """Write DATA frames as far as flow control allows.
+
+    What is queued on the stream goes first; ``data`` is only given with
+    nothing queued, what does not fit the windows is queued in a pooled
+    buffer until the peer sends WINDOW_UPDATE.
+    """
+    queue = stream.send_buffer
+    if queue is None and not data and not stream.send_end:
+        return
+    if queue is not None:
+        pending = len(queue)
+        with queue.view() as view:
+            offset = write_data(client, stream, view)
+        queue.consume(offset)
+    else:
+        pending = len(data)
+        with memoryview(data) as view:
+            offset = write_data(client, stream, view)
+            if offset < pending:
+                queue = stream.send_buffer = buffers.PooledBuffer(pending - offset)
+                queue.write(view[offset:])
+    if queue is not None and not queue:
+        queue.close()
+        stream.send_buffer = None
+    if stream.send_buffer is None:
+        drained(stream)
+
+    if stream.send_end and stream.send_buffer is None:
+        if stream.send_trailers is not None:
+            client.send_data += generate_headers(
+                stream.identifier, stream.send_trailers, True
+            )
+            stream.send_trailers = None
+        elif not pending:
+            # Nothing but END_STREAM left to send
+            client.send_data += generate_data(stream.identifier, b"", True)
+        stream.send_end = False
+        end_local(client, stream)
+
+
+def write_data(client: models.Client, stream: models.Stream, data: memoryview) -> int:
+    """Append DATA frames of ``data`` to ``client.send_data``, return how
+    much flow control allowed."""
+    out = client.send_data
+    max_frame_size = client.remote_settings.max_frame_size
+    # END_STREAM goes on the last DATA frame unless trailers follow
+    end = stream.send_end and stream.send_trailers is None
+    offset = 0
+    while offset < len(data):
+        size = min(
+            len(data) - offset,
+            stream.flow_control,
+            client.flow_control,
+            max_frame_size,
+        )
+        if size <= 0:
+            break
+        flags = 0x1 if end and offset + size == len(data) else 0
+        # Appended in place, the payload is copied once
+        out += frame_header(size, 0x0, flags, stream.identifier)
+        out += data[offset : offset + size]
+        stream.flow_control -= size
+        client.flow_control -= size
+        offset += size
+    return offset
+
+
+def drained(stream: models.Stream) -> None:
+    if stream.on_drained is not None:
+        callback = stream.on_drained
+        stream.on_drained = None
+        callback()
+
+
+def flush_streams(client: models.Client) -> None:
+    """Connection window (or SETTINGS) opened up, retry every blocked stream."""
+    for stream in list(client.streams.values()):
+        if client.flow_control <= 0:
+            return
+        flush_stream(client, stream)
+
+
+def has_active_streams(client: models.Client) -> bool:
+    # Closed streams are removed right away, see close_stream
+    return bool(client.streams)
+
+
+def send_goaway(client: models.Client, error_code: int = 0x0) -> None:
+    """Announce shutdown: streams above ``last_stream_id`` will not be processed."""
+    if client.goaway_sent:
+        return
+    client.goaway_sent = True
+    client.send_data += generate_goaway(client.last_stream_id, error_code)
+    print("GOAWAY sent", client.last_stream_id, error_code)
+
+
+def flush_window_updates(client: models.Client) -> None:
+    """Write all pending WINDOW_UPDATE frames."""
+    if not client.pending_window_updates:
+        return
+    for stream_id, incr in client.pending_window_updates.items():
+        stream = client.streams.get(stream_id)
+        if stream_id and (stream is None or stream.state in _NOT_RECEIVING):
+            # END_STREAM arrived in the same read, the credit is useless now
+            continue
+        client.send_data += generate_window_update(stream_id, incr)
+    client.pending_window_updates.clear()
+
+
+def parse_rst_stream(
+    client: models.Client, header: models.FrameHeader, frame: memoryview
+):
+    assert frame is not None
+    assert header is not None
+    assert header.type == 0x3
+    assert len(frame) == header.length
 
-    client.send_data += generate_empty_200()
+    if header.length != 4:
+        # TODO: connection error FRAME_SIZE_ERROR
+        print("Invalid rst stream frame")
+        client.need_close = True
+        return
 
+    state = stream_state(client, header.stream_id)
+    if header.stream_id == 0 or state == models.StreamState.idle:
+        # TODO: connection error PROTOCOL_ERROR
+        print("Rst stream frame on idle stream", header.stream_id)
+        client.need_close = True
+        return
 
-def parse_unknown(client: models.Client, header: models.FrameHeader, frame: bytes):
-    print("Unknown frame", header, frame)
+    raw: tuple[int]
+    raw = struct.unpack_from(">I", frame, 0)
+    print("Rst stream", header.stream_id, raw[0])
+    stream = client.streams.get(header.stream_id)
+    if stream is not None:
+        close_stream(client, stream)
 
 
 class ParsingProtocol(Protocol):
     def __call__(
-        self, client: models.Client, header: models.FrameHeader, frame: bytes
+        self, client: models.Client, header: models.FrameHeader, frame: memoryview
     ) -> None:
         ...
 
 
 FRAME_MAPPING: Mapping[int, ParsingProtocol] = {
+    0x0: parse_data,
     0x1: parse_headers,
+    0x3: parse_rst_stream,
     0x4: parse_settings,
     0x8: parse_window_update,
 }
 
 
+def frame_header(length: int, type_: int, flags: int, stream_id: int) -> bytes:
+    # 24 bit length and 8 bit type share the first 32 bits
+    return FRAME_HEADER.pack(length << 8 | type_, flags, stream_id)
+
+
+def generate_settings_frame(settings: models.Settings) -> bytes:
+    """SETTINGS frame with every value that differs from the protocol default."""
+    payload = b""
+    for identifier, name in models.SETTING_MAPPING.items():
+        value = getattr(settings, name)
+        if value is None or value == getattr(models.DEFAULT_SETTINGS, name):
+            continue
+        payload += struct.pack(SETTINGS_FRAME_FORMAT, identifier, value)
+    return frame_header(len(payload), 0x4, 0, 0) + payload
+
+
+def generate_headers(stream_id: int, block: bytes, end_stream: bool) -> bytes:
+    # TODO: split into CONTINUATION frames above SETTINGS_MAX_FRAME_SIZE
+    flags = 0x4 | (0x1 if end_stream else 0)  # End headers, End Stream
+    return frame_header(len(block), 0x1, flags, stream_id) + block
+
+
+def generate_data(stream_id: int, data: bytes, end_stream: bool) -> bytes:
+    flags = 0x1 if end_stream else 0  # End Stream
+    return frame_header(len(data), 0x0, flags, stream_id) + data
+
+
+def generate_push_promise(stream_id: int, promised_id: int, block: bytes) -> bytes:
+    # Flags: End headers
+    header = frame_header(4 + len(block), 0x5, 0x4, stream_id)
+    return header + promised_id.to_bytes(4, "big") + block
+
+
 def generate_empty_settings_frame(ack=False):
-    res = b""
-    res += (0).to_bytes(3, "big", signed=False)  # Length
-    res += (0x4).to_bytes(1, "big", signed=False)  # Type
-    flag = 1 if ack else 0
-    res += flag.to_bytes(1, "big", signed=False)  # Flags
-    res += (0).to_bytes(4, "big", signed=False)  # Stream Id
-    assert len(res) == 9, len(res)
-    return res
-
-
-def generate_empty_200():
-    data = b"\x88"  # :status: 200 from static table
-
-    res = b""
-    res += len(data).to_bytes(3, "big", signed=False)  # Length
-    res += (0x1).to_bytes(1, "big", signed=False)  # Type
-    flag = 0x1 | 0x4  # End Stream, End headers
-    res += flag.to_bytes(1, "big", signed=False)  # Flags
-    res += (1).to_bytes(4, "big", signed=False)  # Stream Id
-    res += data
-    assert len(res) == 10, len(res)
-    return res
+    return frame_header(0, 0x4, 0x1 if ack else 0, 0)
+
+
+def generate_window_update(stream_id: int, incr: int) -> bytes:
+    return frame_header(4, 0x8, 0, stream_id) + incr.to_bytes(4, "big")
+
+
+def generate_ping(opaque_data: bytes | memoryview, ack: bool = False) -> bytes:
+    assert len(opaque_data) == 8, len(opaque_data)
+    return frame_header(8, 0x6, 0x1 if ack else 0x0, 0) + bytes(opaque_data)
+
+
+def generate_rst_stream(stream_id: int, error_code: int):
+    return frame_header(4, 0x3, 0, stream_id) + error_code.to_bytes(4, "big")
+
+
+def generate_goaway(last_stream_id: int, error_code: int, debug: bytes = b""):
+    payload = GOAWAY.pack(last_stream_id, error_code) + debug
+    return frame_header(len(payload), 0x7, 0, 0) + payload
+
+
+def generate_empty_200(stream_id: int = 1):
+    # :status: 200 from the static table; End Stream, End headers
+    return frame_header(1, 0x1, 0x1 | 0x4, stream_id) + b"\x88"
@@ -0,0 +1,313 @@
+from __future__ import annotations
+
+import enum
+import inspect
+import struct
+import zlib
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Coroutine
+from typing import Any
+
+from http2 import frames
+from http2 import handlers
+from http2 import models
+
+# Compressed-Flag (1 byte) + Message-Length (4 bytes), then the message
+MESSAGE_HEADER = struct.Struct(">BI")
+MESSAGE_HEADER_SIZE = 5
+
+# zlib wbits per grpc-encoding
+ENCODINGS = {"gzip": 31, "deflate": 15}
+ACCEPT_ENCODING = "identity," + ",".join(ENCODINGS)
+
+MAX_RECEIVE_MESSAGE_SIZE = 4 * 1024 * 1024
+# Queued but not yet sent bytes before ``Call.send`` waits for the client
+SEND_HIGH_WATER = 64 * 1024
+
+
+class Status(enum.IntEnum):
+    OK = 0
+    CANCELLED = 1
+    UNKNOWN = 2
+    INVALID_ARGUMENT = 3
+    DEADLINE_EXCEEDED = 4
+    NOT_FOUND = 5
+    RESOURCE_EXHAUSTED = 8
+    UNIMPLEMENTED = 12
+    INTERNAL = 13
+    UNAVAILABLE = 14
+
+
+class GrpcError(Exception):
+    """Raised by a method to end the call with ``status``."""
+
+    def __init__(self, status: Status, message: str = ""):
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+class MessageParser:
+    """Splits DATA chunks into messages as they arrive.
+
+    A message inside one chunk is returned as a view of it; only a message
+    split across DATA frames is assembled into a buffer of its own.
+    """
+
+    __slots__ = ("pending", "max_size")
+
+    def __init__(self, max_size: int = MAX_RECEIVE_MESSAGE_SIZE):
+        self.pending = bytearray()
+        self.max_size = max_size
+
+    def feed(self, chunk: memoryview) -> list[tuple[int, memoryview]]:
+        messages = []
+        pending = self.pending
+        while chunk:
+            if pending:
+                if len(pending) < MESSAGE_HEADER_SIZE:
+                    take = MESSAGE_HEADER_SIZE - len(pending)
+                else:
+                    length = MESSAGE_HEADER.unpack_from(pending)[1]
+                    take = MESSAGE_HEADER_SIZE + length - len(pending)
+                pending += chunk[:take]
+                chunk = chunk[take:]
+                if len(pending) < MESSAGE_HEADER_SIZE:
+                    continue
+                flag, length = MESSAGE_HEADER.unpack_from(pending)
+                self.check(length)
+                if len(pending) == MESSAGE_HEADER_SIZE + length:
+                    messages.append((flag, memoryview(pending)[MESSAGE_HEADER_SIZE:]))
+                    # The view keeps the old buffer
+                    pending = self.pending = bytearray()
+                continue
+            if len(chunk) >= MESSAGE_HEADER_SIZE:
+                flag, length = MESSAGE_HEADER.unpack_from(chunk)
+                self.check(length)
+                end = MESSAGE_HEADER_SIZE + length
+                if len(chunk) >= end:
+                    messages.append((flag, chunk[MESSAGE_HEADER_SIZE:end]))
+                    chunk = chunk[end:]
+                    continue
+            pending += chunk
+            break
+        return messages
+
+    def check(self, length: int) -> None:
+        if length > self.max_size:
+            raise GrpcError(
+                Status.RESOURCE_EXHAUSTED,
+                f"message of {length} bytes exceeds {self.max_size}",
+            )
+
+    def complete(self) -> bool:
+        return not self.pending
+
+
+def encode_message(message: bytes | memoryview, encoding: str | None) -> bytes:
+    if encoding is None:
+        return MESSAGE_HEADER.pack(0, len(message)) + message
+    compressor = zlib.compressobj(6, zlib.DEFLATED, ENCODINGS[encoding])
+    compressed = compressor.compress(message) + compressor.flush()
+    return MESSAGE_HEADER.pack(1, len(compressed)) + compressed
+
+
+def percent_encode(message: str) -> str:
+    # grpc-message: printable ASCII except "%" is sent as is
+    res = []
+    for byte in message.encode():
+        if 0x20 <= byte <= 0x7E and byte != 0x25:
+            res.append(chr(byte))
+        else:
+            res.append(f"%{byte:02X}")
+    return "".join(res)
+
+
+class Call:
+    """One RPC: iterate it for request messages, ``send`` responses."""
+
+    __slots__ = (
+        "client",
+        "stream",
+        "parser",
+        "encoding",
+        "send_encoding",
+        "headers_sent",
+        "finished",
+    )
+
+    def __init__(self, client: models.Client, stream: models.Stream):
+        assert stream.headers is not None
+        self.client = client
+        self.stream = stream
+        self.parser = MessageParser()
+        # Of compressed request messages
+        self.encoding = stream.headers.get("grpc-encoding")
+        if self.encoding == "identity":
+            self.encoding = None
+        # Of compressed response messages, if the client takes any
+        self.send_encoding = None
+        accepted = stream.headers.get("grpc-accept-encoding") or ""
+        for coding in accepted.split(","):
+            if coding.strip() in ENCODINGS:
+                self.send_encoding = coding.strip()
+                break
+        self.headers_sent = False
+        self.finished = False
+
+    @property
+    def path(self) -> str | None:
+        assert self.stream.headers is not None
+        return self.stream.headers.path
+
+    @property
+    def metadata(self):
+        return self.stream.headers
+
+    async def __aiter__(self) -> AsyncIterator[memoryview | bytes]:
+        body = self.stream.body
+        if body is None:
+            return
+        async for chunk in body:
+            for flag, message in self.parser.feed(chunk):
+                yield self.decode(flag, message)
+        if not self.parser.complete():
+            raise GrpcError(Status.INTERNAL, "truncated message")
+
+    def decode(self, flag: int, message: memoryview) -> memoryview | bytes:
+        if not flag:
+            return message
+        if self.encoding not in ENCODINGS:
+            raise GrpcError(
+                Status.UNIMPLEMENTED, f"unsupported grpc-encoding {self.encoding}"
+            )
+        decompressor = zlib.decompressobj(ENCODINGS[self.encoding])
+        res = decompressor.decompress(message, self.parser.max_size)
+        if decompressor.unconsumed_tail:
+            self.parser.check(self.parser.max_size + 1)
+        return res
+
+    def send_headers(self) -> None:
+        if self.headers_sent:
+            return
+        self.headers_sent = True
+        headers = [(":status", "200"), ("content-type", "application/grpc")]
+        if self.send_encoding is not None:
+            headers.append(("grpc-encoding", self.send_encoding))
+        headers.append(("grpc-accept-encoding", ACCEPT_ENCODING))
+        handlers.send_headers(self.client, self.stream, headers)
+
+    async def send(self, message: bytes | memoryview, compress: bool = False) -> None:
+        """Queue a response message, compressed if asked and the client can.
+
+        Waits while more than SEND_HIGH_WATER bytes are queued for the client.
+        """
+        assert not self.finished
+        self.send_headers()
+        encoding = self.send_encoding if compress else None
+        frames.send_data(
+            self.client,
+            self.stream,
+            encode_message(message, encoding),
+            end_stream=False,
+        )
+        if frames.queued(self.stream) > SEND_HIGH_WATER:
+            await handlers.drain(self.stream)
+
+    def finish(self, status: Status = Status.OK, message: str = "") -> None:
+        if self.finished:
+            return
+        self.finished = True
+        if self.stream.state == models.StreamState.closed:
+            return
+        trailers = [("grpc-status", str(int(status)))]
+        if message:
+            trailers.append(("grpc-message", percent_encode(message)))
+        if not self.headers_sent:
+            # Trailers-Only response
+            self.headers_sent = True
+            headers = [(":status", "200"), ("content-type", "application/grpc")]
+            handlers.send_headers(
+                self.client, self.stream, headers + trailers, end_stream=True
+            )
+            return
+        frames.send_trailers(self.client, self.stream, trailers)
+
+
+UnaryMethod = Callable[[Call, "memoryview | bytes"], "bytes | Awaitable[bytes]"]
+StreamMethod = Callable[[Call], Awaitable[None]]
+
+
+class Router:
+    """Dispatches gRPC calls by path, usable as ``Client.handler``.
+
+    router = grpc.Router()
+
+    @router.unary("/echo.Echo/Say")
+    async def say(call, request):
+        return bytes(request)
+
+    aio.Server(sock, server.handle_client, handler=router)
+    """
+
+    def __init__(self):
+        self.methods: dict[str, Callable[[Call], Awaitable[None]]] = {}
+
+    def unary(self, path: str) -> Callable[[UnaryMethod], UnaryMethod]:
+        """One request message in, one response message out."""
+
+        def decorator(method: UnaryMethod) -> UnaryMethod:
+            async def run(call: Call) -> None:
+                request = None
+                async for message in call:
+                    if request is not None:
+                        raise GrpcError(Status.INTERNAL, "more than one request")
+                    request = message
+                if request is None:
+                    raise GrpcError(Status.INTERNAL, "missing request message")
+                response = method(call, request)
+                if inspect.isawaitable(response):
+                    response = await response
+                await call.send(response)
+
+            self.methods[path] = run
+            return method
+
+        return decorator
+
+    def stream(self, path: str) -> Callable[[StreamMethod], StreamMethod]:
+        """Bidirectional streaming, the method reads and sends on ``call``."""
+
+        def decorator(method: StreamMethod) -> StreamMethod:
+            self.methods[path] = method
+            return method
+
+        return decorator
+
+    def __call__(
+        self, client: models.Client, stream: models.Stream
+    ) -> Coroutine[Any, Any, None] | None:
+        assert stream.headers is not None
+        content_type = stream.headers.get("content-type") or ""
+        if stream.headers.method != "POST" or not content_type.startswith(
+            "application/grpc"
+        ):
+            handlers.send_headers(client, stream, [(":status", "415")], True)
+            return None
+        return self.run(Call(client, stream))
+
+    async def run(self, call: Call) -> None:
+        method = self.methods.get(call.path or "")
+        try:
+            if method is None:
+                raise GrpcError(Status.UNIMPLEMENTED, f"unknown method {call.path}")
+            await method(call)
+        except GrpcError as e:
+            call.finish(e.status, e.message)
+        except Exception as e:
+            print("gRPC method failed", call.path, repr(e))
+            call.finish(Status.UNKNOWN, "method failed")
+        else:
+            call.finish()
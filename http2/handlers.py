@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Iterable
+
+from http2 import frames
+from http2 import hpack
+from http2 import models
+from http2 import push
+
+# A response can still be sent on the stream
+_RESPONDING = (
+    models.StreamState.open,
+    models.StreamState.half_closed_remote,
+    models.StreamState.reserved_local,
+)
+
+
+def send_headers(
+    client: models.Client,
+    stream: models.Stream,
+    headers: Iterable[tuple[str, str]],
+    end_stream: bool = False,
+) -> None:
+    if stream.state == models.StreamState.reserved_local:
+        # Response on a pushed stream
+        stream.state = models.StreamState.half_closed_remote
+    if stream.deadline is not None:
+        stream.deadline.cancel()
+    stream.response_started = True
+    block = hpack.encode(headers)
+    client.send_data += frames.generate_headers(stream.identifier, block, end_stream)
+    if end_stream:
+        frames.end_local(client, stream)
+    frames.wakeup(client)
+
+
+def send_informational(
+    client: models.Client,
+    stream: models.Stream,
+    status: int = 103,
+    headers: Iterable[tuple[str, str]] = (),
+) -> bool:
+    """Send an interim 1xx response, the final one follows with send_headers.
+
+    Leaves the stream open and its response deadline running. False when
+    the final response has started or the stream is closed.
+    """
+    # 101 Switching Protocols does not exist in HTTP/2
+    assert 100 <= status < 200 and status != 101, status
+    if stream.response_started or stream.state not in _RESPONDING:
+        return False
+    if stream.state == models.StreamState.reserved_local:
+        stream.state = models.StreamState.half_closed_remote
+    block = hpack.encode([(":status", str(status)), *headers])
+    client.send_data += frames.generate_headers(stream.identifier, block, False)
+    frames.wakeup(client)
+    return True
+
+
+async def drain(stream: models.Stream) -> None:
+    """Wait until DATA queued on ``stream`` went out to the client."""
+    if not frames.queued(stream) or stream.state == models.StreamState.closed:
+        return
+    future = asyncio.get_running_loop().create_future()
+
+    def done() -> None:
+        if not future.done():
+            future.set_result(None)
+
+    stream.on_drained = done
+    await future
+
+
+def early_hints(
+    client: models.Client, stream: models.Stream, links: Iterable[str]
+) -> bool:
+    """103 Early Hints with a ``link`` field per entry, see hints.Manifest."""
+    return send_informational(client, stream, 103, [("link", link) for link in links])
+
+
+def respond(
+    client: models.Client,
+    stream: models.Stream,
+    status: int = 200,
+    headers: Iterable[tuple[str, str]] = (),
+    body: bytes = b"",
+) -> None:
+    """Send a complete response.
+
+    ``link: <...>; rel=preload`` headers are promised to the client first, the
+    promised responses are produced by ``client.handler`` after this one.
+    """
+    pushed = _start_response(client, stream, status, headers, not body)
+    if body:
+        frames.send_data(client, stream, body, end_stream=True)
+    _run_pushed(client, pushed)
+
+
+def respond_headers(
+    client: models.Client,
+    stream: models.Stream,
+    status: int = 200,
+    headers: Iterable[tuple[str, str]] = (),
+) -> None:
+    """Send response headers only, the body follows with frames.send_data."""
+    pushed = _start_response(client, stream, status, headers, False)
+    _run_pushed(client, pushed)
+
+
+def _start_response(
+    client: models.Client,
+    stream: models.Stream,
+    status: int,
+    headers: Iterable[tuple[str, str]],
+    end_stream: bool,
+) -> list[models.Stream]:
+    headers = list(headers)
+    push.remember(client, stream)
+    pushed = push.push_preloads(client, stream, headers)
+    send_headers(client, stream, [(":status", str(status)), *headers], end_stream)
+    return pushed
+
+
+def _run_pushed(client: models.Client, pushed: list[models.Stream]) -> None:
+    if client.handler is None:
+        return
+    for pushed_stream in pushed:
+        frames.run_handler(client, pushed_stream)
@@ -0,0 +1,81 @@
+"""Zero-downtime restart by passing the listening socket to a new process.
+
+The running process listens on a Unix domain socket. A new process connects
+to it and receives the listening socket's file descriptor (SCM_RIGHTS), starts
+accepting on it and only then the old process stops accepting and drains.
+The kernel keeps the listening socket open throughout, so connections are
+never refused.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+
+HANDOFF_MESSAGE = b"http2-listener"
+CONFIRMATION = b"\x00"
+
+
+def listen(path: str) -> socket.socket:
+    """Bind the Unix socket successors connect to."""
+    if os.path.exists(path):
+        # Left over by the process we inherited the listener from
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(1)
+    sock.setblocking(False)
+    return sock
+
+
+async def wait_for_successor(
+    handoff_sock: socket.socket, listener: socket.socket, timeout: float = 10.0
+) -> bool:
+    """Hand ``listener`` to the first process that connects to ``handoff_sock``.
+
+    Returns False if the successor did not confirm within ``timeout`` seconds
+    that it is accepting; ``handoff_sock`` stays open for the next attempt.
+    """
+    loop = asyncio.get_running_loop()
+    conn, _ = await loop.sock_accept(handoff_sock)
+    with conn:
+        conn.setblocking(True)
+        socket.send_fds(conn, [HANDOFF_MESSAGE], [listener.fileno()])
+        conn.setblocking(False)
+        # Wait until the successor confirms it is accepting, EOF means it
+        # failed to start
+        try:
+            confirmation = await asyncio.wait_for(loop.sock_recv(conn, 1), timeout)
+        except (asyncio.TimeoutError, OSError):
+            confirmation = b""
+    if confirmation != CONFIRMATION:
+        print("Successor did not take over the listening socket")
+        return False
+    # The path now belongs to the successor, do not unlink it
+    handoff_sock.close()
+    print("Listening socket handed off")
+    return True
+
+
+def receive_listener(path: str) -> tuple[socket.socket, socket.socket]:
+    """Fetch the listening socket from the running process.
+
+    Returns the listener and the connection to the old process; close the
+    latter once the listener is being served to let the old process drain.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(path)
+    msg, fds, _, _ = socket.recv_fds(conn, len(HANDOFF_MESSAGE), 1)
+    if msg != HANDOFF_MESSAGE or len(fds) != 1:
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+        raise ConnectionError("Bad listening socket handoff")
+    listener = socket.socket(fileno=fds[0])
+    print("Listening socket received", listener.getsockname())
+    return listener, conn
+
+
+def confirm(conn: socket.socket) -> None:
+    conn.sendall(CONFIRMATION)
+    conn.close()
@@ -0,0 +1,132 @@
+"""103 Early Hints (RFC 8297) from a per-route preload manifest.
+
+While a slow handler works on the response, the browser can already fetch
+the stylesheets, scripts and fonts the page needs. The manifest maps
+request paths (without the query) to what they preload, either a target
+whose ``as`` is guessed from its extension or the link parameters:
+
+    {
+        "/": ["/static/app.css", "/static/app.js"],
+        "/checkout": [{"href": "/static/pay.js", "as": "script"}]
+    }
+
+``Manifest.wrap`` sends the hints right before the handler runs. They are
+written out with the rest of the read, so a coroutine handler gets them to
+the client while it awaits; a blocking handler sends them together with
+its response.
+
+    manifest = hints.Manifest.load("preload.json")
+    aio.Server(sock, server.handle_client, handler=manifest.wrap(handler))
+"""
+from __future__ import annotations
+
+import json
+import posixpath
+from collections.abc import Callable
+from collections.abc import Coroutine
+from collections.abc import Iterable
+from collections.abc import Mapping
+from typing import Any
+
+from http2 import handlers
+from http2 import models
+
+Handler = Callable[[models.Client, models.Stream], Coroutine[Any, Any, None] | None]
+Entry = str | Mapping[str, Any]
+
+AS_BY_EXTENSION = {
+    ".css": "style",
+    ".js": "script",
+    ".mjs": "script",
+    ".woff2": "font",
+    ".woff": "font",
+    ".ttf": "font",
+    ".avif": "image",
+    ".gif": "image",
+    ".jpg": "image",
+    ".jpeg": "image",
+    ".png": "image",
+    ".svg": "image",
+    ".webp": "image",
+    ".json": "fetch",
+}
+# Fetched in CORS mode, a preload without crossorigin is not used
+CORS_AS = frozenset(("font", "fetch"))
+
+
+def preload_link(
+    href: str,
+    as_: str | None = None,
+    *,
+    type_: str | None = None,
+    crossorigin: bool | None = None,
+) -> str:
+    """A ``link`` field value, ``<href>; rel=preload; as=...``."""
+    params = [f"<{href}>", "rel=preload"]
+    if as_ is None:
+        as_ = AS_BY_EXTENSION.get(posixpath.splitext(href.partition("?")[0])[1])
+    if as_ is not None:
+        params.append(f"as={as_}")
+    if type_ is not None:
+        params.append(f'type="{type_}"')
+    if crossorigin or crossorigin is None and as_ in CORS_AS:
+        params.append("crossorigin")
+    return "; ".join(params)
+
+
+def entry_link(entry: Entry) -> str:
+    if isinstance(entry, str):
+        return preload_link(entry)
+    return preload_link(
+        entry["href"],
+        entry.get("as"),
+        type_=entry.get("type"),
+        crossorigin=entry.get("crossorigin"),
+    )
+
+
+class Manifest:
+    """Request path -> ``link`` values sent as 103 Early Hints."""
+
+    def __init__(self, routes: Mapping[str, Iterable[Entry]] | None = None):
+        self.routes: dict[str, list[str]] = {}
+        for path, entries in (routes or {}).items():
+            self.add(path, *entries)
+
+    @classmethod
+    def load(cls, path: str) -> Manifest:
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def add(self, path: str, *entries: Entry) -> None:
+        self.routes.setdefault(path, []).extend(entry_link(e) for e in entries)
+
+    def links(self, path: str | None) -> list[str]:
+        if path is None:
+            return []
+        return self.routes.get(path.partition("?")[0], [])
+
+    def hint(self, client: models.Client, stream: models.Stream) -> bool:
+        """Send the hints of the request on ``stream``, False when there are
+        none or the response already started."""
+        request = stream.headers
+        # Pushed streams are not requested by the browser
+        if request is None or not stream.identifier & 1:
+            return False
+        if request.method not in ("GET", "HEAD"):
+            return False
+        links = self.links(request.path)
+        if not links:
+            return False
+        return handlers.early_hints(client, stream, links)
+
+    def wrap(self, handler: Handler) -> Handler:
+        """``handler`` preceded by the hints of each request."""
+
+        def hinted(
+            client: models.Client, stream: models.Stream
+        ) -> Coroutine[Any, Any, None] | None:
+            self.hint(client, stream)
+            return handler(client, stream)
+
+        return hinted
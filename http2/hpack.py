@@ -1,9 +1,13 @@
 from __future__ import annotations
 
 import dataclasses
+import time
+from collections.abc import Iterable
 from collections.abc import Iterator
 
 from http2 import huffman
+from http2 import interning
+from http2 import profiling
 
 
 @dataclasses.dataclass(slots=True, kw_only=True, frozen=True)
@@ -82,60 +86,59 @@ STATIC_TABLE: list[Header | None] = [
 
 assert len(STATIC_TABLE[1:]) == 61
 
+interning.POOL.seed(
+    s
+    for header in STATIC_TABLE[1:]
+    for s in (header.key, header.value)
+    if s is not None
+)
+
 
 class HPack:
+    __slots__ = ("max_table_size", "table_size", "size", "dynamic_indexes")
+
     def __init__(self, max_table_size: int):
-        # self.result: list[Header] = []
+        # SETTINGS_HEADER_TABLE_SIZE, the limit for Dynamic Table Size Updates
         self.max_table_size = max_table_size
-        # self.new_max_table_size: int | None = None
-        # TODO: To limit the
-        #    memory requirements of the decoder, the dynamic table size is
-        #    strictly bounded (see Section 4.2).
-
-        # FIFO
-        # TODO: The header field is inserted at the beginning of the dynamic
-        #       table.  This insertion could result in the eviction of previous
-        #       entries in the dynamic table (see Section 4.4).
-
-        # TODO:    The size of the dynamic table is the sum of the size of its entries.
-        #    The size of an entry is the sum of its name's length in octets (as
-        #    defined in Section 5.2), its value's length in octets, and 32.
-        #    The size of an entry is calculated using the length of its name and
-        #    value without any Huffman encoding applied.
-
-        # -1 will be the first entry to not to insert into index 0, but to the end
-        # self.dynamic_table = ""
-        # self.dynamic_indexes: list[tuple[int, int]] = []
+        # Current limit, set by the encoder with Dynamic Table Size Updates
+        self.table_size = max_table_size
+        # Sum of the entry sizes, see entry_size
+        self.size = 0
+        # Oldest entry first, the newest is index 62
         self.dynamic_indexes: list[Header] = []
         print("HPack INIT")
 
     def change_max_table_size(self, max_table_size: int):
         self.max_table_size = max_table_size
-        # TODO: change dynamic table accordingly
-        #  This ensures that the
-        #    decoder is able to perform eviction based on reductions in dynamic
-        #    table size (see Section 4.3).
-        #    This mechanism can be used to completely clear entries from the
-        #    dynamic table by setting a maximum size of 0, which can subsequently
-        #    be restored.
-        #    Whenever the maximum size for the dynamic table is reduced, entries
-        #    are evicted from the end of the dynamic table until the size of the
-        #    dynamic table is less than or equal to the maximum size.
+        if self.table_size > max_table_size:
+            self.change_table_size(max_table_size)
 
     def change_table_size(self, table_size: int):
-        pass
+        # 0 clears the table, a later update may raise the limit again
+        self.table_size = table_size
+        self.evict(0)
+
+    def evict(self, room: int) -> None:
+        """Drop the oldest entries until ``room`` bytes fit (RFC 7541 4.4)."""
+        entries = self.dynamic_indexes
+        limit = self.table_size - room
+        count = 0
+        while self.size > limit and count < len(entries):
+            self.size -= entry_size(entries[count])
+            count += 1
+        if count:
+            del entries[:count]
 
     def add_to_dynamic_table(self, header: Header):
-        # todo:    Before a new entry is added to the dynamic table, entries are evicted
-        #    from the end of the dynamic table until the size of the dynamic table
-        #    is less than or equal to (maximum size - new entry size) or until the
-        #    table is empty.
-        #   If the size of the new entry is less than or equal to the maximum
-        #   size, that entry is added to the table.  It is not an error to
-        #   a ttempt to add an entry that is larger than the maximum size; an
-        #   attempt to add an entry larger than the maximum size causes the table
-        #   to be emptied of all existing entries and results in an empty table.
+        size = entry_size(header)
+        if size > self.table_size:
+            # Not an error: the table ends up empty
+            self.dynamic_indexes.clear()
+            self.size = 0
+            return
+        self.evict(size)
         self.dynamic_indexes.append(header)
+        self.size += size
 
     def get_from_tables(
         self, index: int, value_must: bool
@@ -156,12 +159,10 @@ class HPack:
             return False, -8
         return True, header
 
-    def decode(self, data: bytes) -> Iterator[tuple[bool, int | Header]]:
+    def decode(self, data: bytes) -> tuple[bool, HeaderList | int]:
+        headers = HeaderList()
         can_dyn_change = True
-        while True:
-            if not data:
-                return
-
+        while data:
             byte, data = data[0], data[1:]
 
             # Indexed Header Field
@@ -169,96 +170,83 @@ class HPack:
                 can_dyn_change = False
                 success, index, data = decode_int(7, byte & 0x7F, data)
                 if not success:
-                    yield False, index
-                    return
+                    return False, index
 
                 if index == 0:
-                    yield False, -5
-                    return
+                    return False, -5
 
                 success, header = self.get_from_tables(index, value_must=True)
-                yield success, header
                 if not success:
-                    return
-
+                    return False, header
+                headers.append(header.key, header.value)
                 continue
 
             # Literal Header Field with Incremental Indexing
             if (byte >> 6) == 1:
                 can_dyn_change = False
-                success, index, data = decode_int(6, byte & 0x3F, data)
-                if not success:
-                    yield False, index
-                    return
-
-                if index == 0:  # field name is represented as a string literal
-                    success, header_key, data = decode_str(data)
-                    if not success:
-                        yield False, header_key
-                else:
-                    success, header = self.get_from_tables(index, value_must=False)
-                    if not success:
-                        yield False, header
-                    header_key: str = header.key
-
-                success, header_value, data = decode_str(data)
+                success, key, value, data = self.decode_literal(6, byte, data)
                 if not success:
-                    yield False, header_value
+                    return False, key
 
-                header = Header(key=header_key, value=header_value)
+                # Table entries outlive the block, they are decoded right away
+                header = Header(key=as_str(key), value=as_str(value))
                 self.add_to_dynamic_table(header)  # TODO: check error
-                yield True, header
+                headers.append(header.key, header.value)
                 continue
 
             # Literal Header Field without Indexing; Literal Header Field Never Indexed
             if (byte >> 4) in [0, 1]:
                 # TODO: something with: Intermediaries MUST use the same representation
                 #    for encoding this header field.
-                # TODO: same code
                 can_dyn_change = False
-                success, index, data = decode_int(4, byte & 0x0F, data)
-                if not success:
-                    yield False, index
-                    return
-
-                if index == 0:  # field name is represented as a string literal
-                    success, header_key, data = decode_str(data)
-                    if not success:
-                        yield False, header_key
-                else:
-                    success, header = self.get_from_tables(index, value_must=False)
-                    if not success:
-                        yield False, header
-                    header_key: str = header.key
-
-                success, header_value, data = decode_str(data)
+                success, key, value, data = self.decode_literal(4, byte, data)
                 if not success:
-                    yield False, header_value
+                    return False, key
 
-                header = Header(key=header_key, value=header_value)
-                self.add_to_dynamic_table(header)  # TODO: check error
-                yield True, header
+                # Not added to the dynamic table, and decoded only when read
+                headers.append(key, value)
                 continue
 
             # Dynamic Table Size Update
             if (byte >> 5) == 1:
                 # Updates can occur only at the beginning of the block
                 if not can_dyn_change:
-                    yield False, -14
-                    return
+                    return False, -14
 
                 success, size, data = decode_int(5, byte & 0x1F, data)
                 if not success:
-                    yield False, size
-                    return
+                    return False, size
                 if size > self.max_table_size:
-                    yield False, -9
-                    return
+                    return False, -9
                 self.change_table_size(size)
                 print("HPACK: Dynamic Table Size Update", size)
                 continue
 
             raise NotImplementedError
+        return True, headers
+
+    def decode_literal(
+        self, n_bits: int, byte: int, data: bytes
+    ) -> tuple[bool, str | bytes | int, bytes | None, bytes]:
+        success, index, data = decode_int(n_bits, byte & (2**n_bits - 1), data)
+        if not success:
+            return False, index, None, data
+
+        key: str | bytes | int
+        if index == 0:  # field name is represented as a string literal
+            success, key, data = decode_str(data)
+            if not success:
+                return False, key, None, data
+        else:
+            success, header = self.get_from_tables(index, value_must=False)
+            if not success:
+                return False, header, None, data
+            key = header.key
+
+        success, value, data = decode_str(data)
+        if not success:
+            return False, value, None, data
+        return True, key, value, data
 
     # def finalize(self) -> dict[str, list[str]]:
     #     return self.result
@@ -286,7 +274,10 @@ def decode_int(n_bits: int, first_byte: int, data: bytes) -> tuple[bool, int, by
     return True, i, data
 
 
-def decode_str(data: bytes) -> tuple[bool, str | int, bytes]:
+HUFFMAN_PHASE = profiling.phase("huffman")
+
+
+def decode_str(data: bytes) -> tuple[bool, bytes | int, bytes]:
     if not data:
         return False, -3, data
 
@@ -301,8 +292,171 @@ def decode_str(data: bytes) -> tuple[bool, str | int, bytes]:
     raw, data = data[:length], data[length:]
 
     if not _huffman:
-        s = raw.decode()
-        return True, s, data
+        return True, bytes(raw), data
 
+    start = time.perf_counter_ns()
     success, s = huffman.decode_huffman(raw)
+    HUFFMAN_PHASE.add(time.perf_counter_ns() - start)
     return success, s, data
+
+
+def entry_size(header: Header) -> int:
+    """Octets of name and value without Huffman coding, plus 32 (RFC 7541 4.1)."""
+    value = header.value or ""
+    return len(header.key.encode()) + len(value.encode()) + 32
+
+
+def as_str(s: str | bytes) -> str:
+    if type(s) is str:
+        return s
+    return interning.POOL.get(s)
+
+
+class HeaderList:
+    """Decoded header block.
+
+    Field names and values stay bytes until they are read, so headers the
+    application never looks at (large cookies, ...) are never decoded.
+    Pseudo-header fields are always needed and kept decoded in ``pseudo``.
+    """
+
+    __slots__ = ("names", "values", "pseudo")
+
+    def __init__(self):
+        self.pseudo: dict[str, str] = {}
+        self.names: list[str] = []
+        self.values: list[str | bytes] = []
+
+    def append(self, key: str | bytes, value: str | bytes) -> None:
+        # Names are few and compared often: interned right away
+        key = as_str(key)
+        if key[:1] == ":":
+            self.pseudo[key] = as_str(value)
+            return
+        self.names.append(key)
+        self.values.append(value)
+
+    @property
+    def method(self) -> str | None:
+        return self.pseudo.get(":method")
+
+    @property
+    def path(self) -> str | None:
+        return self.pseudo.get(":path")
+
+    @property
+    def scheme(self) -> str | None:
+        return self.pseudo.get(":scheme")
+
+    @property
+    def authority(self) -> str | None:
+        return self.pseudo.get(":authority")
+
+    def _find(self, key: str, start: int = 0) -> int:
+        names = self.names
+        for i in range(start, len(names)):
+            # Identity check when ``key`` is interned as well
+            if names[i] == key:
+                return i
+        return -1
+
+    def _value(self, i: int) -> str:
+        value = self.values[i]
+        if type(value) is not str:
+            value = self.values[i] = interning.POOL.get(value)
+        return value
+
+    def get(self, key: str, default: str | None = None) -> str | None:
+        if key[:1] == ":":
+            return self.pseudo.get(key, default)
+        i = self._find(key)
+        if i == -1:
+            return default
+        return self._value(i)
+
+    def get_all(self, key: str) -> list[str]:
+        res = []
+        i = self._find(key)
+        while i != -1:
+            res.append(self._value(i))
+            i = self._find(key, i + 1)
+        return res
+
+    def get_raw(self, key: str) -> bytes | None:
+        """Value without decoding it to str."""
+        i = self._find(key)
+        if i == -1:
+            return None
+        value = self.values[i]
+        return value.encode() if type(value) is str else value
+
+    def __len__(self) -> int:
+        return len(self.pseudo) + len(self.names)
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        yield from self.pseudo.items()
+        for i in range(len(self.names)):
+            yield self.names[i], self._value(i)
+
+    def __repr__(self) -> str:
+        return f"HeaderList({self.pseudo}, {len(self.names)} fields)"
+
+
+# Encoder side: only the static table is used, every other field is sent as
+# a literal without indexing, so no encoder dynamic table state is needed.
+STATIC_FIELD_INDEX: dict[tuple[str, str | None], int] = {}
+STATIC_NAME_INDEX: dict[str, int] = {}
+for _index, _header in enumerate(STATIC_TABLE):
+    if _header is None:
+        continue
+    STATIC_FIELD_INDEX.setdefault((_header.key, _header.value), _index)
+    STATIC_NAME_INDEX.setdefault(_header.key, _index)
+
+
+def encode(headers: Iterable[tuple[str, str]]) -> bytes:
+    # Appended in place, then copied out once
+    res = bytearray()
+    for key, value in headers:
+        index = STATIC_FIELD_INDEX.get((key, value))
+        if index is not None:
+            # Indexed Header Field
+            res += encode_int(7, 0x80, index)
+            continue
+        # Literal Header Field without Indexing
+        index = STATIC_NAME_INDEX.get(key)
+        if index is not None:
+            res += encode_int(4, 0x00, index)
+        else:
+            res.append(0x00)
+            write_str(res, key)
+        write_str(res, value)
+    return bytes(res)
+
+
+def encode_int(n_bits: int, prefix: int, value: int) -> bytes:
+    limit = 2**n_bits - 1
+    if value < limit:
+        return bytes([prefix | value])
+    res = bytearray([prefix | limit])
+    value -= limit
+    while value >= 128:
+        res.append((value & 127) | 128)
+        value >>= 7
+    res.append(value)
+    return bytes(res)
+
+
+def encode_str(s: str) -> bytes:
+    res = bytearray()
+    write_str(res, s)
+    return bytes(res)
+
+
+def write_str(res: bytearray, s: str) -> None:
+    # TODO: Huffman encode when shorter
+    raw = s.encode()
+    if len(raw) < 0x7F:
+        res.append(len(raw))
+    else:
+        res += encode_int(7, 0x00, len(raw))
+    res += raw
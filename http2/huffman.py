@@ -392,7 +392,7 @@ def _traverse_tree(
     raise NotImplementedError
 
 
-def decode_huffman(data: bytes) -> tuple[bool, str | int]:
+def decode_huffman(data: bytes) -> tuple[bool, bytes | int]:
     global TREE
 
     bin_string = "".join(format(byte, "08b") for byte in data)
@@ -412,12 +412,10 @@ def decode_huffman(data: bytes) -> tuple[bool, str | int]:
         if byte == 256:  # EOS encountered
             return False, -11
         raw_bytes.append(byte)
-    raw = bytes(raw_bytes)
-    s = raw.decode()
-    return True, s
+    return True, bytes(raw_bytes)
 
 
 assert decode_huffman(b"\xf1\xe3\xc2\xe5\xf2\x3a\x6b\xa0\xab\x90\xf4\xff") == (
     True,
-    "www.example.com",
+    b"www.example.com",
 )
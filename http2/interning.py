@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import collections
+import dataclasses
+import threading
+from collections.abc import Iterable
+
+
+@dataclasses.dataclass(kw_only=True, slots=True)
+class InternStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    # Too long to be worth caching (cookies, ...)
+    skipped: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class InternPool:
+    """Process-wide bytes -> str cache for decoded header names and values.
+
+    Every connection decodes the same names and many of the same values; with
+    the pool they share one str object, so comparisons against other interned
+    strings are identity checks. Seeded entries are never evicted, the rest
+    is bounded to ``max_size`` entries and evicted oldest first.
+
+    Shared by the event loops of every thread: seeded entries are read
+    without locking, the bounded part is guarded by ``lock``. Statistics
+    may undercount when loops run truly in parallel.
+    """
+
+    __slots__ = ("max_size", "max_length", "pinned", "entries", "stats", "lock")
+
+    def __init__(self, *, max_size: int = 4_096, max_length: int = 64):
+        self.max_size = max_size
+        self.max_length = max_length
+        self.pinned: dict[bytes, str] = {}
+        self.entries: collections.OrderedDict[bytes, str] = collections.OrderedDict()
+        self.stats = InternStats()
+        self.lock = threading.Lock()
+
+    def seed(self, strings: Iterable[str]) -> None:
+        for s in strings:
+            self.pinned.setdefault(s.encode(), s)
+
+    def get(self, raw: bytes) -> str:
+        s = self.pinned.get(raw)
+        if s is not None:
+            self.stats.hits += 1
+            return s
+        if len(raw) > self.max_length:
+            self.stats.skipped += 1
+            return str(raw, "utf-8")
+
+        with self.lock:
+            s = self.entries.get(raw)
+            if s is not None:
+                self.stats.hits += 1
+                return s
+            s = str(raw, "utf-8")
+            self.stats.misses += 1
+            if len(self.entries) >= self.max_size:
+                self.entries.popitem(last=False)
+                self.stats.evictions += 1
+            self.entries[raw] = s
+            return s
+
+
+POOL = InternPool()
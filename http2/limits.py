@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import dataclasses
+from collections.abc import Mapping
+
+
+@dataclasses.dataclass(kw_only=True, slots=True, frozen=True)
+class Rate:
+    per_second: float
+    burst: float
+
+
+@dataclasses.dataclass(kw_only=True, slots=True, frozen=True)
+class FrameLimits:
+    """Per connection limits, shared by every connection of a server."""
+
+    rates: Mapping[str, Rate] = dataclasses.field(
+        default_factory=lambda: {
+            "headers": Rate(per_second=1_000, burst=500),
+            # HEADERS + RST_STREAM "rapid reset"
+            "rst_stream": Rate(per_second=100, burst=200),
+            "settings": Rate(per_second=10, burst=20),
+            "ping": Rate(per_second=10, burst=20),
+            "control": Rate(per_second=1_000, burst=1_000),
+            # DATA / CONTINUATION without payload and without END_STREAM
+            "empty": Rate(per_second=100, burst=100),
+        }
+    )
+    # Limit hits of one frame class tolerated before GOAWAY(ENHANCE_YOUR_CALM),
+    # forgiven once its bucket has refilled
+    max_strikes: int = 10
+    # Seconds of frame processing per read before yielding to other
+    # connections. Wall clock: the loop is single threaded and parsing is CPU
+    # bound, and it is much cheaper to read than the thread CPU clock.
+    cpu_budget: float = 0.005
+
+
+DEFAULT_LIMITS = FrameLimits()
+
+
+@dataclasses.dataclass(kw_only=True, slots=True)
+class TokenBucket:
+    tokens: float
+    # time.perf_counter seconds
+    updated: float
+    # Limit hits since the bucket was last full
+    strikes: int = 0
+
+
+def frame_class(type_: int, flags: int, length: int) -> str | None:
+    if type_ == 0x1:
+        return "headers"
+    if type_ == 0x3:
+        return "rst_stream"
+    if type_ == 0x4:
+        return "settings"
+    if type_ == 0x6:
+        return "ping"
+    if type_ in (0x2, 0x8):  # PRIORITY, WINDOW_UPDATE
+        return "control"
+    if type_ in (0x0, 0x9) and length == 0 and not flags & 0x1:
+        return "empty"
+    return None
+
+
+def full(bucket: TokenBucket, rate: Rate, now: float) -> bool:
+    """Whether the bucket refilled, a new one would be no different."""
+    return bucket.tokens + (now - bucket.updated) * rate.per_second >= rate.burst
+
+
+def take(bucket: TokenBucket, rate: Rate, now: float) -> bool:
+    """Take a token, counting a strike if there is none."""
+    if full(bucket, rate, now):
+        bucket.tokens = rate.burst
+        bucket.strikes = 0
+    else:
+        bucket.tokens += (now - bucket.updated) * rate.per_second
+    bucket.updated = now
+    if bucket.tokens < 1:
+        bucket.strikes += 1
+        return False
+    bucket.tokens -= 1
+    return True
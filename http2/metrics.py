@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import dataclasses
+import threading
+
+from http2 import buffers
+from http2 import interning
+from http2 import profiling
+
+
+@dataclasses.dataclass(kw_only=True, slots=True)
+class Metrics:
+    # Streams currently open across all connections of the process
+    streams_active: int = 0
+    streams_peak: int = 0
+    streams_total: int = 0
+    # Frame class -> how often its rate limit was hit
+    limits_triggered: dict[str, int] = dataclasses.field(default_factory=dict)
+    # Reads cut short by the per-connection CPU budget
+    budget_exhausted: int = 0
+    # Connections closed with GOAWAY(ENHANCE_YOUR_CALM)
+    enhance_your_calm: int = 0
+    # Requests answered by another request's handler run, see coalesce
+    coalesced_streams: int = 0
+    # DATA bytes those requests got without producing them again
+    coalesced_bytes: int = 0
+    # Requests that stopped waiting for a shared run and ran their own
+    coalesce_wait_expired: int = 0
+
+
+METRICS = Metrics()
+# Event loops may run in several threads, see server.serve_threads
+LOCK = threading.Lock()
+
+
+def stream_opened() -> None:
+    with LOCK:
+        METRICS.streams_active += 1
+        METRICS.streams_total += 1
+        if METRICS.streams_active > METRICS.streams_peak:
+            METRICS.streams_peak = METRICS.streams_active
+
+
+def stream_closed() -> None:
+    with LOCK:
+        METRICS.streams_active -= 1
+
+
+def limit_triggered(name: str) -> None:
+    with LOCK:
+        METRICS.limits_triggered[name] = METRICS.limits_triggered.get(name, 0) + 1
+
+
+def increment(name: str, amount: int = 1) -> None:
+    with LOCK:
+        setattr(METRICS, name, getattr(METRICS, name) + amount)
+
+
+def report() -> None:
+    with LOCK:
+        print("Metrics", METRICS)
+    stats = interning.POOL.stats
+    print(f"Intern pool hit rate {stats.hit_rate:.1%}", stats)
+    buffers.POOL.report()
+    profiling.report()
@@ -2,48 +2,125 @@ from __future__ import annotations
 
 import dataclasses
 import enum
+import time
+from collections.abc import Callable
+from collections.abc import Coroutine
 from collections.abc import Mapping
+from typing import Any
+from typing import NamedTuple
 
+from http2 import admission
+from http2.body import RequestBody
+from http2 import buffers
+from http2 import flow
 from http2 import hpack
-
-
-def default_settings() -> Settings:
-    # TODO: fill default settings
-    return Settings()
-
-
-def default_streams() -> dict[int, Stream]:
-    return {0: Stream(identifier=0)}
-
-
-def default_decoder() -> hpack.HPack:
-    return hpack.HPack(max_table_size=default_settings().header_table_size)
-
-
-@dataclasses.dataclass(kw_only=True, slots=True)
-class FrameHeader:
-    length: int
+from http2 import limits
+from http2 import timers
+
+
+def get_decoder(client: Client) -> hpack.HPack:
+    # Created on the first header block, see shed_idle_state
+    if client.decoder is None:
+        client.decoder = hpack.HPack(
+            max_table_size=client.local_settings.header_table_size
+        )
+    return client.decoder
+
+
+def shed_idle_state(client: Client) -> None:
+    """Drop per-connection state an idle connection can recreate on demand."""
+    if client.rest_data or client.send_data:
+        return
+    # An empty dynamic table is indistinguishable from a fresh decoder
+    if client.decoder is not None and not client.decoder.dynamic_indexes:
+        client.decoder = None
+    if not client.pending_window_updates:
+        client.pending_window_updates = None
+    buckets = client.frame_buckets
+    if buckets is not None:
+        # Partly drained buckets stay, dropping them would hand out a burst
+        now = time.perf_counter()
+        rates = client.frame_limits.rates
+        for name, bucket in list(buckets.items()):
+            if limits.full(bucket, rates[name], now):
+                del buckets[name]
+        if not buckets:
+            client.frame_buckets = None
+
+
+class FrameHeader(NamedTuple):
     type: int
     flags: int
     stream_id: int
-    failure: bool = False
+    # Where the payload starts in the buffer the frame was extracted from
+    offset: int
+    length: int
 
 
 @dataclasses.dataclass(kw_only=True, slots=True)
 class Client:
     phase: int = 0
     rest_data: bytes = b""
-    send_data: bytes = b""
+    # Appended to in place, the backend hands it to the transport as it is
+    # and starts a new one
+    send_data: bytearray = dataclasses.field(default_factory=bytearray)
     need_close: bool = False
-    last_header: FrameHeader | None = None
+    # Highest stream id processed, reported in GOAWAY
+    last_stream_id: int = 0
+    last_pushed_stream_id: int = 0
+    goaway_sent: bool = False
 
     # TODO: MUST be received / sent first
     settings_received: bool = False
-    local_settings: Settings = dataclasses.field(default_factory=default_settings)
-    remote_settings: Settings = dataclasses.field(default_factory=default_settings)
-    decoder: hpack.HPack = dataclasses.field(default_factory=default_decoder)
-
-    streams: dict[int, Stream] = dataclasses.field(default_factory=default_streams)
+    # Our SETTINGS were sent and not acknowledged yet
+    settings_ack_pending: bool = False
+    # Shared until the peer changes something, see frames.set_settings
+    local_settings: Settings = dataclasses.field(
+        default_factory=lambda: DEFAULT_SETTINGS
+    )
+    remote_settings: Settings = dataclasses.field(
+        default_factory=lambda: DEFAULT_SETTINGS
+    )
+    decoder: hpack.HPack | None = None
+
+    # Connection-level (stream 0) flow control
+    flow_control: int = 65_535
+    recv_window: int = 65_535
+    recv_consumed: int = 0
+
+    streams: dict[int, Stream] = dataclasses.field(default_factory=dict)
+    # Called with every new request stream once its headers are decoded,
+    # None answers everything with an empty 200. A coroutine it returns is
+    # run by the backend, see spawn
+    handler: Callable[[Client, Stream], Coroutine[Any, Any, None] | None] | None = None
+    # Provided by the event loop backend: run a callback on the connection's
+    # loop from any thread and write out what it queued
+    call_soon_threadsafe: Callable[[Callable[[], None]], None] | None = None
+    # Provided by the event loop backend: write out what was queued outside
+    # handle_client, e.g. by a coroutine handler, soon
+    wakeup: Callable[[], None] | None = None
+    # Provided by the event loop backend: run the coroutine a handler
+    # returned for a stream, resetting the stream if it fails
+    spawn: Callable[[Stream, Coroutine[Any, Any, None]], None] | None = None
+    # Hashes of resources the client requested or was pushed on this connection
+    push_digest: set[int] | None = None
+
+    # Shared by all connections of the process
+    admission_controller: admission.AdmissionController | None = None
+
+    frame_limits: limits.FrameLimits = limits.DEFAULT_LIMITS
+    frame_buckets: dict[str, limits.TokenBucket] | None = None
+    # Set when a read was cut short by the CPU budget, rest_data still
+    # holds complete frames and handle_client must be called again
+    budget_exhausted: bool = False
+
+    timeouts: timers.Timeouts = timers.DEFAULT_TIMEOUTS
+    # Provided by the event loop backend, drives per-stream deadlines
+    timer_wheel: timers.TimerWheel | None = None
+
+    window_update_policy: flow.WindowUpdatePolicy = flow.DEFAULT_POLICY
+    # stream id -> WINDOW_UPDATE increment waiting to be flushed in one write
+    pending_window_updates: dict[int, int] | None = None
 
 
 class StreamState(enum.IntEnum):
@@ -61,9 +138,27 @@ class Stream:
     identifier: int
     flow_control: int = 65_535
     state: StreamState = StreamState.idle
-
-
-@dataclasses.dataclass(kw_only=True, slots=True)
+    # Receive side: how much the peer may still send, and how much of what it
+    # sent was consumed but not yet handed back with WINDOW_UPDATE
+    recv_window: int = 65_535
+    recv_consumed: int = 0
+    headers: hpack.HeaderList | None = None
+    # Request DATA for the handler, None when the request has no body
+    body: RequestBody | None = None
+    # Response deadline, see Timeouts.stream
+    deadline: timers.Timer | None = None
+    # Final response headers sent, interim 1xx responses are no longer allowed
+    response_started: bool = False
+    # Send side: DATA waiting for flow-control credit, END_STREAM after it
+    send_buffer: buffers.PooledBuffer | None = None
+    send_end: bool = False
+    # Encoded trailer block carrying END_STREAM once send_buffer is drained
+    send_trailers: bytes | None = None
+    # Called once send_buffer has been written out (or the stream closed)
+    on_drained: Callable[[], None] | None = None
+
+
+@dataclasses.dataclass(kw_only=True, slots=True, frozen=True)
 class Settings:
     header_table_size: int = 4_096
     enable_push: int = 1
@@ -71,6 +166,11 @@ class Settings:
     initial_window_size: int = 65_535
     max_frame_size: int = 16_384
     max_header_list_size: int | None = None
+    # Extended CONNECT (:protocol), needed for WebSockets over HTTP/2
+    enable_connect_protocol: int = 0
+
+
+DEFAULT_SETTINGS = Settings()
 
 
 SETTING_MAPPING: Mapping[int, str] = {
@@ -80,4 +180,6 @@ SETTING_MAPPING: Mapping[int, str] = {
     0x4: "initial_window_size",
     0x5: "max_frame_size",
     0x6: "max_header_list_size",
+    # RFC 8441
+    0x8: "enable_connect_protocol",
 }
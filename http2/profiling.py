@@ -0,0 +1,126 @@
+"""Phase timers that are always on, and on-demand profiles of an event loop.
+
+Phases accumulate call counts and nanoseconds where they are cheap to take
+(one clock read per frame, per header block, per Huffman string, per
+socket write). Nested phases are inclusive: hpack.decode is part of
+frame.parse_headers, which is part of handle_client. With event loops in
+several threads the counters are updated without a lock and may
+undercount slightly.
+
+A profile covers ``seconds`` of one event loop thread, either sampled
+stacks in collapsed format (``.folded``, one ``a;b;c count`` line per
+stack, for flamegraph.pl or speedscope) or a cProfile dump (``.prof``).
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import cProfile
+import dataclasses
+import os
+import sys
+import threading
+import time
+from typing import Any
+
+MODES = ("sample", "cprofile")
+# Sampling needs the GIL, more often than the switch interval buys nothing
+SAMPLE_INTERVAL = 0.005
+
+
+@dataclasses.dataclass(slots=True)
+class Phase:
+    calls: int = 0
+    ns: int = 0
+
+    def add(self, ns: int) -> None:
+        self.calls += 1
+        self.ns += ns
+
+
+PHASES: dict[str, Phase] = {}
+
+
+def phase(name: str) -> Phase:
+    """The timer of ``name``, look it up once and keep it."""
+    return PHASES.setdefault(name, Phase())
+
+
+def report() -> None:
+    for name, timer in sorted(PHASES.items()):
+        if timer.calls:
+            print(
+                f"Phase {name}: {timer.calls} calls {timer.ns / 1e6:.1f} ms"
+                f" {timer.ns / timer.calls / 1e3:.2f} us/call"
+            )
+
+
+# Threads with a profile running
+_running: set[int] = set()
+_running_lock = threading.Lock()
+
+
+def start(
+    directory: str, seconds: float, mode: str = "sample", loop: Any = None
+) -> None:
+    """Profile the calling event loop thread for ``seconds``.
+
+    ``loop`` ends a cProfile run, the running asyncio loop by default.
+    """
+    assert mode in MODES, mode
+    ident = threading.get_ident()
+    with _running_lock:
+        if ident in _running:
+            print("Profile already running")
+            return
+        _running.add(ident)
+    name = threading.current_thread().name
+    path = os.path.join(directory, f"profile-{os.getpid()}-{name}-{int(time.time())}")
+    print("Profiling", name, "for", seconds, "seconds to", path)
+    if mode == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        loop.call_later(seconds, _stop_cprofile, profile, path + ".prof", ident)
+    else:
+        threading.Thread(
+            target=_sample,
+            args=(ident, seconds, path + ".folded"),
+            name="sampler",
+            daemon=True,
+        ).start()
+
+
+def _stop_cprofile(profile: cProfile.Profile, path: str, ident: int) -> None:
+    profile.disable()
+    profile.dump_stats(path)
+    _finished(path, ident)
+
+
+def _sample(ident: int, seconds: float, path: str) -> None:
+    stacks: collections.Counter[str] = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(ident)
+        if frame is None:
+            # The thread is gone
+            break
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{frame.f_globals.get('__name__')}.{code.co_qualname}")
+            frame = frame.f_back
+        stacks[";".join(reversed(names))] += 1
+        time.sleep(SAMPLE_INTERVAL)
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    _finished(path, ident)
+
+
+def _finished(path: str, ident: int) -> None:
+    with _running_lock:
+        _running.discard(ident)
+    print("Profile written to", path)
+    report()
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections.abc import Coroutine
+from typing import Any
+
+from http2 import body
+from http2 import frames
+from http2 import handlers
+from http2 import hpack
+from http2 import models
+from http2 import server
+from http2 import upstream
+
+# Connection-specific fields, not valid in HTTP/2 and never forwarded
+HOP_BY_HOP = frozenset(
+    (
+        "connection",
+        "keep-alive",
+        "proxy-connection",
+        "transfer-encoding",
+        "upgrade",
+    )
+)
+
+
+def forwarded_headers(headers: hpack.HeaderList) -> list[tuple[str, str]]:
+    return [(key, value) for key, value in headers if key not in HOP_BY_HOP]
+
+
+class Proxy:
+    """Handler forwarding every stream to an upstream over a pool.
+
+    Bodies are streamed both ways with flow control bridged end to end. A
+    request chunk is credited back to the client when it is taken, before
+    it waits for upstream window, and the next one is only taken once it
+    went out: at most the chunk in hand plus one client window is buffered
+    per stream. A response chunk is only taken from the upstream once the
+    previous one went out to the client.
+    """
+
+    def __init__(self, pool: upstream.UpstreamPool):
+        self.pool = pool
+
+    def __call__(
+        self, client: models.Client, stream: models.Stream
+    ) -> Coroutine[Any, Any, None]:
+        return self.forward(client, stream)
+
+    async def forward(self, client: models.Client, stream: models.Stream) -> None:
+        assert stream.headers is not None
+        try:
+            ustream = await self.pool.open_stream(
+                forwarded_headers(stream.headers), end_stream=stream.body is None
+            )
+        except (OSError, upstream.UpstreamError) as e:
+            print("Upstream unavailable", repr(e))
+            handlers.send_headers(client, stream, [(":status", "502")], True)
+            return
+
+        request = None
+        if stream.body is not None:
+            request = asyncio.create_task(self.forward_request(stream, ustream))
+        try:
+            await self.forward_response(client, stream, ustream)
+        except upstream.UpstreamError as e:
+            # Failed before the response headers
+            print("Upstream stream failed", stream.identifier, repr(e))
+            if stream.state != models.StreamState.closed:
+                handlers.send_headers(client, stream, [(":status", "502")], True)
+        finally:
+            if request is not None:
+                request.cancel()
+            ustream.reset()
+
+    async def forward_request(
+        self, stream: models.Stream, ustream: upstream.UpstreamStream
+    ) -> None:
+        assert stream.body is not None
+        try:
+            async for chunk in stream.body:
+                await ustream.write(chunk)
+            await ustream.write(b"", end_stream=True)
+        except body.StreamReset:
+            # The client is gone, so is the upstream request
+            ustream.reset()
+        except upstream.UpstreamError:
+            # The upstream is done with the stream, the rest is discarded
+            pass
+
+    async def forward_response(
+        self,
+        client: models.Client,
+        stream: models.Stream,
+        ustream: upstream.UpstreamStream,
+    ) -> None:
+        response = await ustream.response
+        if stream.state == models.StreamState.closed:
+            return
+        response_body = ustream.body
+        end = (
+            response_body.complete
+            and not response_body.chunks
+            and ustream.trailers is None
+        )
+        handlers.send_headers(client, stream, forwarded_headers(response), end)
+        if end:
+            return
+        async for chunk in response_body:
+            if stream.state == models.StreamState.closed:
+                return
+            frames.send_data(client, stream, chunk, end_stream=False)
+            # The next chunk, and the upstream credit for it, waits for the client
+            await handlers.drain(stream)
+        if stream.state == models.StreamState.closed:
+            return
+        if ustream.trailers is not None:
+            frames.send_trailers(client, stream, forwarded_headers(ustream.trailers))
+        else:
+            frames.send_data(client, stream, b"", end_stream=True)
+
+
+def main():
+    parser = server.argument_parser()
+    parser.add_argument("--upstream", required=True, help="HOST:PORT of the h2 backend")
+    parser.add_argument("--upstream-connections", type=int, default=4)
+    args = parser.parse_args()
+    if args.threads > 1:
+        # Pools hold connections of one event loop, one per thread
+        server.serve_threads(args, handler_factory=lambda: Proxy(create_pool(args)))
+    else:
+        asyncio.run(serve(args))
+
+
+def create_pool(args: argparse.Namespace) -> upstream.UpstreamPool:
+    host, _, port = args.upstream.rpartition(":")
+    return upstream.UpstreamPool(
+        host, int(port), max_connections=args.upstream_connections
+    )
+
+
+async def serve(args: argparse.Namespace) -> None:
+    pool = create_pool(args)
+    try:
+        await server.serve(args, handler=Proxy(pool))
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
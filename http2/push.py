@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import re
+from collections.abc import Iterable
+
+from http2 import frames
+from http2 import hpack
+from http2 import models
+
+# <target>; param; param
+LINK_RE = re.compile(r"<([^>]*)>([^,]*)")
+
+# Entries remembered per connection before the digest starts over
+MAX_DIGEST_SIZE = 256
+
+
+def digest_key(authority: str | None, path: str) -> int:
+    return hash((authority, path))
+
+
+def remember(client: models.Client, stream: models.Stream) -> None:
+    """The client has (or is getting) the resource requested on ``stream``."""
+    if stream.headers is None or stream.headers.path is None:
+        return
+    _remember(client, digest_key(stream.headers.authority, stream.headers.path))
+
+
+def _remember(client: models.Client, key: int) -> None:
+    if client.push_digest is None:
+        client.push_digest = set()
+    elif len(client.push_digest) >= MAX_DIGEST_SIZE:
+        client.push_digest.clear()
+    client.push_digest.add(key)
+
+
+def push(
+    client: models.Client,
+    stream: models.Stream,
+    path: str,
+    headers: Iterable[tuple[str, str]] = (),
+) -> models.Stream | None:
+    """Promise ``path`` to the client on the request ``stream``.
+
+    Returns the reserved stream to send the response on, or None when the
+    push is not allowed or the client most likely has the resource already.
+    """
+    if not client.remote_settings.enable_push:
+        return None
+    # PUSH_PROMISE can only be sent on a client stream that is still open
+    if not stream.identifier & 1 or stream.state not in [
+        models.StreamState.open,
+        models.StreamState.half_closed_remote,
+    ]:
+        return None
+    if client.goaway_sent:
+        return None
+    limit = client.remote_settings.max_concurrent_streams
+    if limit is not None:
+        pushed = sum(1 for stream_id in client.streams if not stream_id & 1)
+        if pushed >= limit:
+            return None
+
+    request = stream.headers
+    authority = request.authority if request is not None else None
+    key = digest_key(authority, path)
+    if client.push_digest is not None and key in client.push_digest:
+        print("Push skipped, client has it", path)
+        return None
+    _remember(client, key)
+
+    promised_id = client.last_pushed_stream_id + 2
+    if promised_id > 2**31 - 1:
+        return None
+
+    promised = hpack.HeaderList()
+    promised.append(":method", "GET")
+    promised.append(":scheme", (request and request.scheme) or "https")
+    if authority is not None:
+        promised.append(":authority", authority)
+    promised.append(":path", path)
+    for key, value in headers:
+        promised.append(key, value)
+
+    block = hpack.encode(promised)
+    client.send_data += frames.generate_push_promise(
+        stream.identifier, promised_id, block
+    )
+    pushed_stream = frames.open_stream(client, promised_id)
+    pushed_stream.state = models.StreamState.reserved_local
+    pushed_stream.headers = promised
+    print("Push promise", promised_id, path)
+    return pushed_stream
+
+
+def preload_paths(headers: Iterable[tuple[str, str]]) -> list[str]:
+    """Same-origin targets of ``link: <...>; rel=preload`` without ``nopush``."""
+    paths = []
+    for key, value in headers:
+        if key != "link":
+            continue
+        for match in LINK_RE.finditer(value):
+            target, params = match.groups()
+            params = {param.strip().lower() for param in params.split(";")}
+            if not params & {"rel=preload", 'rel="preload"'} or "nopush" in params:
+                continue
+            if target.startswith("/") and not target.startswith("//"):
+                paths.append(target)
+    return paths
+
+
+def push_preloads(
+    client: models.Client, stream: models.Stream, headers: Iterable[tuple[str, str]]
+) -> list[models.Stream]:
+    pushed = []
+    for path in preload_paths(headers):
+        pushed_stream = push(client, stream, path)
+        if pushed_stream is not None:
+            pushed.append(pushed_stream)
+    return pushed
@@ -0,0 +1,713 @@
+"""Event loop backend on selectors (epoll on Linux), without asyncio.
+
+A readable socket is read until it is empty and goes straight into
+handle_client; what that queued is sent right away, and what the socket
+does not take waits until it is writable. With epoll every socket is
+registered once, edge-triggered, for both directions, so no event needs a
+registration change. Elsewhere the level-triggered DefaultSelector is
+used and write interest is switched on while data waits.
+
+Connections get the same Client hooks as from the asyncio backend, but
+there are no tasks to run coroutines: handlers respond before they return,
+or later from another thread with ``call_soon_threadsafe``. Coroutine
+handlers are refused by Server, and a coroutine returned anyway resets its
+stream.
+TLS runs through ssl.MemoryBIO.
+
+    srv = selector.Server(sock, server.handle_client, handler=handler)
+    srv.start()
+    srv.run()  # until srv.stop(), which may be called from any thread
+    srv.shutdown(drain_timeout)
+"""
+from __future__ import annotations
+
+import collections
+import errno
+import functools
+import heapq
+import inspect
+import itertools
+import select
+import selectors
+import socket
+import ssl
+import time
+from collections.abc import Callable
+from collections.abc import Coroutine
+from typing import Any
+
+from http2 import admission
+from http2 import capture
+from http2 import flow
+from http2 import frames
+from http2 import limits
+from http2 import metrics
+from http2 import models
+from http2 import profiling
+from http2 import timers
+from http2 import tls
+
+HandleClient = Callable[[models.Client], None]
+
+READ_SIZE = 256 * 1024
+# Read from one connection per turn, then the others get theirs
+READ_LIMIT = 1024 * 1024
+MAX_EVENTS = 1024
+# Unsent bytes at which a connection stops reading, and resumes once they
+# are down to the low mark: a peer that does not read is not served
+BACKLOG_HIGH_WATER = 256 * 1024
+BACKLOG_LOW_WATER = 64 * 1024
+# Seconds between event loop delay samples for the admission controller
+SAMPLE_PERIOD = 0.01
+# Out of file descriptors: accepting again after this many seconds
+ACCEPT_RETRY = 0.1
+
+WRITE_PHASE = profiling.phase("write")
+
+
+class TimerHandle:
+    __slots__ = ("callback", "cancelled")
+
+    def __init__(self, callback: Callable[[], None]):
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class EpollPoller:
+    """Edge-triggered: both directions are registered once and reported
+    when they become ready, so a socket must be read until it is empty."""
+
+    FLAGS = select.EPOLLIN | select.EPOLLOUT | select.EPOLLRDHUP | select.EPOLLET
+    READ = select.EPOLLIN | select.EPOLLRDHUP | select.EPOLLHUP | select.EPOLLERR
+
+    def __init__(self):
+        self.epoll = select.epoll()
+
+    def register(self, fd: int) -> None:
+        self.epoll.register(fd, self.FLAGS)
+
+    def want_write(self, fd: int, write: bool) -> None:
+        pass
+
+    def unregister(self, fd: int) -> None:
+        self.epoll.unregister(fd)
+
+    def poll(self, timeout: float | None) -> list[tuple[int, bool, bool]]:
+        events = self.epoll.poll(-1 if timeout is None else timeout, MAX_EVENTS)
+        return [
+            (fd, bool(mask & self.READ), bool(mask & select.EPOLLOUT))
+            for fd, mask in events
+        ]
+
+    def close(self) -> None:
+        self.epoll.close()
+
+
+class SelectorPoller:
+    """Level-triggered: write interest only while data waits."""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+
+    def register(self, fd: int) -> None:
+        self.selector.register(fd, selectors.EVENT_READ)
+
+    def want_write(self, fd: int, write: bool) -> None:
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if write else 0)
+        self.selector.modify(fd, events)
+
+    def unregister(self, fd: int) -> None:
+        self.selector.unregister(fd)
+
+    def poll(self, timeout: float | None) -> list[tuple[int, bool, bool]]:
+        return [
+            (
+                key.fd,
+                bool(mask & selectors.EVENT_READ),
+                bool(mask & selectors.EVENT_WRITE),
+            )
+            for key, mask in self.selector.select(timeout)
+        ]
+
+    def close(self) -> None:
+        self.selector.close()
+
+
+class Loop:
+    """What the connections and TimerWheel need of an event loop."""
+
+    def __init__(self):
+        self.poller = EpollPoller() if hasattr(select, "epoll") else SelectorPoller()
+        # fd -> called with (readable, writable)
+        self.handlers: dict[int, Callable[[bool, bool], None]] = {}
+        self.ready: collections.deque[Callable[[], None]] = collections.deque()
+        self.scheduled: list[tuple[float, int, TimerHandle]] = []
+        self.sequence = itertools.count()
+        # Appended to from other threads, a byte on the socket pair wakes
+        # the poll up
+        self.threadsafe: collections.deque[Callable[[], None]] = collections.deque()
+        self.waker, self.woken = socket.socketpair()
+        self.waker.setblocking(False)
+        self.woken.setblocking(False)
+        self.add(self.woken.fileno(), self.drain_waker)
+        self.running = False
+
+    def time(self) -> float:
+        return time.monotonic()
+
+    def call_soon(self, callback: Callable[[], None]) -> None:
+        self.ready.append(callback)
+
+    def call_at(self, when: float, callback: Callable[[], None]) -> TimerHandle:
+        handle = TimerHandle(callback)
+        heapq.heappush(self.scheduled, (when, next(self.sequence), handle))
+        return handle
+
+    def call_later(
+        self, delay: float, callback: Callable[..., None], *args: Any
+    ) -> TimerHandle:
+        if args:
+            callback = functools.partial(callback, *args)
+        return self.call_at(self.time() + delay, callback)
+
+    def call_soon_threadsafe(self, callback: Callable[[], None]) -> None:
+        self.threadsafe.append(callback)
+        try:
+            self.waker.send(b"\0")
+        except OSError:
+            # Full: a wakeup is pending already
+            pass
+
+    def drain_waker(self, readable: bool, writable: bool) -> None:
+        try:
+            while self.woken.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def add(self, fd: int, handler: Callable[[bool, bool], None]) -> None:
+        self.handlers[fd] = handler
+        self.poller.register(fd)
+
+    def want_write(self, fd: int, write: bool) -> None:
+        self.poller.want_write(fd, write)
+
+    def remove(self, fd: int) -> None:
+        del self.handlers[fd]
+        self.poller.unregister(fd)
+
+    def run(self) -> None:
+        """Until stop()."""
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def stop(self) -> None:
+        self.running = False
+
+    def run_once(self, max_timeout: float | None = None) -> None:
+        timeout = max_timeout
+        if self.ready or self.threadsafe:
+            timeout = 0
+        elif self.scheduled:
+            timeout = max(0.0, self.scheduled[0][0] - self.time())
+            if max_timeout is not None:
+                timeout = min(timeout, max_timeout)
+        for fd, readable, writable in self.poller.poll(timeout):
+            handler = self.handlers.get(fd)
+            if handler is not None:
+                handler(readable, writable)
+        while self.threadsafe:
+            self.ready.append(self.threadsafe.popleft())
+        now = self.time()
+        while self.scheduled and self.scheduled[0][0] <= now:
+            _, _, handle = heapq.heappop(self.scheduled)
+            if not handle.cancelled:
+                self.ready.append(handle.callback)
+        # What these queue runs after the next poll
+        for _ in range(len(self.ready)):
+            callback = self.ready.popleft()
+            try:
+                callback()
+            except Exception as e:
+                print("Callback failed", callback, repr(e))
+
+    def close(self) -> None:
+        self.remove(self.woken.fileno())
+        self.waker.close()
+        self.woken.close()
+        self.poller.close()
+
+
+class Connection:
+    def __init__(self, server: Server, sock: socket.socket):
+        self.server = server
+        self.loop = server.loop
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.client = models.Client(
+            local_settings=server.local_settings,
+            admission_controller=server.admission_controller,
+            handler=server.handler,
+            frame_limits=server.frame_limits,
+            timeouts=server.timeouts,
+            window_update_policy=server.window_update_policy,
+        )
+        self.client.call_soon_threadsafe = self.call_soon_threadsafe
+        self.client.wakeup = self.wakeup
+        self.client.spawn = self.spawn
+        self.client.timer_wheel = server.wheel
+        # What the socket did not take yet
+        self.backlog = bytearray()
+        self.closed = False
+        # Close once the backlog is sent
+        self.closing = False
+        # Out of CPU budget, see resume
+        self.paused = False
+        # Backlog above BACKLOG_HIGH_WATER, see send_backlog
+        self.blocked = False
+        self.flush_scheduled = False
+        self.tls: ssl.SSLObject | None = None
+        self.handshaking = False
+        self.incoming = ssl.MemoryBIO()
+        self.outgoing = ssl.MemoryBIO()
+        self.idle_timer: timers.Timer | None = None
+        self.frame_timer: timers.Timer | None = None
+        self.settings_timer: timers.Timer | None = None
+        self.capture: capture.ConnectionCapture | None = None
+
+    def start(self) -> None:
+        print("Client open")
+        self.server.connections.add(self)
+        if self.server.capture is not None:
+            self.capture = self.server.capture.connection(
+                self.client.local_settings.header_table_size
+            )
+        wheel = self.server.wheel
+        timeouts = self.client.timeouts
+        if timeouts.idle is not None:
+            self.idle_timer = wheel.schedule(timeouts.idle, self.idle_timeout)
+        if timeouts.frame is not None:
+            # The preface is due right away
+            self.frame_timer = wheel.schedule(timeouts.frame, self.frame_timeout)
+        if self.server.ssl_context is not None:
+            self.tls = self.server.ssl_context.wrap_bio(
+                self.incoming, self.outgoing, server_side=True
+            )
+            self.handshaking = True
+        # Already readable sockets are reported right away, also by epoll
+        self.loop.add(self.fd, self.ready)
+        if self.server.draining:
+            # Accepted right before the listener closed
+            frames.send_goaway(self.client)
+
+    def ready(self, readable: bool, writable: bool) -> None:
+        try:
+            if writable and self.backlog:
+                self.send_backlog()
+            if readable and not self.paused and not self.blocked and not self.closed:
+                self.read()
+        except Exception as e:
+            print("Connection failed", repr(e))
+            self.close()
+
+    def read(self) -> None:
+        received = 0
+        eof = False
+        while received < READ_LIMIT:
+            try:
+                data = self.sock.recv(READ_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                print("Read failed", repr(e))
+                self.close()
+                return
+            if not data:
+                eof = True
+                break
+            received += len(data)
+            self.data_received(data)
+            if self.closed:
+                return
+        else:
+            # More may be waiting, and edge-triggered epoll does not tell again
+            self.loop.call_soon(self.resume)
+        if received:
+            self.process()
+        if eof:
+            self.close()
+
+    def data_received(self, data: bytes) -> None:
+        if self.tls is not None:
+            self.incoming.write(data)
+            data = self.decrypt()
+            if not data:
+                return
+        if self.capture is not None:
+            self.capture.feed(data)
+        self.client.rest_data += data
+        if self.idle_timer is not None:
+            self.idle_timer.reschedule(self.client.timeouts.idle)
+
+    def decrypt(self) -> bytes:
+        assert self.tls is not None
+        if self.handshaking:
+            try:
+                self.tls.do_handshake()
+            except ssl.SSLWantReadError:
+                self.send_tls()
+                return b""
+            except ssl.SSLError as e:
+                print("TLS handshake failed", repr(e))
+                self.close()
+                return b""
+            self.handshaking = False
+            if not tls.negotiated_h2(self.tls):
+                # TODO: HTTP/1.1 fallback
+                self.close()
+                return b""
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.tls.read(READ_SIZE))
+            except ssl.SSLWantReadError:
+                break
+            except ssl.SSLZeroReturnError:
+                # close_notify, the socket EOF follows
+                break
+            except ssl.SSLError as e:
+                print("TLS error", repr(e))
+                self.close()
+                return b""
+        # Session tickets, alerts
+        self.send_tls()
+        return b"".join(chunks)
+
+    def send_tls(self) -> None:
+        if self.outgoing.pending:
+            self.send(self.outgoing.read())
+
+    def process(self) -> None:
+        client = self.client
+        if client.need_close:
+            return
+        pending = len(client.rest_data)
+        self.server.handle_client(client)
+        self.flush()
+        if self.closed or client.need_close:
+            return
+        self.update_timers(progress=len(client.rest_data) < pending)
+        if client.budget_exhausted:
+            # Continue after the other connections had their turn
+            self.paused = True
+            self.loop.call_soon(self.resume)
+            return
+        if not frames.has_active_streams(client):
+            models.shed_idle_state(client)
+
+    def resume(self) -> None:
+        if self.closed or self.blocked:
+            # send_backlog calls again, frames already read included
+            return
+        if self.paused:
+            self.paused = False
+            self.process()
+            if self.paused or self.closed or self.blocked:
+                return
+        self.read()
+
+    def flush(self) -> None:
+        client = self.client
+        if client.send_data and not self.closed:
+            start = time.perf_counter_ns()
+            data = client.send_data
+            client.send_data = bytearray()
+            if self.tls is not None:
+                self.tls.write(data)
+                self.send_tls()
+            else:
+                self.send(data)
+            WRITE_PHASE.add(time.perf_counter_ns() - start)
+        if client.need_close:
+            print("Need close")
+            self.close_when_sent()
+        elif client.goaway_sent and not frames.has_active_streams(client):
+            print("Drained")
+            self.close_when_sent()
+
+    def send(self, data: bytes | bytearray) -> None:
+        if self.closed:
+            return
+        if self.backlog:
+            self.backlog += data
+        else:
+            try:
+                sent = self.sock.send(data)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError as e:
+                print("Write failed", repr(e))
+                self.close()
+                return
+            if sent == len(data):
+                return
+            self.backlog += memoryview(data)[sent:]
+            self.loop.want_write(self.fd, True)
+        if len(self.backlog) > BACKLOG_HIGH_WATER:
+            self.blocked = True
+
+    def send_backlog(self) -> None:
+        try:
+            with memoryview(self.backlog) as view:
+                sent = self.sock.send(view)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            print("Write failed", repr(e))
+            self.close()
+            return
+        del self.backlog[:sent]
+        if self.blocked and len(self.backlog) <= BACKLOG_LOW_WATER:
+            self.blocked = False
+            # Edge-triggered epoll does not report what arrived meanwhile
+            self.loop.call_soon(self.resume)
+        if not self.backlog:
+            self.loop.want_write(self.fd, False)
+            if self.closing:
+                self.close()
+
+    def close_when_sent(self) -> None:
+        if self.backlog:
+            self.closing = True
+        else:
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.remove(self.fd)
+        self.sock.close()
+        if self.client.rest_data:
+            print("Unhandled data in client steam before close")
+        frames.release_streams(self.client)
+        for timer in (self.idle_timer, self.frame_timer, self.settings_timer):
+            if timer is not None:
+                timer.cancel()
+        if self.capture is not None:
+            self.capture.close()
+        print("Client closed")
+        self.server.connections.discard(self)
+
+    def update_timers(self, progress: bool) -> None:
+        client = self.client
+        timeouts = client.timeouts
+        if self.frame_timer is not None:
+            if not client.rest_data and client.phase:
+                self.frame_timer.cancel()
+            elif progress or not self.frame_timer.active:
+                # A frame started, or the previous one completed
+                self.frame_timer.reschedule(timeouts.frame)
+        if (
+            client.settings_ack_pending
+            and self.settings_timer is None
+            and timeouts.settings_ack is not None
+        ):
+            self.settings_timer = self.server.wheel.schedule(
+                timeouts.settings_ack, self.settings_timeout
+            )
+
+    def idle_timeout(self) -> None:
+        if frames.has_active_streams(self.client):
+            assert self.idle_timer is not None
+            self.idle_timer.reschedule(self.client.timeouts.idle)
+            return
+        print("Idle timeout")
+        frames.send_goaway(self.client)
+        self.flush()
+
+    def frame_timeout(self) -> None:
+        print("Frame timeout, incomplete frame or preface")
+        # PROTOCOL_ERROR
+        frames.send_goaway(self.client, 0x1)
+        self.client.need_close = True
+        self.flush()
+
+    def settings_timeout(self) -> None:
+        if not self.client.settings_ack_pending:
+            return
+        print("SETTINGS not acknowledged in time")
+        # SETTINGS_TIMEOUT
+        frames.send_goaway(self.client, 0x4)
+        self.client.need_close = True
+        self.flush()
+
+    def wakeup(self) -> None:
+        # Once per loop iteration, however many frames were queued
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self.scheduled_flush)
+
+    def scheduled_flush(self) -> None:
+        self.flush_scheduled = False
+        if self.closed:
+            return
+        frames.flush_window_updates(self.client)
+        self.flush()
+
+    def spawn(self, stream: models.Stream, coro: Coroutine[Any, Any, None]) -> None:
+        # Nothing to run it on: the stream fails, not the connection
+        coro.close()
+        print("Coroutine handler on the selectors backend", stream.identifier)
+        if stream.state != models.StreamState.closed:
+            # INTERNAL_ERROR
+            self.client.send_data += frames.generate_rst_stream(stream.identifier, 0x2)
+            frames.close_stream(self.client, stream)
+
+    def call_soon_threadsafe(self, callback: Callable[[], None]) -> None:
+        self.loop.call_soon_threadsafe(functools.partial(self._run, callback))
+
+    def _run(self, callback: Callable[[], None]) -> None:
+        if self.closed:
+            return
+        callback()
+        self.flush()
+
+    def goaway(self) -> None:
+        frames.send_goaway(self.client)
+        self.flush()
+
+    def abort(self) -> None:
+        self.backlog.clear()
+        self.close()
+
+
+def is_async(handler: Callable[..., Any] | None) -> bool:
+    """Whether ``handler`` is declared to return coroutines.
+
+    Handler objects whose ``__call__`` is a plain method returning one are
+    only caught at their first request, see Connection.spawn.
+    """
+    if handler is None:
+        return False
+    return inspect.iscoroutinefunction(handler) or inspect.iscoroutinefunction(
+        getattr(type(handler), "__call__", None)
+    )
+
+
+class Server:
+    """selectors backend: takes the same arguments as aio.Server, but
+    start and shutdown are plain calls and ``run`` serves."""
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        handle_client: HandleClient,
+        *,
+        local_settings: models.Settings = models.DEFAULT_SETTINGS,
+        admission_controller: admission.AdmissionController | None = None,
+        ssl_context: ssl.SSLContext | None = None,
+        frame_limits: limits.FrameLimits = limits.DEFAULT_LIMITS,
+        timeouts: timers.Timeouts = timers.DEFAULT_TIMEOUTS,
+        handler: Callable[
+            [models.Client, models.Stream], Coroutine[Any, Any, None] | None
+        ]
+        | None = None,
+        capture: capture.Capture | None = None,
+        window_update_policy: flow.WindowUpdatePolicy = flow.DEFAULT_POLICY,
+    ):
+        if is_async(handler):
+            raise TypeError("the selectors backend can not run coroutine handlers")
+        self.sock = sock
+        self.handle_client = handle_client
+        self.local_settings = local_settings
+        self.admission_controller = admission_controller
+        self.ssl_context = ssl_context
+        self.frame_limits = frame_limits
+        self.timeouts = timeouts
+        self.handler = handler
+        self.capture = capture
+        self.window_update_policy = window_update_policy
+        self.loop = Loop()
+        self.wheel = timers.TimerWheel(self.loop)  # type: ignore[arg-type]
+        self.connections: set[Connection] = set()
+        self.draining = False
+        self.listening = False
+
+    def start(self) -> None:
+        self.sock.setblocking(False)
+        self.loop.add(self.sock.fileno(), self.accept)
+        self.listening = True
+        if self.admission_controller is not None:
+            self.sample_delay(self.loop.time())
+
+    def sample_delay(self, expected: float) -> None:
+        """Feed the admission controller with how late the loop wakes us up."""
+        assert self.admission_controller is not None
+        now = self.loop.time()
+        self.admission_controller.observe(max(0.0, now - expected))
+        if not self.draining:
+            self.loop.call_later(
+                SAMPLE_PERIOD,
+                functools.partial(self.sample_delay, now + SAMPLE_PERIOD),
+            )
+
+    def accept(self, readable: bool, writable: bool) -> None:
+        # Edge-triggered: until the queue is empty
+        while self.listening:
+            try:
+                sock, _ = self.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print("Accept failed", repr(e))
+                if e.errno in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+                    # No event for the connections still queued, try again
+                    self.loop.call_later(
+                        ACCEPT_RETRY, functools.partial(self.accept, True, False)
+                    )
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            Connection(self, sock).start()
+
+    def run(self) -> None:
+        """Serve in the calling thread until stop()."""
+        self.loop.run()
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def shutdown(self, timeout: float) -> None:
+        """Graceful shutdown, as aio.Server.shutdown, running the loop
+        until the connections are drained or ``timeout`` seconds passed."""
+        if self.draining:
+            return
+        self.draining = True
+        if self.listening:
+            self.listening = False
+            self.loop.remove(self.sock.fileno())
+            self.sock.close()
+        print("Draining", len(self.connections), "connections")
+
+        for connection in list(self.connections):
+            connection.goaway()
+
+        deadline = time.monotonic() + timeout
+        while self.connections and time.monotonic() < deadline:
+            self.loop.run_once(max_timeout=0.05)
+
+        for connection in list(self.connections):
+            print("Drain deadline reached, closing client")
+            connection.abort()
+        if self.admission_controller is not None:
+            print("Admission", self.admission_controller)
+        if self.ssl_context is not None:
+            tls.report(self.ssl_context)
+        metrics.report()
+        self.loop.close()
+        print("Server closed")
@@ -1,12 +1,32 @@
 from __future__ import annotations
 
-import logging
+import argparse
+import asyncio
+import functools
 import signal
 import socket
+import ssl
 import struct
-
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+from http2 import admission
+from http2 import aio
+from http2 import capture
 from http2 import frames
+from http2 import flow
+from http2 import handoff
+from http2 import limits
+from http2 import metrics
 from http2 import models
+from http2 import profiling
+from http2 import selector
+from http2 import timers
+from http2 import tls
+
+BACKENDS = ("asyncio", "selectors")
 
 CLIENT_PREFACE_PRI = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
 
@@ -14,158 +34,509 @@ CLIENT_PREFACE_PRI = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
 # All numbers are big endian
 
 # 9 bytes:
-# 24 bit length
+# 24 bit length (16 + 8 bits, struct has no 3 byte integer)
 # 8 bit type
 # 8 bit flags
 # 1 bit reserved 0
 # 31 bit stream identifier
-FRAME_HEADER_FORMAT = ">3sBBI"
-FRAME_HEADER_FORMAT_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
-assert FRAME_HEADER_FORMAT_SIZE == 9
+FRAME_HEADER = struct.Struct(">HBBBI")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+assert FRAME_HEADER_SIZE == 9
+
+
+def extract_frames(
+    data: bytes, max_frame_size: int
+) -> tuple[list[models.FrameHeader], int, bool]:
+    """Parse every complete frame in ``data`` in one pass.
+
+    Returns the frame headers, each pointing at its payload inside ``data``,
+    how many bytes of ``data`` the frames span and whether the scan stopped
+    at a malformed frame header.
+    """
+    batch = []
+    unpack_from = FRAME_HEADER.unpack_from
+    make_header = models.FrameHeader._make
+    size = len(data)
+    offset = 0
+    while offset + FRAME_HEADER_SIZE <= size:
+        length_high, length_low, type_, flags, stream_id = unpack_from(data, offset)
+        length = length_high << 8 | length_low
+        if length > max_frame_size:
+            # TODO: FRAME_SIZE_ERROR
+            print("Header length > SETTINGS_MAX_FRAME_SIZE", length, max_frame_size)
+            return batch, offset, True
+        if stream_id & 0x80_00_00_00:
+            print("Reserved bit is set")
+            return batch, offset, True
+        end = offset + FRAME_HEADER_SIZE + length
+        if end > size:
+            break
+        batch.append(
+            make_header((type_, flags, stream_id, offset + FRAME_HEADER_SIZE, length))
+        )
+        offset = end
+    return batch, offset, False
+
+
+def allow_frame(client: models.Client, header: models.FrameHeader, now: float) -> bool:
+    """Charge the frame to its class' token bucket.
+
+    ``now`` is in time.perf_counter seconds. Returns False once the client
+    went over the limit of a class too often since its bucket was full.
+    """
+    name = limits.frame_class(header.type, header.flags, header.length)
+    if name is None:
+        return True
+    rate = client.frame_limits.rates.get(name)
+    if rate is None:
+        return True
+
+    if client.frame_buckets is None:
+        # Allocated on first use to keep idle connections small
+        client.frame_buckets = {}
+    bucket = client.frame_buckets.get(name)
+    if bucket is None:
+        bucket = limits.TokenBucket(tokens=rate.burst, updated=now)
+        client.frame_buckets[name] = bucket
+    if limits.take(bucket, rate, now):
+        return True
+
+    metrics.limit_triggered(name)
+    print("Frame rate limit", name, bucket.strikes)
+    return bucket.strikes < client.frame_limits.max_strikes
 
 
-def parse_frame_header(client) -> models.FrameHeader | None:
-    if len(client.rest_data) < FRAME_HEADER_FORMAT_SIZE:
-        return None
+def handle_client(client: models.Client) -> None:
+    assert not client.need_close
+
+    client.budget_exhausted = False
+    start = time.perf_counter_ns()
+    deadline = start + int(client.frame_limits.cpu_budget * 1e9)
+    process_frames(client, deadline)
+    # Updates for every stream touched by this read go out in one write
+    frames.flush_window_updates(client)
+    HANDLE_CLIENT_PHASE.add(time.perf_counter_ns() - start)
+
+
+# Always-on timers, see profiling
+HANDLE_CLIENT_PHASE = profiling.phase("handle_client")
+FRAME_PHASES = {
+    type_: profiling.phase(f"frame.{parser.__name__}")
+    for type_, parser in frames.FRAME_MAPPING.items()
+}
+
+
+def process_frames(client: models.Client, deadline: int) -> None:
+    """Process the complete frames in ``client.rest_data``.
+
+    ``deadline`` is in time.perf_counter_ns units.
+    """
+    if client.phase == 0:
+        print("Client phase 0")
+        if len(client.rest_data) < len(CLIENT_PREFACE_PRI):
+            return
+        if not client.rest_data.startswith(CLIENT_PREFACE_PRI):
+            print("Not http/2 with prior knowledge")
+            client.need_close = True
+            return
+        client.rest_data = client.rest_data[len(CLIENT_PREFACE_PRI) :]
+        client.phase = 1
+        # TODO: local settings only apply once the peer ACKs them
+        client.send_data += frames.generate_settings_frame(client.local_settings)
+        client.settings_ack_pending = True
+
+    # TODO:
+    #    An endpoint MUST send an error code of FRAME_SIZE_ERROR if a frame
+    #    exceeds the size defined in SETTINGS_MAX_FRAME_SIZE, exceeds any
+    #    A frame size error in a frame that could alter
+    #    the state of the entire connection MUST be treated as a connection
+    #    error (Section 5.4.1); this includes any frame carrying a header
+    #    block (Section 4.3) (that is, HEADERS, PUSH_PROMISE, and
+    #    CONTINUATION), SETTINGS, and any frame with a stream identifier of 0.
+
+    data = client.rest_data
+    batch, consumed, failure = extract_frames(
+        data, client.local_settings.max_frame_size
+    )
+    print("Client frames", len(batch))
+    # Payloads are handed to the parsers as views, nothing is copied
+    view = memoryview(data)
+    now = time.perf_counter_ns()
+    for header in batch:
+        # At least one frame per call: scanning a large backlog of frames
+        # can use up the budget alone, and the caller would come back forever
+        if now > deadline and header is not batch[0]:
+            # Let other connections run, the caller comes back for the rest
+            print("CPU budget exhausted")
+            client.budget_exhausted = True
+            metrics.increment("budget_exhausted")
+            consumed = header.offset - FRAME_HEADER_SIZE
+            break
+
+        if not client.settings_received:
+            if header.type != 0x4:
+                print("First frame is not SETTINGS")
+                client.need_close = True
+                return
+            client.settings_received = True
+
+        if not allow_frame(client, header, now / 1e9):
+            frames.send_goaway(client, 0xB)  # ENHANCE_YOUR_CALM
+            metrics.increment("enhance_your_calm")
+            client.need_close = True
+            return
+
+        parser = frames.FRAME_MAPPING.get(header.type)
+        if parser is None:
+            # Implementations MUST ignore and discard frames of unknown types
+            print("Unknown frame", header)
+            # Not timed, but the next frame starts here
+            now = time.perf_counter_ns()
+            continue
+        parser(client, header, view[header.offset : header.offset + header.length])
+        # The end of this frame is the start of the next one
+        end = time.perf_counter_ns()
+        FRAME_PHASES[header.type].add(end - now)
+        now = end
+        if client.need_close:
+            return
+    else:
+        if failure:
+            print("Header failure")
+            client.need_close = True
+            return
+
+    client.rest_data = data[consumed:]
+
 
-    # header_raw, client.rest_data = client.rest_data[:9], client.rest_data[9:]
-    res: tuple[bytes, int, int, int]
-    res = struct.unpack_from(FRAME_HEADER_FORMAT, client.rest_data)
-    client.rest_data = client.rest_data[FRAME_HEADER_FORMAT_SIZE:]
-    header = models.FrameHeader(
-        length=int.from_bytes(res[0], "big", signed=False),
-        type=res[1],
-        flags=res[2],
-        stream_id=res[3],
+def main():
+    args = argument_parser().parse_args()
+    if args.backend == "selectors":
+        serve_selectors(args)
+    elif args.threads > 1:
+        serve_threads(args)
+    else:
+        asyncio.run(serve(args))
+
+
+def argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="asyncio",
+        help="event loop; selectors runs epoll directly, without coroutine handlers",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=30.0,
+        help="seconds active streams get to finish on shutdown",
+    )
+    parser.add_argument(
+        "--handoff-path",
+        help="Unix socket on which the listening socket is passed to a new process",
+    )
+    parser.add_argument(
+        "--inherit",
+        action="store_true",
+        help="take the listening socket over from the process at --handoff-path",
+    )
+    parser.add_argument("--max-concurrent-streams", type=int, default=100)
+    parser.add_argument("--initial-window-size", type=int, default=65_535)
+    parser.add_argument(
+        "--window-update-policy",
+        choices=tuple(flow.POLICIES),
+        default="default",
+        help="when received bytes are credited back, bulk-upload sends fewer updates",
+    )
+    parser.add_argument(
+        "--shed-target-ms",
+        type=float,
+        help="shed new streams while event loop delay stays above this",
+    )
+    parser.add_argument(
+        "--shed-status",
+        type=int,
+        help="respond to shed streams with this status instead of REFUSED_STREAM",
+    )
+    parser.add_argument("--certfile", help="serve h2 over TLS with this certificate")
+    parser.add_argument("--keyfile")
+    parser.add_argument(
+        "--no-session-tickets",
+        action="store_true",
+        help="resume TLS sessions from the server-side session cache only",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=timers.DEFAULT_TIMEOUTS.idle,
+        help="close connections without frames for this many seconds",
+    )
+    parser.add_argument(
+        "--stream-timeout",
+        type=float,
+        default=timers.DEFAULT_TIMEOUTS.stream,
+        help="reset streams without response headers after this many seconds",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="event loops, one per thread; scales on free-threaded builds",
+    )
+    parser.add_argument(
+        "--shared-listener",
+        action="store_true",
+        help="with --threads, accept from one socket instead of one per thread",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=".",
+        help="where SIGUSR1 writes a profile of every event loop",
+    )
+    parser.add_argument("--profile-seconds", type=float, default=10.0)
+    parser.add_argument(
+        "--profile-mode",
+        choices=profiling.MODES,
+        default="sample",
+        help="sampled stacks in collapsed format, or a cProfile dump",
     )
-    # TODO: SETTINGS_MAX_FRAME_SIZE
-    if header.length > 2**14:
-        print("Header length > 2 ^ 14", header.length, 2**14)
-        header.failure = True
-    # TODO: Check frame type for unknown and MUST skip
+    parser.add_argument(
+        "--capture",
+        help="record inbound bytes to this file for benchmarks.capture_replay",
+    )
+    parser.add_argument(
+        "--capture-rate",
+        type=float,
+        default=1.0,
+        help="fraction of connections recorded with --capture",
+    )
+    return parser
+
+
+async def serve(
+    args: argparse.Namespace,
+    handler: Callable[[models.Client, models.Stream], Any] | None = None,
+) -> None:
+    previous = None
+    if args.inherit:
+        server_sock, previous = handoff.receive_listener(args.handoff_path)
+    else:
+        server_sock = socket.create_server(("127.0.0.1", args.port), reuse_port=True)
+        print("Listening on port", args.port)
+
+    server_capture = create_capture(args)
+    server = create_server(
+        args,
+        server_sock,
+        ssl_context=create_ssl_context(args),
+        handler=handler,
+        capture=server_capture,
+    )
+    await server.start()
+    if previous is not None:
+        # We are accepting now, the old process may stop
+        handoff.confirm(previous)
 
-    if header.stream_id & 0x80_00_00_00:
-        print("Reserved bit is set")
-        header.failure = True
-    return header
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
 
+    def sig_handler():
+        print("Exit signal")
+        stop.set()
+
+    loop.add_signal_handler(signal.SIGINT, sig_handler)
+    loop.add_signal_handler(signal.SIGTERM, sig_handler)
+    loop.add_signal_handler(signal.SIGUSR1, start_profile, args)
+
+    async def hand_off(handoff_sock: socket.socket) -> None:
+        # Keep serving until a successor confirms it took over
+        while not await handoff.wait_for_successor(handoff_sock, server_sock):
+            pass
+
+    waiters = [asyncio.create_task(stop.wait())]
+    if args.handoff_path:
+        waiters.append(asyncio.create_task(hand_off(handoff.listen(args.handoff_path))))
+    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    for waiter in waiters:
+        waiter.cancel()
+
+    await server.shutdown(args.drain_timeout)
+    if server_capture is not None:
+        server_capture.close()
+
+
+def serve_selectors(
+    args: argparse.Namespace,
+    handler: Callable[[models.Client, models.Stream], Any] | None = None,
+) -> None:
+    """Serve from a selector.Loop in the main thread until SIGINT or SIGTERM."""
+    # TODO: listener handoff and several loops
+    assert not args.handoff_path, "--handoff-path needs the asyncio backend"
+    assert args.threads == 1, "--threads needs the asyncio backend"
+    server_sock = socket.create_server(("127.0.0.1", args.port), reuse_port=True)
+    print("Listening on port", args.port, "with selectors")
+    server_capture = create_capture(args)
+    server = create_server(
+        args,
+        server_sock,
+        ssl_context=create_ssl_context(args),
+        handler=handler,
+        capture=server_capture,
+        backend=selector.Server,
+    )
+    server.start()
+    loop = server.loop
 
-def parse_frame_body(client: models.Client) -> bytes | None:
-    assert client.last_header is not None
-    assert not client.last_header.failure
+    def sig_handler(signum, frame):
+        print("Exit signal")
+        server.stop()
 
-    length = client.last_header.length
-    if len(client.rest_data) < length:
-        return
-    frame, client.rest_data = client.rest_data[:length], client.rest_data[length:]
-    return frame
+    def profile_handler(signum, frame):
+        loop.call_soon_threadsafe(functools.partial(start_profile, args, loop))
 
+    signal.signal(signal.SIGINT, sig_handler)
+    signal.signal(signal.SIGTERM, sig_handler)
+    signal.signal(signal.SIGUSR1, profile_handler)
+    server.run()
+    server.shutdown(args.drain_timeout)
+    if server_capture is not None:
+        server_capture.close()
 
-def handle_client(client: models.Client) -> None:
-    assert not client.need_close
 
-    while True:
-        if client.phase == 0:
-            print("Client phase 0")
-            if len(client.rest_data) < len(CLIENT_PREFACE_PRI):
-                return
-            if not client.rest_data.startswith(CLIENT_PREFACE_PRI):
-                print("Not http/2 with prior knowledge")
-                client.need_close = True
-                return
-            client.rest_data = client.rest_data[len(CLIENT_PREFACE_PRI) :]
-            client.phase = 1
-            # TODO: schedule send settings to event_loop
-            client.send_data += frames.generate_empty_settings_frame(False)
-
-        if client.phase == 1:
-            print("Client phase 1")
-            header = parse_frame_header(client)
-            if header is None:
-                return
-            if header.failure:
-                print("Header failure")
-                client.need_close = True
-                return
-            client.last_header = header
-            client.phase = 2
-
-        if client.phase == 2:
-            # TODO:
-            #    An endpoint MUST send an error code of FRAME_SIZE_ERROR if a frame
-            #    exceeds the size defined in SETTINGS_MAX_FRAME_SIZE, exceeds any
-            #    A frame size error in a frame that could alter
-            #    the state of the entire connection MUST be treated as a connection
-            #    error (Section 5.4.1); this includes any frame carrying a header
-            #    block (Section 4.3) (that is, HEADERS, PUSH_PROMISE, and
-            #    CONTINUATION), SETTINGS, and any frame with a stream identifier of 0.
-
-            print("Client phase 2")
-            frame = parse_frame_body(client)
-            if frame is None:
-                return
-            header = client.last_header
-            client.last_header = None
+def start_profile(args: argparse.Namespace, loop: Any = None) -> None:
+    """Called in the event loop thread to be profiled."""
+    profiling.start(args.profile_dir, args.profile_seconds, args.profile_mode, loop)
 
-            if not client.settings_received:
-                if header.type != 0x4:
-                    print("First frame is not SETTINGS")
-                    client.need_close = True
-                    return
-                client.settings_received = True
 
-            parser = frames.FRAME_MAPPING.get(header.type, frames.parse_unknown)
-            parser(client, header, frame)
+def create_capture(args: argparse.Namespace) -> capture.Capture | None:
+    if not args.capture:
+        return None
+    print("Capturing", args.capture_rate, "of connections to", args.capture)
+    return capture.Capture(args.capture, rate=args.capture_rate)
 
-            client.phase = 1
-            continue
 
-        raise NotImplementedError
+def create_ssl_context(args: argparse.Namespace) -> ssl.SSLContext | None:
+    if not args.certfile:
+        return None
+    return tls.create_context(
+        args.certfile,
+        args.keyfile,
+        session_tickets=not args.no_session_tickets,
+    )
+
 
+def create_server(
+    args: argparse.Namespace,
+    sock: socket.socket,
+    *,
+    ssl_context: ssl.SSLContext | None,
+    handler: Callable[[models.Client, models.Stream], Any] | None,
+    capture: capture.Capture | None = None,
+    backend: type[aio.Server] | type[selector.Server] = aio.Server,
+) -> Any:
+    local_settings = models.Settings(
+        max_concurrent_streams=args.max_concurrent_streams,
+        initial_window_size=args.initial_window_size,
+    )
+    admission_controller = None
+    if args.shed_target_ms is not None:
+        # Per server: the delay it reacts to is that of its own event loop
+        admission_controller = admission.AdmissionController(
+            target=args.shed_target_ms / 1000, reject_status=args.shed_status
+        )
+    return backend(
+        sock,
+        handle_client,
+        local_settings=local_settings,
+        admission_controller=admission_controller,
+        ssl_context=ssl_context,
+        timeouts=timers.Timeouts(idle=args.idle_timeout, stream=args.stream_timeout),
+        handler=handler,
+        capture=capture,
+        window_update_policy=flow.POLICIES[args.window_update_policy],
+    )
 
-def main():
-    server_sock = socket.create_server(("127.0.0.1", 8000), reuse_port=True)
-    print("Listening on port 8000")
 
-    def sig_handler(sig, frame):
+def serve_threads(
+    args: argparse.Namespace,
+    handler_factory: Callable[[], Callable[[models.Client, models.Stream], Any]]
+    | None = None,
+) -> None:
+    """Run ``args.threads`` event loops, one per thread.
+
+    Each loop owns its connections, so models.Client and its HPACK state
+    never leave the thread; only metrics and the process-wide caches are
+    shared. Every loop accepts from its own SO_REUSEPORT socket, letting the
+    kernel spread connections, or with --shared-listener from one socket.
+    Handlers holding loop-bound state are created per loop by
+    ``handler_factory``.
+    """
+    # TODO: listener handoff between processes
+    assert not args.handoff_path, "--handoff-path is not supported with --threads"
+    ssl_context = create_ssl_context(args)
+    # One file for all loops
+    server_capture = create_capture(args)
+    shared = None
+    if args.shared_listener:
+        shared = socket.create_server(("127.0.0.1", args.port), reuse_port=True)
+    print("Listening on port", args.port, "with", args.threads, "threads")
+
+    stops: list[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+    stops_lock = threading.Lock()
+    started = threading.Barrier(args.threads + 1)
+
+    async def run_loop() -> None:
+        sock = shared
+        if sock is None:
+            sock = socket.create_server(("127.0.0.1", args.port), reuse_port=True)
+        handler = handler_factory() if handler_factory is not None else None
+        server = create_server(
+            args,
+            sock,
+            ssl_context=ssl_context,
+            handler=handler,
+            capture=server_capture,
+        )
+        await server.start()
+        stop = asyncio.Event()
+        with stops_lock:
+            stops.append((asyncio.get_running_loop(), stop))
+        started.wait()
+        await stop.wait()
+        await server.shutdown(args.drain_timeout)
+
+    workers = [
+        threading.Thread(target=asyncio.run, args=(run_loop(),), name=f"loop-{i}")
+        for i in range(args.threads)
+    ]
+    for worker in workers:
+        worker.start()
+    started.wait()
+
+    stopping = threading.Event()
+
+    def sig_handler(signum, frame):
         print("Exit signal")
-        nonlocal server_sock
-        server_sock.close()
+        stopping.set()
+
+    def profile_handler(signum, frame):
+        for loop, _ in stops:
+            loop.call_soon_threadsafe(start_profile, args)
 
     signal.signal(signal.SIGINT, sig_handler)
     signal.signal(signal.SIGTERM, sig_handler)
-
-    while True:
-        try:
-            client_sock, addr = server_sock.accept()
-        except OSError:
-            print("Server closed")
-            break
-        print("Client open")
-        client = models.Client()
-        while True:
-            try:
-                payload = client_sock.recv(4096)
-            except ConnectionError:
-                logging.exception("!")
-                break
-            if not payload:
-                break
-            client.rest_data += payload
-            handle_client(client)
-            if client.need_close:
-                print("Need close")
-                break
-
-            if client.send_data:
-                print("DEBUG: sending: ", client.send_data)
-                client_sock.sendall(client.send_data)
-                client.send_data = b""
-
-        if client.rest_data:
-            print("Unhandled data in client steam before close")
-        print("Client closed")
-        client_sock.close()
+    signal.signal(signal.SIGUSR1, profile_handler)
+    while not stopping.wait(1.0):
+        pass
+    for loop, stop in stops:
+        loop.call_soon_threadsafe(stop.set)
+    for worker in workers:
+        worker.join()
+    if server_capture is not None:
+        server_capture.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import threading
+import weakref
+from collections.abc import Callable
+
+
+@dataclasses.dataclass(kw_only=True, slots=True, frozen=True)
+class Timeouts:
+    """Seconds, None disables; shared by every connection of a server."""
+
+    # No frame received for this long
+    idle: float | None = 300.0
+    # Our SETTINGS not acknowledged (RFC 9113 6.5.3 SETTINGS_TIMEOUT)
+    settings_ack: float | None = 10.0
+    # A started frame (or the preface) not completed, e.g. half a header
+    frame: float | None = 10.0
+    # A request still waiting for its response headers
+    stream: float | None = 60.0
+
+
+DEFAULT_TIMEOUTS = Timeouts()
+
+
+class Timer:
+    __slots__ = ("wheel", "callback", "deadline", "queued", "generation", "active")
+
+    def __init__(self, wheel: TimerWheel, callback: Callable[[], None]):
+        self.wheel = wheel
+        self.callback = callback
+        # In ticks: when it fires, and the deadline its wheel entry was made for
+        self.deadline = 0
+        self.queued = 0
+        # Wheel entries of an older generation are stale
+        self.generation = 0
+        self.active = False
+
+    def reschedule(self, delay: float) -> None:
+        """Move the deadline to ``delay`` seconds from now.
+
+        Pushing it later, the common case of an idle timer reset on every
+        read, only stores the new deadline: the wheel entry is left where it
+        is and moves on when it comes up.
+        """
+        wheel = self.wheel
+        deadline = wheel.ticks(delay)
+        self.deadline = deadline
+        if self.active and deadline >= self.queued:
+            return
+        self.generation += 1
+        self.active = True
+        wheel.insert(self)
+
+    def cancel(self) -> None:
+        if self.active:
+            self.active = False
+            self.generation += 1
+
+
+class TimerWheel:
+    """Hashed hierarchical timing wheel.
+
+    Level 0 has a slot per tick, every further level a slot per turn of the
+    level below. Scheduling, rescheduling and cancelling are O(1); each
+    timer is cascaded at most once per level on its way down. One wheel
+    ticks for every connection of an event loop, see get_wheel.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        tick: float = 0.1,
+        sizes: tuple[int, ...] = (256, 64, 64),
+    ):
+        self.loop = loop
+        self.tick = tick
+        self.sizes = sizes
+        self.spans = []
+        span = 1
+        for size in sizes:
+            self.spans.append(span)
+            span *= size
+        self.levels: list[list[list[tuple[Timer, int]]]] = [
+            [[] for _ in range(size)] for size in sizes
+        ]
+        self.current = self.now()
+        self.entries = 0
+        self.handle: asyncio.TimerHandle | None = None
+
+    def now(self) -> int:
+        return int(self.loop.time() / self.tick)
+
+    def ticks(self, delay: float) -> int:
+        # Never in the current tick, it may have been processed already
+        return max(self.now() + max(1, round(delay / self.tick)), self.current + 1)
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+        timer = Timer(self, callback)
+        timer.reschedule(delay)
+        return timer
+
+    def insert(self, timer: Timer) -> None:
+        if not self.entries:
+            # Idle wheels do not tick, skip the time they spent empty instead
+            # of catching up on it one tick at a time
+            self.current = max(self.current, self.now())
+        timer.queued = timer.deadline
+        delta = timer.deadline - self.current
+        last = len(self.sizes) - 1
+        for level, size in enumerate(self.sizes):
+            span = self.spans[level]
+            if delta < size * span or level == last:
+                # Beyond the last level: parked in its furthest slot, it is
+                # cascaded again until the deadline is in range
+                deadline = min(timer.deadline, self.current + (size - 1) * span)
+                slot = self.levels[level][deadline // span % size]
+                slot.append((timer, timer.generation))
+                break
+        self.entries += 1
+        if self.handle is None:
+            self.handle = self.loop.call_at(
+                (self.current + 1) * self.tick, self.advance
+            )
+
+    def advance(self) -> None:
+        self.handle = None
+        now = self.now()
+        while self.current < now and self.entries:
+            self.current += 1
+            current = self.current
+            # Cascade higher levels whose slot turn starts now
+            for level in range(1, len(self.sizes)):
+                span = self.spans[level]
+                if current % span:
+                    break
+                self.reinsert(self.levels[level], current // span % self.sizes[level])
+            self.expire(current % self.sizes[0])
+        if self.current < now:
+            self.current = now
+        if self.entries and self.handle is None:
+            self.handle = self.loop.call_at(
+                (self.current + 1) * self.tick, self.advance
+            )
+
+    def reinsert(self, slots: list[list[tuple[Timer, int]]], index: int) -> None:
+        entries = slots[index]
+        slots[index] = []
+        self.entries -= len(entries)
+        for timer, generation in entries:
+            if timer.active and generation == timer.generation:
+                self.insert(timer)
+
+    def expire(self, index: int) -> None:
+        slots = self.levels[0]
+        entries = slots[index]
+        slots[index] = []
+        self.entries -= len(entries)
+        for timer, generation in entries:
+            if not timer.active or generation != timer.generation:
+                continue
+            if timer.deadline > self.current:
+                # Rescheduled later since the entry was made
+                self.insert(timer)
+                continue
+            timer.active = False
+            timer.callback()
+
+
+_wheels: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, TimerWheel
+] = weakref.WeakKeyDictionary()
+_wheels_lock = threading.Lock()
+
+
+def get_wheel() -> TimerWheel:
+    """The timer wheel of the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _wheels_lock:
+        wheel = _wheels.get(loop)
+        if wheel is None:
+            wheel = _wheels[loop] = TimerWheel(loop)
+        return wheel
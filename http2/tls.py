@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import ssl
+
+ALPN_PROTOCOL = "h2"
+
+# RFC 9113 9.2.2: TLS 1.2 deployments MUST NOT use the cipher suites of the
+# block list; AEAD with ephemeral key exchange only.
+TLS12_CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20"
+
+
+def create_context(
+    certfile: str,
+    keyfile: str | None = None,
+    *,
+    session_tickets: bool = True,
+    num_tickets: int = 2,
+) -> ssl.SSLContext:
+    """Server context negotiating h2 via ALPN, with session resumption.
+
+    Repeat clients resume with a session ticket (stateless, TLS 1.2 and 1.3)
+    or, with tickets disabled, from OpenSSL's server-side session cache (by
+    session id in TLS 1.2, by a stateful ticket in TLS 1.3),
+    skipping the certificate exchange and the key agreement signature.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS12_CIPHERS)
+    context.load_cert_chain(certfile, keyfile)
+    context.set_alpn_protocols([ALPN_PROTOCOL])
+    # RFC 9113 9.2.1: compression and renegotiation MUST be disabled
+    context.options |= ssl.OP_NO_COMPRESSION
+    context.options |= ssl.OP_NO_RENEGOTIATION
+    # TLS 1.3 tickets sent after the handshake. With OP_NO_TICKET they are
+    # stateful, only an id into the session cache; TLS 1.2 clients resume
+    # by session id from the same cache.
+    context.num_tickets = num_tickets
+    if not session_tickets:
+        context.options |= ssl.OP_NO_TICKET
+    return context
+
+
+def negotiated_h2(ssl_object: ssl.SSLObject | ssl.SSLSocket) -> bool:
+    protocol = ssl_object.selected_alpn_protocol()
+    if protocol != ALPN_PROTOCOL:
+        print("ALPN did not negotiate h2:", protocol)
+        return False
+    return True
+
+
+def report(context: ssl.SSLContext) -> None:
+    stats = context.session_stats()
+    print(
+        "TLS sessions",
+        {key: stats[key] for key in ("accept", "hits", "misses", "timeouts")},
+    )
@@ -0,0 +1,443 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import ssl
+import struct
+from collections.abc import Iterable
+
+from http2 import body
+from http2 import flow
+from http2 import frames
+from http2 import hpack
+from http2 import models
+from http2 import server
+
+# Streams per connection when the upstream does not announce a limit
+DEFAULT_MAX_CONCURRENT_STREAMS = 100
+
+# Our receive windows towards the upstream; a response buffers at most
+# the stream window while the downstream client is slow
+LOCAL_SETTINGS = models.Settings(enable_push=0, initial_window_size=256 * 1024)
+CONNECTION_WINDOW = 4 * 1024 * 1024
+
+
+class UpstreamError(Exception):
+    """The upstream reset the stream or the connection went away."""
+
+
+class UpstreamStream:
+    """One request to the upstream.
+
+    The response body is a body.RequestBody: the stream window is credited
+    back to the upstream only as DATA is taken, which bridges flow control
+    to whoever forwards it. The connection window is credited on arrival,
+    so a slow downstream client holds up only its own stream.
+    """
+
+    __slots__ = (
+        "conn",
+        "identifier",
+        "flow_control",
+        "window_waiter",
+        "response",
+        "body",
+        "trailers",
+        "local_ended",
+        "closed",
+    )
+
+    def __init__(self, conn: UpstreamConnection, identifier: int):
+        self.conn = conn
+        self.identifier = identifier
+        self.flow_control = conn.remote_settings.initial_window_size
+        self.window_waiter: asyncio.Future | None = None
+        self.response: asyncio.Future[hpack.HeaderList] = conn.loop.create_future()
+        self.body = body.RequestBody(self.release)
+        self.trailers: hpack.HeaderList | None = None
+        self.local_ended = False
+        self.closed = False
+
+    def release(self, size: int) -> None:
+        self.conn.write(self.conn.consume_stream(self.identifier, size))
+
+    async def write(self, data: bytes | memoryview, end_stream: bool = False) -> None:
+        """Send request DATA, waiting for upstream flow-control credit."""
+        conn = self.conn
+        data = memoryview(data)
+        if not data and not end_stream:
+            # An empty DATA frame without END_STREAM says nothing
+            return
+        while True:
+            if self.closed:
+                raise UpstreamError("stream closed")
+            size = min(
+                len(data),
+                self.flow_control,
+                conn.flow_control,
+                conn.remote_settings.max_frame_size,
+            )
+            if size > 0 or not data:
+                end = end_stream and size == len(data)
+                conn.write(frames.generate_data(self.identifier, data[:size], end))
+                self.flow_control -= size
+                conn.flow_control -= size
+                data = data[size:]
+                if not data:
+                    self.local_ended = end
+                    return
+                continue
+            self.window_waiter = conn.loop.create_future()
+            await self.window_waiter
+
+    def wake(self) -> None:
+        if self.window_waiter is not None and not self.window_waiter.done():
+            self.window_waiter.set_result(None)
+        self.window_waiter = None
+
+    def reset(self, error_code: int = 0x8) -> None:
+        """Cancel the request, CANCEL by default."""
+        if self.closed:
+            return
+        self.conn.write(frames.generate_rst_stream(self.identifier, error_code))
+        self.conn.close_stream(self, UpstreamError("cancelled"))
+
+
+class UpstreamConnection(asyncio.Protocol):
+    """Client side of one long-lived HTTP/2 connection to an upstream.
+
+    Requests are multiplexed as streams; the response header blocks of all
+    of them go through the one HPACK decoder of the connection, so its
+    dynamic table keeps saving bytes across requests.
+    """
+
+    def __init__(self, pool: UpstreamPool):
+        self.pool = pool
+        self.loop = asyncio.get_running_loop()
+        self.transport: asyncio.Transport | None = None
+        self.buffer = b""
+        self.decoder = hpack.HPack(max_table_size=LOCAL_SETTINGS.header_table_size)
+        self.remote_settings = models.DEFAULT_SETTINGS
+        self.ready: asyncio.Future[None] = self.loop.create_future()
+        self.streams: dict[int, UpstreamStream] = {}
+        self.next_stream_id = 1
+        # Send side connection window, and what we consumed but not credited
+        self.flow_control = frames.CONNECTION_WINDOW_SIZE
+        self.recv_consumed = 0
+        self.stream_consumed: dict[int, int] = {}
+        self.goaway = False
+        self.closed = False
+
+    @property
+    def max_concurrent_streams(self) -> int:
+        limit = self.remote_settings.max_concurrent_streams
+        return DEFAULT_MAX_CONCURRENT_STREAMS if limit is None else limit
+
+    def available(self) -> bool:
+        return (
+            self.ready.done()
+            and not self.goaway
+            and not self.closed
+            and len(self.streams) < self.max_concurrent_streams
+            and self.next_stream_id < 2**31
+        )
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.write(
+            server.CLIENT_PREFACE_PRI
+            + frames.generate_settings_frame(LOCAL_SETTINGS)
+            + frames.generate_window_update(
+                0, CONNECTION_WINDOW - frames.CONNECTION_WINDOW_SIZE
+            )
+        )
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.closed = True
+        error = UpstreamError(f"upstream connection lost: {exc}")
+        if not self.ready.done():
+            self.ready.set_exception(error)
+        for stream in list(self.streams.values()):
+            self.close_stream(stream, error)
+        self.pool.connection_closed(self)
+
+    def write(self, data: bytes) -> None:
+        assert self.transport is not None
+        if data and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def open_stream(
+        self, headers: Iterable[tuple[str, str]], end_stream: bool
+    ) -> UpstreamStream:
+        stream = UpstreamStream(self, self.next_stream_id)
+        self.next_stream_id += 2
+        self.streams[stream.identifier] = stream
+        block = hpack.encode(headers)
+        self.write(frames.generate_headers(stream.identifier, block, end_stream))
+        stream.local_ended = end_stream
+        return stream
+
+    def close_stream(
+        self, stream: UpstreamStream, error: Exception | None = None
+    ) -> None:
+        if stream.closed:
+            return
+        stream.closed = True
+        self.streams.pop(stream.identifier, None)
+        self.stream_consumed.pop(stream.identifier, None)
+        if error is not None:
+            if not stream.response.done():
+                stream.response.set_exception(error)
+            stream.body.abort()
+        stream.wake()
+        self.pool.stream_closed()
+
+    def consume(self, stream_id: int, size: int) -> None:
+        """``size`` response bytes need no forwarding, credit them upstream."""
+        self.write(self.consume_connection(size) + self.consume_stream(stream_id, size))
+
+    def consume_connection(self, size: int) -> bytes:
+        """The WINDOW_UPDATE to send for ``size`` received bytes, if any."""
+        self.recv_consumed += size
+        incr = flow.DEFAULT_POLICY.increment(self.recv_consumed, CONNECTION_WINDOW)
+        if not incr:
+            return b""
+        self.recv_consumed -= incr
+        return frames.generate_window_update(0, incr)
+
+    def consume_stream(self, stream_id: int, size: int) -> bytes:
+        """The WINDOW_UPDATE to send for ``size`` forwarded bytes, if any."""
+        if stream_id not in self.stream_consumed:
+            return b""
+        consumed = self.stream_consumed[stream_id] + size
+        incr = flow.DEFAULT_POLICY.increment(
+            consumed, LOCAL_SETTINGS.initial_window_size
+        )
+        if incr:
+            consumed -= incr
+        self.stream_consumed[stream_id] = consumed
+        if not incr:
+            return b""
+        return frames.generate_window_update(stream_id, incr)
+
+    def data_received(self, data: bytes) -> None:
+        self.buffer += data
+        batch, consumed, failure = server.extract_frames(
+            self.buffer, LOCAL_SETTINGS.max_frame_size
+        )
+        buffer = memoryview(self.buffer)
+        for header in batch:
+            frame = buffer[header.offset : header.offset + header.length]
+            parse = FRAME_MAPPING.get(header.type)
+            if parse is not None:
+                parse(self, header, frame)
+            if self.closed:
+                return
+        self.buffer = self.buffer[consumed:]
+        if failure:
+            self.fail("invalid frame")
+
+    def fail(self, reason: str) -> None:
+        print("Upstream connection error:", reason)
+        assert self.transport is not None
+        self.write(frames.generate_goaway(0, 0x1))
+        self.transport.close()
+        self.closed = True
+
+    def parse_settings(self, header: models.FrameHeader, frame: memoryview) -> None:
+        if header.flags & 0x1:
+            return
+        settings = {}
+        for identifier, value in struct.iter_unpack(
+            frames.SETTINGS_FRAME_FORMAT, frame
+        ):
+            name = models.SETTING_MAPPING.get(identifier)
+            if name is not None:
+                settings[name] = value
+        if "initial_window_size" in settings:
+            delta = (
+                settings["initial_window_size"]
+                - self.remote_settings.initial_window_size
+            )
+            for stream in self.streams.values():
+                stream.flow_control += delta
+                stream.wake()
+        self.remote_settings = dataclasses.replace(self.remote_settings, **settings)
+        self.write(frames.generate_empty_settings_frame(ack=True))
+        if not self.ready.done():
+            self.ready.set_result(None)
+        # A raised limit may unblock requests waiting for a connection
+        self.pool.stream_closed()
+
+    def parse_window_update(
+        self, header: models.FrameHeader, frame: memoryview
+    ) -> None:
+        incr = int.from_bytes(frame, "big") & 0x7FFFFFFF
+        if header.stream_id == 0:
+            self.flow_control += incr
+            for stream in self.streams.values():
+                stream.wake()
+            return
+        stream = self.streams.get(header.stream_id)
+        if stream is not None:
+            stream.flow_control += incr
+            stream.wake()
+
+    def parse_headers(self, header: models.FrameHeader, frame: memoryview) -> None:
+        # TODO: CONTINUATION, padding and priority, as on the server side
+        if not header.flags & 0x4 or header.flags & 0x28:
+            self.fail("unsupported header block")
+            return
+        success, headers = self.decoder.decode(frame)
+        if not success:
+            self.fail("header block decode error")
+            return
+        stream = self.streams.get(header.stream_id)
+        if stream is None:
+            return
+        assert isinstance(headers, hpack.HeaderList)
+        if not stream.response.done():
+            if headers.get(":status", "").startswith("1"):
+                # Interim response, the final one follows
+                return
+            stream.response.set_result(headers)
+            self.stream_consumed[stream.identifier] = 0
+        else:
+            stream.trailers = headers
+        if header.flags & 0x1:
+            self.end_remote(stream)
+
+    def parse_data(self, header: models.FrameHeader, frame: memoryview) -> None:
+        data = frame
+        if header.flags & 0x8:
+            if not frame or frame[0] >= len(frame):
+                self.fail("invalid padding")
+                return
+            data = frame[1 : len(frame) - frame[0]]
+        stream = self.streams.get(header.stream_id)
+        padding = header.length - len(data)
+        if stream is None or not stream.response.done():
+            self.consume(header.stream_id, header.length)
+            return
+        # Buffering is bounded by the stream window, the connection's is
+        # handed back right away
+        update = self.consume_connection(header.length)
+        if padding:
+            update += self.consume_stream(header.stream_id, padding)
+        self.write(update)
+        stream.body.feed(data)
+        if header.flags & 0x1:
+            self.end_remote(stream)
+
+    def end_remote(self, stream: UpstreamStream) -> None:
+        if not stream.local_ended:
+            # Response complete before the request body, stop sending it
+            self.write(frames.generate_rst_stream(stream.identifier, 0x8))
+        stream.body.end()
+        if not stream.response.done():
+            stream.response.set_exception(UpstreamError("no response headers"))
+        self.close_stream(stream)
+
+    def parse_rst_stream(self, header: models.FrameHeader, frame: memoryview) -> None:
+        stream = self.streams.get(header.stream_id)
+        if stream is not None:
+            error_code = int.from_bytes(frame, "big")
+            self.close_stream(stream, UpstreamError(f"RST_STREAM {error_code}"))
+
+    def parse_ping(self, header: models.FrameHeader, frame: memoryview) -> None:
+        if not header.flags & 0x1:
+            self.write(frames.generate_ping(frame, ack=True))
+
+    def parse_goaway(self, header: models.FrameHeader, frame: memoryview) -> None:
+        self.goaway = True
+        last_stream_id = int.from_bytes(frame[:4], "big") & 0x7FFFFFFF
+        for stream in list(self.streams.values()):
+            if stream.identifier > last_stream_id:
+                # Not processed, safe to retry on another connection
+                self.close_stream(stream, UpstreamError("GOAWAY"))
+        self.pool.connection_closed(self)
+
+
+FRAME_MAPPING = {
+    0x0: UpstreamConnection.parse_data,
+    0x1: UpstreamConnection.parse_headers,
+    0x3: UpstreamConnection.parse_rst_stream,
+    0x4: UpstreamConnection.parse_settings,
+    0x6: UpstreamConnection.parse_ping,
+    0x7: UpstreamConnection.parse_goaway,
+    0x8: UpstreamConnection.parse_window_update,
+}
+
+
+class UpstreamPool:
+    """Long-lived connections to one upstream, shared by every request.
+
+    A new connection is only opened once each existing one carries as many
+    streams as the upstream's SETTINGS_MAX_CONCURRENT_STREAMS allows.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        max_connections: int = 4,
+        ssl_context: ssl.SSLContext | None = None,
+    ):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.ssl_context = ssl_context
+        self.connections: list[UpstreamConnection] = []
+        # The connection being opened, shared by whoever needs one meanwhile
+        self.connecting: asyncio.Task[None] | None = None
+        self.waiters: list[asyncio.Future] = []
+
+    async def open_stream(
+        self, headers: Iterable[tuple[str, str]], end_stream: bool
+    ) -> UpstreamStream:
+        while True:
+            for conn in self.connections:
+                if conn.available():
+                    return conn.open_stream(headers, end_stream)
+            if self.connecting is None and len(self.connections) < self.max_connections:
+                self.connecting = asyncio.get_running_loop().create_task(self.connect())
+            if self.connecting is not None:
+                # Its streams are for everybody waiting, it may fail for all
+                await asyncio.shield(self.connecting)
+                continue
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            await waiter
+
+    async def connect(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            _, conn = await loop.create_connection(
+                lambda: UpstreamConnection(self),
+                self.host,
+                self.port,
+                ssl=self.ssl_context,
+                server_hostname=self.host if self.ssl_context else None,
+            )
+            await conn.ready
+        finally:
+            self.connecting = None
+        print("Upstream connection open", self.host, self.port)
+        self.connections.append(conn)
+
+    def stream_closed(self) -> None:
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def connection_closed(self, conn: UpstreamConnection) -> None:
+        if conn in self.connections:
+            self.connections.remove(conn)
+        self.stream_closed()
+
+    def close(self) -> None:
+        for conn in list(self.connections):
+            if conn.transport is not None:
+                conn.transport.close()
@@ -0,0 +1,405 @@
+"""WebSockets over HTTP/2 (RFC 8441).
+
+The client opens a stream with an extended CONNECT (``:protocol:
+websocket``) and both sides exchange RFC 6455 frames in the stream's
+DATA. Every WebSocket is one stream, so many of them share a connection,
+each with its own flow control. The server has to advertise
+SETTINGS_ENABLE_CONNECT_PROTOCOL:
+
+    router = websocket.Router()
+
+    @router.route("/echo")
+    async def echo(ws):
+        async for message in ws:
+            await ws.send(message)
+
+    aio.Server(
+        sock,
+        server.handle_client,
+        local_settings=models.Settings(enable_connect_protocol=1),
+        handler=router,
+    )
+"""
+from __future__ import annotations
+
+import enum
+import struct
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Coroutine
+from collections.abc import Iterable
+from typing import Any
+
+from http2 import body
+from http2 import frames
+from http2 import handlers
+from http2 import models
+
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+# Queued but not yet sent bytes before ``send`` waits for the peer
+SEND_HIGH_WATER = 64 * 1024
+
+
+class Opcode(enum.IntEnum):
+    CONTINUATION = 0x0
+    TEXT = 0x1
+    BINARY = 0x2
+    CLOSE = 0x8
+    PING = 0x9
+    PONG = 0xA
+
+
+class CloseCode(enum.IntEnum):
+    NORMAL = 1000
+    GOING_AWAY = 1001
+    PROTOCOL_ERROR = 1002
+    # Not sent, reported when the stream ends without a close frame
+    ABNORMAL = 1006
+    INVALID_DATA = 1007
+    MESSAGE_TOO_BIG = 1009
+    INTERNAL_ERROR = 1011
+
+
+def valid_close_code(code: int) -> bool:
+    """Whether a close frame may carry ``code`` (RFC 6455 7.4).
+
+    1004 is reserved, 1005, 1006 and 1015 only stand for missing or failed
+    closes locally, 1016-2999 are left to future extensions.
+    """
+    return 1000 <= code <= 1003 or 1007 <= code <= 1014 or 3000 <= code <= 4999
+
+
+class ConnectionClosed(Exception):
+    def __init__(self, code: int, reason: str = ""):
+        super().__init__(code, reason)
+        self.code = code
+        self.reason = reason
+
+
+class ProtocolError(Exception):
+    """The peer broke RFC 6455, the WebSocket is closed with ``code``."""
+
+    def __init__(self, code: int, reason: str):
+        super().__init__(code, reason)
+        self.code = code
+        self.reason = reason
+
+
+def unmask(data: bytes | memoryview, key: bytes) -> bytes:
+    size = len(data)
+    if not size:
+        return b""
+    # XOR of two big integers runs in C, much faster than a loop over bytes
+    mask = (key * (size // 4 + 1))[:size]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(mask, "big")).to_bytes(
+        size, "big"
+    )
+
+
+def encode_frame(opcode: int, payload: bytes, fin: bool = True) -> bytes:
+    """A server frame: never masked."""
+    first = (0x80 if fin else 0) | opcode
+    size = len(payload)
+    if size < 126:
+        header = bytes([first, size])
+    elif size < 2**16:
+        header = struct.pack(">BBH", first, 126, size)
+    else:
+        header = struct.pack(">BBQ", first, 127, size)
+    return header + payload
+
+
+def encode_close(code: int, reason: str = "") -> bytes:
+    return encode_frame(Opcode.CLOSE, struct.pack(">H", code) + reason.encode())
+
+
+class FrameParser:
+    """Splits DATA chunks into (fin, opcode, unmasked payload) frames."""
+
+    __slots__ = ("pending", "max_size")
+
+    def __init__(self, max_size: int = MAX_MESSAGE_SIZE):
+        # Appended to in place, a large frame arriving in many chunks is not
+        # copied again for each of them
+        self.pending = bytearray()
+        self.max_size = max_size
+
+    def feed(self, chunk: bytes | memoryview) -> list[tuple[bool, int, bytes]]:
+        data = self.pending
+        data += chunk
+        res = []
+        offset = 0
+        while len(data) - offset >= 2:
+            first, second = data[offset], data[offset + 1]
+            if first & 0x70:
+                raise ProtocolError(CloseCode.PROTOCOL_ERROR, "reserved bits set")
+            if not second & 0x80:
+                raise ProtocolError(CloseCode.PROTOCOL_ERROR, "unmasked frame")
+            size = second & 0x7F
+            start = offset + 2
+            if size == 126:
+                if len(data) - start < 2:
+                    break
+                size = int.from_bytes(data[start : start + 2], "big")
+                start += 2
+            elif size == 127:
+                if len(data) - start < 8:
+                    break
+                size = int.from_bytes(data[start : start + 8], "big")
+                start += 8
+            if size > self.max_size:
+                raise ProtocolError(CloseCode.MESSAGE_TOO_BIG, "frame too big")
+            end = start + 4 + size
+            if len(data) < end:
+                break
+            key = bytes(data[start : start + 4])
+            with memoryview(data) as view:
+                payload = unmask(view[start + 4 : end], key)
+            res.append((bool(first & 0x80), first & 0x0F, payload))
+            offset = end
+        # Cheap, bytearray drops a prefix by moving its start
+        del data[:offset]
+        return res
+
+
+class WebSocket:
+    """One accepted WebSocket: iterate it for messages, ``send`` replies.
+
+    Text messages come as str, binary ones as bytes. Pings are answered
+    while iterating; a close frame from the peer is answered and ends the
+    iteration.
+    """
+
+    __slots__ = (
+        "client",
+        "stream",
+        "parser",
+        "subprotocol",
+        "close_code",
+        "close_sent",
+    )
+
+    def __init__(
+        self,
+        client: models.Client,
+        stream: models.Stream,
+        subprotocol: str | None = None,
+    ):
+        self.client = client
+        self.stream = stream
+        self.parser = FrameParser()
+        self.subprotocol = subprotocol
+        # Set once the peer's close frame arrived (or the stream ended)
+        self.close_code: int | None = None
+        self.close_sent = False
+
+    @property
+    def path(self) -> str | None:
+        assert self.stream.headers is not None
+        return self.stream.headers.path
+
+    @property
+    def headers(self):
+        return self.stream.headers
+
+    async def __aiter__(self) -> AsyncIterator[str | bytes]:
+        request = self.stream.body
+        if request is None:
+            return
+        fragments: list[bytes] = []
+        opcode = 0
+        try:
+            async for chunk in request:
+                for fin, frame_opcode, payload in self.parser.feed(chunk):
+                    if frame_opcode >= Opcode.CLOSE:
+                        if not fin:
+                            raise ProtocolError(
+                                CloseCode.PROTOCOL_ERROR, "fragmented control frame"
+                            )
+                        if await self.control(frame_opcode, payload):
+                            return
+                        continue
+                    if frame_opcode > Opcode.BINARY:
+                        raise ProtocolError(
+                            CloseCode.PROTOCOL_ERROR, f"reserved opcode {frame_opcode}"
+                        )
+                    if frame_opcode == Opcode.CONTINUATION:
+                        if not fragments:
+                            raise ProtocolError(
+                                CloseCode.PROTOCOL_ERROR, "unexpected continuation"
+                            )
+                    elif fragments:
+                        raise ProtocolError(
+                            CloseCode.PROTOCOL_ERROR, "expected continuation"
+                        )
+                    else:
+                        opcode = frame_opcode
+                    fragments.append(payload)
+                    if sum(len(fragment) for fragment in fragments) > (
+                        self.parser.max_size
+                    ):
+                        raise ProtocolError(
+                            CloseCode.MESSAGE_TOO_BIG, "message too big"
+                        )
+                    if not fin:
+                        continue
+                    message = b"".join(fragments) if len(fragments) > 1 else payload
+                    fragments = []
+                    if opcode == Opcode.TEXT:
+                        try:
+                            yield message.decode()
+                        except UnicodeDecodeError:
+                            raise ProtocolError(
+                                CloseCode.INVALID_DATA, "text is not UTF-8"
+                            ) from None
+                    else:
+                        yield message
+        except body.StreamReset:
+            self.close_code = CloseCode.ABNORMAL
+            return
+        except ProtocolError as e:
+            print("WebSocket protocol error", self.stream.identifier, e.reason)
+            self.close_code = e.code
+            await self.close(e.code, e.reason)
+            return
+        # END_STREAM without a close frame
+        self.close_code = CloseCode.ABNORMAL
+        self.end()
+
+    async def control(self, opcode: int, payload: bytes) -> bool:
+        """Handle a control frame, True when it closed the WebSocket."""
+        if len(payload) > 125:
+            raise ProtocolError(CloseCode.PROTOCOL_ERROR, "control frame too big")
+        if opcode == Opcode.PING:
+            await self.write(encode_frame(Opcode.PONG, payload))
+            return False
+        if opcode == Opcode.PONG:
+            return False
+        if opcode != Opcode.CLOSE:
+            raise ProtocolError(CloseCode.PROTOCOL_ERROR, f"unknown opcode {opcode}")
+        if len(payload) == 1:
+            raise ProtocolError(CloseCode.PROTOCOL_ERROR, "close payload of 1 byte")
+        code = CloseCode.NORMAL
+        if len(payload) >= 2:
+            code = int.from_bytes(payload[:2], "big")
+            if not valid_close_code(code):
+                raise ProtocolError(CloseCode.PROTOCOL_ERROR, f"close code {code}")
+        self.close_code = code
+        await self.close(code)
+        return True
+
+    async def write(self, data: bytes) -> None:
+        stream = self.stream
+        if stream.state == models.StreamState.closed or self.close_sent:
+            raise ConnectionClosed(self.close_code or CloseCode.ABNORMAL)
+        frames.send_data(self.client, stream, data, end_stream=False)
+        if frames.queued(stream) > SEND_HIGH_WATER:
+            await handlers.drain(stream)
+
+    async def send(self, message: str | bytes | memoryview) -> None:
+        if isinstance(message, str):
+            await self.write(encode_frame(Opcode.TEXT, message.encode()))
+        else:
+            await self.write(encode_frame(Opcode.BINARY, bytes(message)))
+
+    async def ping(self, payload: bytes = b"") -> None:
+        await self.write(encode_frame(Opcode.PING, payload))
+
+    async def close(self, code: int = CloseCode.NORMAL, reason: str = "") -> None:
+        """Send a close frame and end the stream.
+
+        HTTP/2 ends the stream in both directions, so unlike over TCP there
+        is no waiting for the peer's close frame.
+        """
+        if self.close_sent or self.stream.state == models.StreamState.closed:
+            return
+        self.close_sent = True
+        if code == CloseCode.ABNORMAL:
+            # May not be sent on the wire
+            code = CloseCode.NORMAL
+        frames.send_data(
+            self.client, self.stream, encode_close(code, reason), end_stream=True
+        )
+        if self.stream.body is not None:
+            # Whatever the peer still sends is of no interest
+            self.stream.body.discard()
+
+    def end(self) -> None:
+        if self.close_sent or self.stream.state == models.StreamState.closed:
+            return
+        self.close_sent = True
+        frames.send_data(self.client, self.stream, b"", end_stream=True)
+
+
+App = Callable[[WebSocket], Awaitable[None]]
+
+
+class Router:
+    """Accepts WebSockets by path, usable as ``Client.handler``."""
+
+    def __init__(self, subprotocols: Iterable[str] = ()):
+        self.routes: dict[str, App] = {}
+        # In order of preference
+        self.subprotocols = tuple(subprotocols)
+
+    def route(self, path: str) -> Callable[[App], App]:
+        def decorator(app: App) -> App:
+            self.routes[path] = app
+            return app
+
+        return decorator
+
+    def __call__(
+        self, client: models.Client, stream: models.Stream
+    ) -> Coroutine[Any, Any, None] | None:
+        headers = stream.headers
+        assert headers is not None
+        protocol = headers.get(":protocol")
+        if protocol is not None and not client.local_settings.enable_connect_protocol:
+            # Malformed without SETTINGS_ENABLE_CONNECT_PROTOCOL: PROTOCOL_ERROR
+            client.send_data += frames.generate_rst_stream(stream.identifier, 0x1)
+            frames.close_stream(client, stream)
+            return None
+        if headers.method != "CONNECT" or protocol != "websocket":
+            handlers.send_headers(client, stream, [(":status", "400")], True)
+            return None
+        app = self.routes.get(headers.path or "")
+        if app is None:
+            handlers.send_headers(client, stream, [(":status", "404")], True)
+            return None
+        if headers.get("sec-websocket-version") != "13":
+            handlers.send_headers(
+                client,
+                stream,
+                [(":status", "400"), ("sec-websocket-version", "13")],
+                True,
+            )
+            return None
+
+        response = [(":status", "200")]
+        subprotocol = self.negotiate(headers.get("sec-websocket-protocol"))
+        if subprotocol is not None:
+            response.append(("sec-websocket-protocol", subprotocol))
+        handlers.send_headers(client, stream, response)
+        return self.run(app, WebSocket(client, stream, subprotocol))
+
+    def negotiate(self, offered: str | None) -> str | None:
+        if not offered:
+            return None
+        names = {name.strip() for name in offered.split(",")}
+        for subprotocol in self.subprotocols:
+            if subprotocol in names:
+                return subprotocol
+        return None
+
+    async def run(self, app: App, ws: WebSocket) -> None:
+        try:
+            await app(ws)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            print("WebSocket app failed", ws.path, repr(e))
+            await ws.close(CloseCode.INTERNAL_ERROR)
+        else:
+            await ws.close()